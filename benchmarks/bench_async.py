@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""Concurrent provenance throughput benchmark for Smart Containers.
+
+Runs label reads and provenance archive copies against a local fake docker
+daemon that answers on a unix socket after a fixed latency, first one at a
+time with a scClient and then through an AsyncClient at increasing
+concurrency. No docker daemon is needed.
+
+Usage:
+    python benchmarks/bench_async.py [operations] [latency_ms]
+"""
+import BaseHTTPServer
+import SocketServer
+import base64
+import io
+import json
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+
+from sc import asyncClient, client
+
+API_VERSION = "1.21"
+LABEL = json.dumps({"@context": {"prov": "http://www.w3.org/ns/prov#"},
+                    "@graph": [{"@id": "urn:uuid:bench",
+                                "@type": "prov:Entity"}]})
+PROVDATA = LABEL * 20
+
+
+def archive(filename, data):
+    """Tar archive holding one file."""
+    f = io.BytesIO()
+    tar = tarfile.open(mode='w', fileobj=f)
+    member = tarfile.TarInfo(name=filename)
+    member.size = len(data)
+    tar.addfile(member, io.BytesIO(data))
+    tar.close()
+    return f.getvalue()
+
+
+class FakeDaemonHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Answers the docker API calls used by the benchmark."""
+
+    protocol_version = 'HTTP/1.1'
+    latency = 0.01
+    archive = archive('SCProv.jsonld', PROVDATA)
+    stat = base64.b64encode(json.dumps(
+        {"name": "SCProv.jsonld", "size": len(PROVDATA), "mode": 420}))
+
+    def reply(self, body='', headers=None, send_body=True):
+        time.sleep(self.latency)
+        self.send_response(200)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def do_GET(self):
+        if '/archive' in self.path:
+            self.reply(self.archive, {
+                'Content-Type': 'application/x-tar',
+                'X-Docker-Container-Path-Stat': self.stat})
+        else:
+            self.reply(json.dumps({
+                "Id": "sha256:" + "0" * 64,
+                "ContainerConfig": {"Labels": {}},
+                "Config": {"Labels": {"smartcontainer": LABEL}}}),
+                {'Content-Type': 'application/json'})
+
+    def do_HEAD(self):
+        self.reply('', {'X-Docker-Container-Path-Stat': self.stat}, False)
+
+    def do_PUT(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.reply()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeDaemon(SocketServer.ThreadingMixIn,
+                 SocketServer.UnixStreamServer):
+    """Threaded HTTP server on a unix socket."""
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, path):
+        SocketServer.UnixStreamServer.__init__(self, path, FakeDaemonHandler)
+        # BaseHTTPRequestHandler expects a host name for the server.
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+
+def operation(index):
+    """One provenance operation, cycling through the benchmarked calls.
+
+    Returns:
+        (name, args): scClient method name and arguments.
+
+    """
+    container = "bench%d" % index
+    kind = index % 3
+    if kind == 0:
+        return 'get_label_image', (container,)
+    if kind == 1:
+        return 'bufferCopyOut', (container, 'SCProv.jsonld',
+                                 '/SmartContainer/')
+    return 'bufferCopyIn', (container, PROVDATA, 'SCProv.jsonld',
+                            '/SmartContainer/')
+
+
+def main(operations=600, latency_ms=10):
+    FakeDaemonHandler.latency = latency_ms / 1000.0
+    directory = tempfile.mkdtemp()
+    socket_path = os.path.join(directory, 'docker.sock')
+    daemon = FakeDaemon(socket_path)
+    thread = threading.Thread(target=daemon.serve_forever)
+    thread.daemon = True
+    thread.start()
+    base_url = "unix://" + socket_path
+    try:
+        myclient = client.scClient(base_url=base_url, version=API_VERSION)
+        start = time.time()
+        for index in range(operations):
+            name, args = operation(index)
+            getattr(myclient, name)(*args)
+        elapsed = time.time() - start
+        print("%-24s %8.1f ops/s" % ("scClient, serial",
+                                     operations / elapsed))
+        for workers in (10, 50, 100, 200):
+            pool = asyncClient.AsyncClient(base_url=base_url,
+                                           workers=workers,
+                                           version=API_VERSION)
+            start = time.time()
+            results = [pool.submit(name, *args) for name, args in
+                       map(operation, range(operations))]
+            for result in results:
+                result.get()
+            elapsed = time.time() - start
+            pool.close()
+            print("%-24s %8.1f ops/s" % ("AsyncClient, %d workers" % workers,
+                                         operations / elapsed))
+    finally:
+        daemon.shutdown()
+        daemon.server_close()
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
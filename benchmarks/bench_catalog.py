@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""Provenance catalog search benchmark for Smart Containers.
+
+Indexes synthetic labels for many images in a temporary catalog and times
+typical sc search queries against it, then records a lineage tree over the
+same images and times sc lineage and sc descendants queries of different
+answer sizes. No docker daemon is needed.
+
+Usage:
+    python benchmarks/bench_catalog.py [images] [repeat]
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from sc import catalog
+
+BASES = ['ubuntu:14.04', 'ubuntu:16.04', 'alpine:3.4', 'debian:jessie',
+         'centos:7']
+OSES = ['Linux', 'Darwin']
+QUERIES = [
+    ('orcid + base + after', dict(orcid="0000-0002-0000-0040",
+                                  base="ubuntu", after="2016-06-01")),
+    ('base + after', dict(base="alpine", after="2016-11-01")),
+    ('full text', dict(text="Carberry40 commitOperation")),
+    ('agent + env', dict(agent="Carberry7", env={'os': 'Darwin'})),
+    ('command', dict(command="buildOperation", limit=50)),
+]
+
+
+def label(index):
+    """Synthetic label of image index."""
+    orcid = "0000-0002-0000-%04d" % (index % 100)
+    return json.dumps([{"@graph": [
+        {"@id": "http://orcid.org/" + orcid, "@type": ["prov:Person"],
+         "foaf:givenName": "Josiah",
+         "foaf:familyName": "Carberry%d" % (index % 100)},
+        {"@id": "urn:uuid:activity%d" % index, "@type": ["prov:Activity"],
+         "docker:hasCommand": {"@id": "docker:%sOperation" % (
+             'build' if index % 2 else 'commit')},
+         "prov:startedAtTime": "2016-%02d-01T00:00:00Z" % (index % 12 + 1)},
+        {"@id": "urn:uuid:env%d" % index,
+         "ce:hasOperatingSystem": {"@id": "urn:uuid:os%d" % index}},
+        {"@id": "urn:uuid:os%d" % index, "rdfs:label": OSES[index % 2]},
+    ]}])
+
+
+def main(images=20000, repeat=20):
+    directory = tempfile.mkdtemp()
+    try:
+        mycatalog = catalog.Catalog(os.path.join(directory, 'catalog.db'))
+        start = time.time()
+        for index in range(images):
+            base = BASES[index % len(BASES)]
+            mycatalog.add({
+                'id': '%064x' % index,
+                'created': '2016-%02d-%02dT00:00:00Z' % (index % 12 + 1,
+                                                         index % 28 + 1),
+                'tags': ['project%d:%d' % (index % 500, index)],
+                'base': [base, base.split(':')[0]],
+                'facts': catalog.label_facts(label(index))})
+        mycatalog.commit()
+        print("indexed %d images in %.1f s" % (images, time.time() - start))
+        for name, query in QUERIES:
+            start = time.time()
+            for _ in range(repeat):
+                found = mycatalog.search(**query)
+            elapsed = (time.time() - start) / repeat
+            print("%-24s %8.2f ms  %6d images" % (name, elapsed * 1000,
+                                                  len(found)))
+        # Each image is made from image index // 3, a tree of depth log3 n.
+        start = time.time()
+        for index in range(1, images):
+            mycatalog.add_lineage('%064x' % (index // 3), '%064x' % index)
+        mycatalog.commit()
+        print("recorded lineage of %d images in %.1f s" % (
+            images, time.time() - start))
+        for name, related, index in [('lineage of a leaf', 'lineage',
+                                      images - 1),
+                                     ('descendants of a leaf', 'descendants',
+                                      images - 1),
+                                     ('descendants of a node', 'descendants',
+                                      images // 200),
+                                     ('descendants of the root',
+                                      'descendants', 0)]:
+            start = time.time()
+            for _ in range(repeat):
+                found = getattr(mycatalog, related)('%064x' % index)
+            elapsed = (time.time() - start) / repeat
+            print("%-24s %8.2f ms  %6d images" % (name, elapsed * 1000,
+                                                  len(found)))
+        mycatalog.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
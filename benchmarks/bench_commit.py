@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""Commit latency benchmark for Smart Containers.
+
+Compares the single-pass commit, which writes the smartcontainer label in
+the commit config, with the legacy commit that creates, commits and removes
+a second container in put_label_image. Requires a running docker daemon.
+
+Usage:
+    python benchmarks/bench_commit.py [rounds]
+"""
+import os
+import sys
+import time
+
+from sc import client
+
+image_name = "alpine:latest"
+
+
+def make_client():
+    """Create an scClient on the local docker socket."""
+    host = os.getenv("DOCKER_HOST", "unix:///var/run/docker.sock")
+    return client.scClient(base_url=host, version="auto")
+
+
+def time_commit(myclient, single_pass):
+    """Commit a provenance-bearing container and return the latency."""
+    myclient.single_pass_commit = single_pass
+    container = myclient.create_container(image=image_name,
+                                          command="/bin/sh", tty=True)
+    ContainerID = str(container['Id'])
+    myclient.start(ContainerID)
+    myclient.bufferCopyIn(ContainerID, '', myclient.provfilename,
+                          myclient.provfilepath)
+    start = time.time()
+    newImage = myclient.commit(ContainerID)
+    elapsed = time.time() - start
+    myclient.stop(ContainerID)
+    myclient.remove_container(ContainerID)
+    myclient.remove_image(newImage['Id'], force=True)
+    return elapsed
+
+
+def main(rounds=10):
+    myclient = make_client()
+    myclient.pull(image_name)
+    # Build the provenance graph once so it is not part of the timing.
+    myclient.scmd.labelDictionary(myclient.label_prefix)
+    results = {}
+    for single_pass in (False, True):
+        timings = [time_commit(myclient, single_pass) for _ in range(rounds)]
+        results[single_pass] = sum(timings) / len(timings)
+    print("legacy commit:      %.1f ms" % (results[False] * 1000))
+    print("single-pass commit: %.1f ms" % (results[True] * 1000))
+    print("saved per image:    %.1f ms" %
+          ((results[False] - results[True]) * 1000))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""Dockerfile parser throughput benchmark for Smart Containers.
+
+Generates a large Dockerfile with continued RUN instructions, comments and
+labels, then times dockerfileParser.parse alone and buildProcessor.processDF,
+which also dispatches each instruction to the parsingUtility handlers.
+
+Usage:
+    python benchmarks/bench_parser.py [instructions]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from sc import buildProcessor, dockerfileParser
+
+
+def generate(count):
+    """Generate a Dockerfile with about count instructions."""
+    lines = ["# escape=\\", "FROM ubuntu:14.04", "MAINTAINER Bench Mark"]
+    for index in range(count // 4):
+        lines.append("# Step %d" % index)
+        lines.append("RUN apt-get update \\")
+        lines.append("  && apt-get install -y package%d \\" % index)
+        lines.append("  && rm -rf /var/lib/apt/lists/*")
+        lines.append('LABEL step%d="value %d" other="x"' % (index, index))
+        lines.append("ENV PATH=/opt/tool%d/bin:$PATH" % index)
+        lines.append("COPY [\"file%d\", \"/opt/\"]" % index)
+    return "\n".join(lines) + "\n"
+
+
+def main(count=20000):
+    text = generate(count)
+    path = tempfile.mktemp(suffix='.Dockerfile')
+    with open(path, 'w') as f:
+        f.write(text)
+    try:
+        start = time.time()
+        instructions = dockerfileParser.parse(text)
+        elapsed = time.time() - start
+        print("parse:     %d instructions, %.1f ms, %.0f instructions/s, "
+              "%.1f MB/s" % (len(instructions), elapsed * 1000,
+                             len(instructions) / elapsed,
+                             len(text) / elapsed / 1e6))
+        processor = buildProcessor.buildProcessor()
+        start = time.time()
+        processor.processDF(path)
+        elapsed = time.time() - start
+        print("processDF: %d instructions, %.1f ms, %.0f instructions/s" % (
+            len(processor.PU.steps), elapsed * 1000,
+            len(processor.PU.steps) / elapsed))
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
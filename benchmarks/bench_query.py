@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""SPARQL query latency benchmark for Smart Containers.
+
+Runs typical provenance queries in fresh interpreters, as sc query does,
+first with an empty prepared-query cache (cold) and then with the cache
+written by the cold run (warm), and reports the time to prepare and run
+each query. Repeated queries in one process are timed as well.
+
+Usage:
+    python benchmarks/bench_query.py [activities]
+"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+QUERIES = [
+    ('activities after', """
+        SELECT ?activity ?start WHERE {
+            ?activity a prov:Activity ; prov:startedAtTime ?start .
+            FILTER (?start >= "2016-06-01T00:00:00Z"^^xsd:dateTime)
+        } ORDER BY DESC(?start) LIMIT 20"""),
+    ('agents by graph', """
+        SELECT ?g (COUNT(DISTINCT ?agent) AS ?agents) WHERE {
+            GRAPH ?g { ?agent a prov:Person .
+                       OPTIONAL { ?agent foaf:familyName ?name } }
+        } GROUP BY ?g"""),
+    ('commands', """
+        SELECT DISTINCT ?command WHERE {
+            ?activity docker:hasCommand ?command .
+            FILTER regex(str(?command), "Operation$")
+        }"""),
+]
+
+
+def dataset(activities):
+    """N-Quads with a prov:Activity and agent in a graph per activity."""
+    lines = []
+    for index in range(activities):
+        graph = '<urn:uuid:graph%d>' % index
+        activity = '<urn:uuid:activity%d>' % index
+        agent = '<http://orcid.org/0000-0002-0000-%04d>' % (index % 100)
+        lines.extend([
+            '%s <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> '
+            '<http://www.w3.org/ns/prov#Activity> %s .' % (activity, graph),
+            '%s <http://www.w3.org/ns/prov#startedAtTime> '
+            '"2016-%02d-01T00:00:00Z"^^<http://www.w3.org/2001/XMLSchema#'
+            'dateTime> %s .' % (activity, index % 12 + 1, graph),
+            '%s <http://w3id.org/daspos/docker#hasCommand> '
+            '<http://w3id.org/daspos/docker#commitOperation> %s .' % (
+                activity, graph),
+            '%s <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> '
+            '<http://www.w3.org/ns/prov#Person> %s .' % (agent, graph),
+            '%s <http://xmlns.com/foaf/0.1/familyName> "Carberry" %s .' % (
+                agent, graph),
+        ])
+    return '\n'.join(lines) + '\n'
+
+
+def child(data_path, repeat):
+    """Time the queries in this interpreter and print the timings."""
+    start = time.time()
+    import rdflib
+    from sc import sparqlQuery
+    imported = time.time() - start
+    ds = rdflib.Dataset(default_union=True)
+    ds.parse(data_path, format='nquads')
+    cache = sparqlQuery.QueryCache()
+    timings = []
+    for name, text in QUERIES:
+        runs = []
+        for _ in range(repeat):
+            start = time.time()
+            query = cache.prepare(text)
+            prepared = time.time() - start
+            rows = len(list(ds.query(query)))
+            runs.append((prepared, time.time() - start - prepared, rows))
+        timings.append((name, runs))
+    sys.stdout.write('\n' + json.dumps({'import': imported,
+                                        'timings': timings}) + '\n')
+
+
+def run(data_path, home, repeat=1):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=root, SC_HOME=home)
+    output = subprocess.check_output(
+        [sys.executable, os.path.abspath(__file__), '--child', data_path,
+         str(repeat)], env=env)
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(activities=1000):
+    home = tempfile.mkdtemp()
+    try:
+        data_path = os.path.join(home, 'provenance.nq')
+        with open(data_path, 'w') as data:
+            data.write(dataset(activities))
+        cold = run(data_path, home)
+        warm = run(data_path, home, repeat=5)
+        print("%d activities, import %.0f ms" % (activities,
+                                                 warm['import'] * 1000))
+        print("%-18s %12s %12s %14s %10s" % (
+            'query', 'cold prep', 'warm prep', 'in-process', 'run'))
+        for (name, cold_runs), (_, warm_runs) in zip(cold['timings'],
+                                                     warm['timings']):
+            print("%-18s %9.1f ms %9.1f ms %11.2f ms %7.1f ms" % (
+                name, cold_runs[0][0] * 1000, warm_runs[0][0] * 1000,
+                min(r[0] for r in warm_runs[1:]) * 1000,
+                warm_runs[0][1] * 1000))
+    finally:
+        shutil.rmtree(home)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--child']:
+        child(sys.argv[2], int(sys.argv[3]))
+    else:
+        main(*[int(arg) for arg in sys.argv[1:2]])
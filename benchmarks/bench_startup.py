@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""Cold-start benchmark for the sc command line.
+
+Runs each sc subcommand in a fresh interpreter with an import hook that
+records the self and cumulative time of every import, in the style of
+python -X importtime, and reports the wall time of each subcommand with
+its slowest imports. Subcommands that are passed through to docker should
+not import rdflib, docker-py or the ORCID client.
+
+It then counts the daemon requests made by creating the shared client and
+making one API call, with and without a cached API version, against a fake
+daemon. The cached version should cost no request of its own.
+
+Usage:
+    python benchmarks/bench_startup.py [top]
+"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# Subcommand argument lists to time. Help output exercises command lookup
+# without needing a docker daemon.
+SUBCOMMANDS = [
+    ['--help'],
+    ['docker', '--help'],
+    ['config', '--help'],
+    ['search', '--help'],
+    ['query', '--help'],
+    ['printlabel', '--help'],
+    ['infect', '--help'],
+]
+
+# Modules that passthrough commands should never load.
+HEAVY_MODULES = ['rdflib', 'rdflib_jsonld', 'docker', 'orcid', 'requests',
+                 'cpuinfo']
+
+
+def profile(args):
+    """Run sc with args under the import hook and print the timings."""
+    import __builtin__
+    real_import = __builtin__.__import__
+    records = []
+    stack = []
+
+    def timed_import(name, *rest, **kwargs):
+        stack.append(0.0)
+        start = time.time()
+        try:
+            return real_import(name, *rest, **kwargs)
+        finally:
+            elapsed = time.time() - start
+            nested = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            records.append((name, elapsed - nested, elapsed))
+
+    start = time.time()
+    __builtin__.__import__ = timed_import
+    try:
+        from sc import cli
+        cli.cli(args, prog_name='sc', standalone_mode=False)
+    except SystemExit:
+        pass
+    finally:
+        __builtin__.__import__ = real_import
+    wall = time.time() - start
+    loaded = [m for m in HEAVY_MODULES if sys.modules.get(m) is not None]
+    sys.stdout.write('\n' + json.dumps({'wall': wall, 'imports': records,
+                                        'heavy': loaded}) + '\n')
+
+
+def run(args):
+    """Time sc args in a fresh interpreter.
+
+    Returns:
+        result (dict): wall time, import records and heavy modules loaded.
+
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=root)
+    output = subprocess.check_output(
+        [sys.executable, os.path.abspath(__file__), '--child'] + args,
+        env=env, stdin=open(os.devnull))
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def client_requests(cached):
+    """Count the daemon requests of get_client and one API call.
+
+    Args:
+        cached (bool): Start with the API version in the cache.
+
+    Returns:
+        requested (list): Paths of the requests made.
+
+    """
+    import requests
+    from sc import client
+    base_url = "unix:///tmp/sc-bench-docker.sock"
+    requested = []
+
+    def request(self, method, url, *args, **kwargs):
+        requested.append(url.split('localunixsocket', 1)[-1])
+        response = requests.Response()
+        response.status_code = 200
+        response._content = json.dumps({'ApiVersion': '1.21'}) \
+            if url.endswith('/version') else '[]'
+        return response
+
+    directory = tempfile.mkdtemp()
+    cache_path = os.path.join(directory, 'docker_api.json')
+    if cached:
+        with open(cache_path, 'w') as cache:
+            json.dump({base_url: '1.21'}, cache)
+    real_request = requests.Session.request
+    requests.Session.request = request
+    client._clients.pop(base_url, None)
+    try:
+        client.get_client(base_url, cache_path=cache_path).images()
+    finally:
+        requests.Session.request = real_request
+        client._clients.pop(base_url, None)
+        shutil.rmtree(directory)
+    return requested
+
+
+def main(top=5):
+    for args in SUBCOMMANDS:
+        result = run(args)
+        print("sc %-20s %7.1f ms  heavy: %s" % (
+            ' '.join(args), result['wall'] * 1000,
+            ', '.join(result['heavy']) or '-'))
+        # Sum repeated imports of a module, most expensive first.
+        totals = {}
+        for name, self_time, cumulative in result['imports']:
+            previous = totals.get(name, (0.0, 0.0))
+            totals[name] = (previous[0] + self_time,
+                            previous[1] + cumulative)
+        ranked = sorted(totals.items(), key=lambda item: -item[1][1])
+        print("    import time: self [us] | cumulative | imported package")
+        for name, (self_time, cumulative) in ranked[:top]:
+            print("    import time: %9d | %10d | %s" % (
+                self_time * 1e6, cumulative * 1e6, name))
+    for cached in (False, True):
+        requested = client_requests(cached)
+        print("get_client + images, %-9s %d requests: %s" % (
+            'cached:' if cached else 'uncached:', len(requested),
+            ', '.join(requested)))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--child']:
+        profile(sys.argv[2:])
+    else:
+        main(*[int(arg) for arg in sys.argv[1:2]])
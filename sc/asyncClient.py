@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""Concurrent Smart Containers Docker API Client.
+
+This module runs scClient operations concurrently for services that record
+provenance for many containers at once. Every method queues the operation on
+a pool of worker threads and returns at once with an AsyncResult, whose get
+method waits for the operation and returns its result or raises its error.
+Each worker thread has its own scClient, and so its own connection to the
+docker daemon, so operations do not wait on each other for a connection.
+
+Example:
+    myclient = asyncClient.AsyncClient(base_url="unix://var/run/docker.sock")
+    results = [myclient.get_label_image(image) for image in images]
+    labels = [result.get() for result in results]
+"""
+import threading
+from multiprocessing.pool import ThreadPool
+
+import client
+
+
+class AsyncClient(object):
+    """Runs scClient methods concurrently on a pool of worker threads."""
+
+    def __init__(self, base_url=None, tls=False, workers=100, factory=None,
+                 **kwargs):
+        """Initialize the worker pool.
+
+        Args:
+            base_url (str): Docker host URL.
+            tls (TLSConfig): TLS configuration for https hosts.
+            workers (int): Number of operations run at once.
+            factory: Creates the client of a worker thread, defaults to an
+        scClient for base_url. The API version is looked up once and
+        shared by the worker clients.
+            kwargs: Other scClient arguments.
+        """
+        if factory is None:
+            version = kwargs.pop('version', None)
+            version_cache = None
+            if version is None:
+                shared = client.get_client(base_url, tls=tls)
+                version, version_cache = shared.api_version, \
+                    shared.version_cache
+
+            def factory():
+                myclient = client.scClient(base_url=base_url, tls=tls,
+                                           version=version, **kwargs)
+                # Worker clients check a cached version like the shared one.
+                myclient.version_cache = version_cache
+                return myclient
+        self.factory = factory
+        self.workers = workers
+        self.pool = ThreadPool(workers)
+        self.local = threading.local()
+
+    def client(self):
+        """Returns the scClient of the calling worker thread."""
+        myclient = getattr(self.local, 'client', None)
+        if myclient is None:
+            myclient = self.local.client = self.factory()
+        return myclient
+
+    def _call(self, name, args, kwargs):
+        """Run a client method in a worker thread."""
+        return getattr(self.client(), name)(*args, **kwargs)
+
+    def submit(self, name, *args, **kwargs):
+        """Queue a call of a scClient method.
+
+        Args:
+            name (str): scClient method name.
+            args, kwargs: Method arguments.
+
+        Returns:
+            result (AsyncResult): Result of the call.
+
+        """
+        return self.pool.apply_async(self._call, (name, args, kwargs))
+
+    def commit(self, container, *args, **kwargs):
+        """Queue scClient.commit."""
+        return self.submit('commit', container, *args, **kwargs)
+
+    def build(self, *args, **kwargs):
+        """Queue scClient.build."""
+        return self.submit('build', *args, **kwargs)
+
+    def build_prov(self, **kwargs):
+        """Queue scClient.build_prov."""
+        return self.submit('build_prov', **kwargs)
+
+    def infect_image(self, image, *args, **kwargs):
+        """Queue scClient.infect_image."""
+        return self.submit('infect_image', image, *args, **kwargs)
+
+    def get_label_image(self, imageID, resolve=True):
+        """Queue scClient.get_label_image."""
+        return self.submit('get_label_image', imageID, resolve)
+
+    def bufferCopyOut(self, containerid, filename, path):
+        """Queue scClient.bufferCopyOut."""
+        return self.submit('bufferCopyOut', containerid, filename, path)
+
+    def bufferCopyIn(self, containerid, data, filename, path):
+        """Queue scClient.bufferCopyIn."""
+        return self.submit('bufferCopyIn', containerid, data, filename, path)
+
+    def bufferCopyInFiles(self, containerid, files, path):
+        """Queue scClient.bufferCopyInFiles."""
+        return self.submit('bufferCopyInFiles', containerid, files, path)
+
+    def close(self):
+        """Wait for queued operations and stop the worker threads."""
+        self.pool.close()
+        self.pool.join()
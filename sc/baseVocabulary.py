@@ -15,9 +15,17 @@ class baseVocabulary(object):
         inside the dict RegistryHolder.REGISTRY, the key being the name of the
         class and the associated value, the class itself.
     """
-    graph = rdflib.Dataset(default_union=True)
-    context = {}
     namespace = []
+
+    def __init__(self):
+        """Initialize the vocabulary with its own graph and context.
+
+        Each vocabulary builds into a separate graph so the registry can
+        build them concurrently and merge the results.
+        """
+        self.graph = rdflib.Dataset(default_union=True)
+        self.context = {}
+
     @abstractmethod
     def build(self):
         pass
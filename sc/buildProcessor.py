@@ -1,64 +1,94 @@
+import dockerfileParser
+import io
 import parsingUtility
 import os
+import shutil
+import tarfile
+import tempfile
 
 class buildProcessor:
 
     def __init__(self):
         self.PU = parsingUtility.parsingUtility()
-        self.backslashChar = '\\'
+        self.instructions = []
+        #Build context to upload after processFO, and how much of a
+        #streamed context is kept in memory before spilling to disk.
+        self.context = None
+        self.spool_size = 16 * 1024 * 1024
 
     def processDF(self, path):
         #Processes the dockerfile at path
         try:
-            #Open the file for reading
             with open(path, 'r') as DF:
-                #Initialize the cmd variable
-                cmd = ''
-                #Read the first line in the file
-                line = DF.readline()
-                #So long as there are lines to read in the file,
-                #process each line.
-                while line:
-                    #Trim off the line feed character
-                    line = line[:-1]
-                    #If the line is empty, read the next line
-                    if line == '':
-                        line = DF.readline()
-                    #If the line ends with a backslash, the command is continued
-                    #across mulitple lines
-                    elif line.endswith(self.backslashChar):
-                        #Remove the backslash character, and then:
-                        #Append the command fragment to the cmd variable
-                        #This will occur repeatedly until the entire command
-                        #is assembled
-                        cmd += line.replace(self.backslashChar, '')
-                        #Read teh next line
-                        line = DF.readline()
-                    #If the cmd variable is not empty and we have a line without
-                    #a backslash at the end, then the multi-line command is complete.
-                    elif cmd != '':
-                        #Append the line to the cmd variable
-                        cmd += line
-                        #Send the completed command for parsing
-                        self.PU.parseCommand(cmd)
-                        #Re-initialize the cmd variable
-                        cmd = ''
-                        #Read the next line in the file
-                        line = DF.readline()
-                    #If the cmd variable is empty and we have a line without
-                    #a backslash at the end, then we have a complete command to process.
-                    elif cmd == '':
-                        #Send the command off for parsing
-                        self.PU.parseCommand(line)
-                        #Read the next line in the file
-                        line = DF.readline()
-                    else:
-                        #We should never be here!
-                        print 'Problem processing DockerFile'
-                return 0
+                self.instructions = dockerfileParser.parse(DF)
+            for instruction in self.instructions:
+                self.PU.parseInstruction(instruction)
+            return 0
         except Exception as e:
             return 1
 
-    def processFO(self, fileobj):
-        #Processes a fileobject passed in
-        pass
\ No newline at end of file
+    def processFO(self, fileobj, custom_context=False, dockerfile=None):
+        #Processes a fileobject passed in, either a Dockerfile or a tar
+        #build context holding one. The source is only read once: the
+        #context to upload to docker is left in self.context.
+        dockerfile = os.path.normpath(dockerfile or 'Dockerfile')
+        try:
+            if not custom_context:
+                data = fileobj.read()
+                self.context = io.BytesIO(data)
+                self.instructions = dockerfileParser.parse(data)
+            elif self.seekable(fileobj):
+                #Read the tar index and the Dockerfile, then rewind so
+                #the upload reads the context from the start.
+                start = fileobj.tell()
+                self.context = fileobj
+                try:
+                    self.instructions = self.parseContext(
+                        tarfile.open(fileobj=fileobj, mode='r:*'), dockerfile)
+                finally:
+                    fileobj.seek(start)
+            else:
+                #A stream can only be read once, so keep a copy of
+                #everything read for the upload.
+                self.context = tempfile.SpooledTemporaryFile(
+                    max_size=self.spool_size)
+                reader = TeeReader(fileobj, self.context)
+                try:
+                    self.instructions = self.parseContext(
+                        tarfile.open(fileobj=reader, mode='r|*'), dockerfile)
+                finally:
+                    shutil.copyfileobj(fileobj, self.context)
+                    self.context.seek(0)
+            for instruction in self.instructions:
+                self.PU.parseInstruction(instruction)
+            return 0
+        except Exception as e:
+            return 1
+
+    def parseContext(self, tar, dockerfile):
+        #Parses the Dockerfile inside an open tar build context
+        for member in tar:
+            if os.path.normpath(member.name) == dockerfile and member.isfile():
+                return dockerfileParser.parse(tar.extractfile(member))
+        raise IOError("Build context has no %s" % dockerfile)
+
+    def seekable(self, fileobj):
+        #Returns True if fileobj can be rewound after reading it
+        try:
+            fileobj.tell()
+            return hasattr(fileobj, 'seek')
+        except (AttributeError, IOError):
+            return False
+
+
+class TeeReader(object):
+    """Reads from a file object and copies everything read to another."""
+
+    def __init__(self, source, copy):
+        self.source = source
+        self.copy = copy
+
+    def read(self, size=-1):
+        data = self.source.read(size)
+        self.copy.write(data)
+        return data
@@ -0,0 +1,556 @@
+# -*- coding: utf-8 -*-
+"""Local provenance catalog for SmartContainers.
+
+This module indexes the smartcontainer label of every local image in a
+SQLite database under SC_HOME, so images can be searched by provenance
+without a docker daemon round trip for each image. Each image is stored
+with its creation time, repository tags and base images, a table of facts
+read from its label (agents, ORCID IDs, commands, times and environment)
+and a full text index over all of them.
+
+The catalog is brought up to date with sync, which lists the labelled
+images once and only inspects the images it has not indexed yet. Image IDs
+are content hashes, so an indexed label never changes.
+
+Example:
+    mycatalog = catalog.Catalog()
+    mycatalog.sync(myclient)
+    images = mycatalog.search(orcid="0000-0002-1825-0097", base="ubuntu",
+                              after="2016-01-01")
+"""
+import json
+import os
+import re
+import sqlite3
+from multiprocessing.pool import ThreadPool
+
+from util import sc_home
+
+# Bump when the images, facts or search tables change. They only index
+# labels, so an older catalog drops them and sync indexes the images again.
+SCHEMA_VERSION = 1
+# pk is the rowid the search index refers to. Being declared, it is kept by
+# VACUUM, which may renumber an implicit rowid.
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS images "
+    "(pk INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE, created TEXT, "
+    "tags TEXT, base TEXT)",
+    "CREATE INDEX IF NOT EXISTS images_created ON images (created)",
+    "CREATE TABLE IF NOT EXISTS facts "
+    "(image TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS facts_kvi ON facts (key, value, image)",
+    "CREATE INDEX IF NOT EXISTS facts_image ON facts (image)",
+    # Transitive closure of the image lineage, with a depth 0 row for each
+    # image. depth is the number of steps from ancestor to descendant.
+    "CREATE TABLE IF NOT EXISTS lineage "
+    "(ancestor TEXT NOT NULL, descendant TEXT NOT NULL, "
+    "depth INTEGER NOT NULL, PRIMARY KEY (ancestor, descendant))",
+    "CREATE INDEX IF NOT EXISTS lineage_descendant "
+    "ON lineage (descendant, depth)",
+    "CREATE TABLE IF NOT EXISTS names "
+    "(name TEXT PRIMARY KEY, image TEXT NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS names_image ON names (image)",
+]
+# Full text index, FTS4 is used where sqlite was built without FTS5.
+FTS_SCHEMA = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search USING fts5"
+    "(image UNINDEXED, body)",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search USING fts4(image, body)",
+]
+
+ORCID = re.compile(r'orcid\.org/(\d{4}-\d{4}-\d{4}-\d{3}[\dX])', re.I)
+ORCID_ID = re.compile(r'(\d{4}-\d{4}-\d{4}-\d{3}[\dX])$', re.I)
+HEX_ID = re.compile(r'^(sha256:)?[0-9a-f]{12,64}$')
+# Most parent images followed to find the tagged base of a built image.
+MAX_PARENTS = 256
+AGENT_TYPES = ('Agent', 'Person', 'SoftwareAgent', 'Organization')
+# Label predicates recorded as facts, by local name.
+PREDICATES = {
+    'hasCommand': 'command',
+    'startedAtTime': 'time',
+    'endedAtTime': 'time',
+    'hasContainerID': 'container',
+    'hasContainerTag': 'tag',
+    'hasNumberOfCores': 'cores',
+    'hasOperatingSystem': 'os',
+    'hasArchitecture': 'architecture',
+}
+
+
+def image_id(value):
+    """image_id: Returns an image ID without its sha256: prefix."""
+    return value.replace('sha256:', '')
+
+
+def image_name(name):
+    """image_name: Returns an image name with its tag, latest by default."""
+    if ':' not in name.split('/')[-1] and '@' not in name:
+        return name + ':latest'
+    return name
+
+
+def base_names(names):
+    """base_names: Returns base image names followed by their bare
+    repository names, so ubuntu matches ubuntu:14.04."""
+    names = list(names)
+    names.extend(sorted(set(name.rsplit(':', 1)[0] for name in names
+                            if ':' in name.split('/')[-1]) - set(names)))
+    return names
+
+
+def localname(iri):
+    """localname: Returns the part of an IRI or compact IRI after the last
+    #, / or :."""
+    return re.split(r'[#/:]', iri)[-1]
+
+
+def as_list(value):
+    """as_list: Returns a JSON-LD value as a list."""
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def iter_nodes(document):
+    """iter_nodes: Generator over the node objects of a JSON-LD document.
+
+    Args:
+        document: Parsed JSON-LD, a node, a list or a graph object.
+
+    Yields:
+        node (dict): Object with an @id, from any named graph.
+
+    """
+    for item in as_list(document):
+        if not isinstance(item, dict):
+            continue
+        if '@graph' in item:
+            for node in iter_nodes(item['@graph']):
+                yield node
+        if '@id' in item and any(not key.startswith('@') for key in item):
+            yield item
+
+
+def normalize_orcid(value):
+    """normalize_orcid: Returns the bare ORCID iD of an ORCID IRI or iD, or
+    the value unchanged if it is neither."""
+    match = ORCID.search(value) or ORCID_ID.search(value)
+    return match.group(1).upper() if match else value
+
+
+def normalize_time(value):
+    """normalize_time: Returns an xsd:dateTime or docker time as a sortable
+    YYYY-MM-DDTHH:MM:SSZ string, or a date as YYYY-MM-DD."""
+    value = value.strip()
+    if len(value) <= 10:
+        return value
+    return value[:19].replace(' ', 'T') + 'Z'
+
+
+def label_facts(data):
+    """label_facts: Read the searchable facts of a smartcontainer label.
+
+    Args:
+        data (str): Label graph serialized as JSON-LD.
+
+    Returns:
+        facts (list): (key, value) pairs, without duplicates.
+
+    """
+    try:
+        document = json.loads(data)
+    except (TypeError, ValueError):
+        return []
+    nodes = {}
+    for node in iter_nodes(document):
+        nodes.setdefault(node['@id'], {}).update(node)
+
+    def text(value):
+        # Literal text, or the label or local name of a referenced node.
+        if isinstance(value, dict):
+            if '@value' in value:
+                return unicode(value['@value'])
+            iri = value.get('@id', '')
+            for key, labels in nodes.get(iri, {}).items():
+                if localname(key) == 'label' and as_list(labels):
+                    return text(as_list(labels)[0])
+            return localname(iri)
+        return unicode(value)
+
+    facts = []
+    for iri, node in nodes.items():
+        types = [localname(t) for t in as_list(node.get('@type'))]
+        names = {}
+        for key, values in node.items():
+            if key.startswith('@'):
+                continue
+            name = localname(key)
+            for value in as_list(values):
+                if name in ('givenName', 'familyName'):
+                    names[name] = text(value)
+                elif name in PREDICATES:
+                    fact = text(value)
+                    if PREDICATES[name] == 'time':
+                        fact = normalize_time(fact)
+                    facts.append((PREDICATES[name], fact))
+                if isinstance(value, dict) and ORCID.search(
+                        value.get('@id', '')):
+                    facts.append(('orcid', normalize_orcid(value['@id'])))
+        if ORCID.search(iri):
+            facts.append(('orcid', normalize_orcid(iri)))
+        if any(t in AGENT_TYPES for t in types):
+            facts.append(('agent', iri))
+            name = ' '.join(names[key] for key in ('givenName', 'familyName')
+                            if key in names)
+            if name:
+                facts.append(('agent', name))
+    return sorted(set(facts))
+
+
+def fts_query(text):
+    """fts_query: Returns a full text query matching every word of text.
+
+    Each word is quoted, so characters such as the hyphens of an ORCID iD
+    are not read as query operators.
+    """
+    return ' '.join('"%s"' % word.replace('"', '""')
+                    for word in text.split())
+
+
+class Catalog(object):
+    """Searchable index of the smartcontainer labels of local images."""
+
+    def __init__(self, path=None):
+        """Open the catalog database, creating it if it does not exist.
+
+        Args:
+         (Optional) path (str): Database path, defaults to catalog.db under
+        SC_HOME.
+        """
+        self.path = path or sc_home('catalog.db')
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        # Clients recording lineage from several threads or processes wait
+        # for each other's writes.
+        self.db = sqlite3.connect(self.path, timeout=30)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        if self.db.execute("PRAGMA user_version").fetchone()[0] < \
+                SCHEMA_VERSION:
+            for table in ('images', 'facts', 'search'):
+                self.db.execute("DROP TABLE IF EXISTS %s" % table)
+            self.db.execute("PRAGMA user_version = %d" % SCHEMA_VERSION)
+        for statement in SCHEMA:
+            self.db.execute(statement)
+        for statement in FTS_SCHEMA:
+            try:
+                self.db.execute(statement)
+                break
+            except sqlite3.OperationalError:
+                continue
+        self.db.commit()
+
+    def close(self):
+        """close: Commit pending writes and close the database."""
+        self.db.commit()
+        self.db.close()
+
+    def image_ids(self):
+        """image_ids: Returns the set of indexed image IDs."""
+        return set(row[0] for row in self.db.execute("SELECT id FROM images"))
+
+    def add(self, record):
+        """add: Index an image, replacing an earlier entry.
+
+        The write is committed with the next commit or close.
+
+        Args:
+            record (dict): Image id, created time, tags and base image
+        lists, and (key, value) facts.
+
+        """
+        Id = record['id']
+        self.remove(Id)
+        tags = record.get('tags') or []
+        base = record.get('base') or []
+        facts = list(record.get('facts') or [])
+        facts.extend(('base', name) for name in base)
+        pk = self.db.execute(
+            "INSERT INTO images (id, created, tags, base) VALUES (?, ?, ?, ?)",
+            (Id, record.get('created'), json.dumps(tags),
+             json.dumps(base))).lastrowid
+        self.db.executemany(
+            "INSERT INTO facts (image, key, value) VALUES (?, ?, ?)",
+            [(Id, key, value) for key, value in facts])
+        body = ' '.join([Id] + tags + [value for key, value in facts])
+        # The text index rowid is the pk of the image, so it is updated
+        # without scanning it.
+        self.db.execute("INSERT INTO search (rowid, image, body) "
+                        "VALUES (?, ?, ?)", (pk, Id, body))
+
+    def remove(self, Id):
+        """remove: Drop an image from the catalog."""
+        for (pk,) in self.db.execute(
+                "SELECT pk FROM images WHERE id = ?", (Id,)).fetchall():
+            self.db.execute("DELETE FROM search WHERE rowid = ?", (pk,))
+        self.db.execute("DELETE FROM images WHERE id = ?", (Id,))
+        self.db.execute("DELETE FROM facts WHERE image = ?", (Id,))
+
+    def commit(self):
+        """commit: Commit pending writes."""
+        self.db.commit()
+
+    def search(self, text=None, orcid=None, agent=None, base=None,
+               command=None, after=None, before=None, env=None, limit=None):
+        """search: Find images by provenance.
+
+        Every criterion given must match. Only the catalog is read.
+
+        Args:
+            text (str): Words that must all appear in the indexed label.
+            orcid (str): ORCID iD or IRI of an agent.
+            agent (str): Part of an agent IRI or name.
+            base (str): Base image, with or without a tag.
+            command (str): Part of a recorded command.
+            after (str): Images created at or after this date or time.
+            before (str): Images created before this date or time.
+            env (dict): Environment facts, such as {'os': 'Linux'}.
+            limit (int): Maximum number of images returned.
+
+        Returns:
+            images (list): One dict per image with its id, created time,
+        tags and base images, newest first.
+
+        """
+        where = []
+        args = []
+
+        def fact(key, condition, value):
+            where.append("id IN (SELECT image FROM facts WHERE key = ? AND "
+                         "value %s)" % condition)
+            args.extend([key, value])
+
+        if text:
+            where.append("pk IN (SELECT rowid FROM search WHERE search "
+                         "MATCH ?)")
+            args.append(fts_query(text))
+        if orcid:
+            fact('orcid', '= ?', normalize_orcid(orcid))
+        if agent:
+            fact('agent', 'LIKE ?', '%' + agent + '%')
+        if base:
+            fact('base', '= ?', base)
+        if command:
+            fact('command', 'LIKE ?', '%' + command + '%')
+        for key, value in sorted((env or {}).items()):
+            fact(key, '= ?', value)
+        if after:
+            where.append("created >= ?")
+            args.append(normalize_time(after))
+        if before:
+            where.append("created < ?")
+            args.append(normalize_time(before))
+        query = "SELECT id, created, tags, base FROM images"
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY created DESC"
+        if limit:
+            query += " LIMIT %d" % int(limit)
+        return [{'id': Id, 'created': created, 'tags': json.loads(tags),
+                 'base': json.loads(base)}
+                for Id, created, tags, base in self.db.execute(query, args)]
+
+    def add_names(self, names):
+        """add_names: Record the image each name refers to.
+
+        Args:
+            names: (name, image ID) pairs. A name given again moves to the
+        new image.
+
+        """
+        self.db.executemany(
+            "INSERT OR REPLACE INTO names (name, image) VALUES (?, ?)",
+            [(image_name(name), image_id(Id)) for name, Id in names])
+
+    def add_lineage(self, parent, child, names=()):
+        """add_lineage: Record that image child was made from image parent.
+
+        Every ancestor of parent becomes an ancestor of child and of its
+        descendants, so the cost is proportional to the new closure rows,
+        which for a new image is the number of its ancestors.
+
+        Args:
+            parent (str): Image ID the child was made from.
+            child (str): Image ID of the new image.
+            names: (name, image ID) pairs for either image.
+
+        Returns:
+            added (bool): False if the link would make a cycle.
+
+        """
+        parent, child = image_id(parent), image_id(child)
+        self.add_names(names)
+        if parent == child or self.db.execute(
+                "SELECT 1 FROM lineage WHERE ancestor = ? AND descendant = ?",
+                (child, parent)).fetchone():
+            return False
+        self.db.executemany(
+            "INSERT OR IGNORE INTO lineage (ancestor, descendant, depth) "
+            "VALUES (?, ?, 0)", [(parent, parent), (child, child)])
+        self.db.execute(
+            "INSERT OR IGNORE INTO lineage (ancestor, descendant, depth) "
+            "SELECT a.ancestor, d.descendant, a.depth + d.depth + 1 "
+            "FROM lineage a, lineage d "
+            "WHERE a.descendant = ? AND d.ancestor = ?", (parent, child))
+        return True
+
+    def resolve(self, name):
+        """resolve: Returns the image ID a name or ID prefix refers to, or
+        None if the catalog does not know it or it is ambiguous."""
+        row = self.db.execute("SELECT image FROM names WHERE name = ?",
+                              (image_name(name),)).fetchone()
+        if row is not None:
+            return row[0]
+        prefix = image_id(name)
+        if not HEX_ID.match(prefix):
+            return None
+        # Hex digits sort before 'g', so the prefix is an index range.
+        rows = self.db.execute(
+            "SELECT ancestor FROM lineage WHERE ancestor >= ? AND "
+            "ancestor < ? AND depth = 0 LIMIT 2",
+            (prefix, prefix + 'g')).fetchall()
+        return rows[0][0] if len(rows) == 1 else None
+
+    def lineage(self, Id):
+        """lineage: Returns the ancestors of an image, nearest first.
+
+        Args:
+            Id (str): Image ID.
+
+        Returns:
+            images (list): One dict per ancestor with its id, depth and
+        names.
+
+        """
+        return self._related(
+            "SELECT ancestor, depth FROM lineage WHERE descendant = ? "
+            "AND depth > 0 ORDER BY depth", Id)
+
+    def descendants(self, Id):
+        """descendants: Returns the images made from an image, nearest
+        first.
+
+        Args:
+            Id (str): Image ID.
+
+        Returns:
+            images (list): One dict per descendant with its id, depth and
+        names.
+
+        """
+        return self._related(
+            "SELECT descendant, depth FROM lineage WHERE ancestor = ? "
+            "AND depth > 0 ORDER BY depth", Id)
+
+    def _related(self, query, Id):
+        """Run a lineage query and look up the names of each image."""
+        related = []
+        for other, depth in self.db.execute(query, (image_id(Id),)).fetchall():
+            names = [row[0] for row in self.db.execute(
+                "SELECT name FROM names WHERE image = ? ORDER BY name",
+                (other,))]
+            related.append({'id': other, 'depth': depth, 'names': names})
+        return related
+
+    def sync(self, client, workers=8):
+        """sync: Bring the catalog up to date with the docker daemon.
+
+        Lists the images once and the labelled images once, drops images
+        that are gone and inspects only the labelled images not indexed
+        yet, several at a time. The base of an image is the nearest named
+        ancestor in the lineage index, when sc recorded one.
+
+        Args:
+            client (scClient): Client for the docker daemon.
+            workers (int): Number of images inspected at once.
+
+        Returns:
+            (added, removed): Number of images indexed and dropped.
+
+        """
+        tags = {}
+        for image in client.images():
+            tags[image['Id'].replace('sha256:', '')] = [
+                tag for tag in image.get('RepoTags') or []
+                if tag != '<none>:<none>']
+        self.add_names((name, Id) for Id, names in tags.items()
+                       for name in names)
+        labelled = set(Id.replace('sha256:', '') for Id in client.images(
+            quiet=True, filters={'label': client.label_prefix}))
+        known = self.image_ids()
+        for Id in known - labelled:
+            self.remove(Id)
+        new = sorted(labelled - known)
+        if new:
+            pool = ThreadPool(max(1, min(workers, len(new))))
+            try:
+                for record in pool.imap_unordered(
+                        lambda Id: self.image_record(client, Id, tags), new):
+                    for ancestor in self.lineage(record['id']):
+                        if ancestor['names']:
+                            record['base'] = base_names(ancestor['names'])
+                            break
+                    self.add(record)
+            finally:
+                pool.close()
+        self.commit()
+        return len(new), len(known - labelled)
+
+    def image_record(self, client, Id, tags):
+        """image_record: Read the catalog record of an image.
+
+        Args:
+            client (scClient): Client for the docker daemon.
+            Id (str): Image ID.
+            tags (dict): Repository tags by image ID.
+
+        Returns:
+            record (dict): Record for add.
+
+        """
+        inspect = client.inspect_image(Id)
+        value = client.image_labels(inspect).get(client.label_prefix, '')
+        data = client.scmd.decodeLabel(value)
+        summary = client.scmd.readReference(value)
+        if summary is not None:
+            # Reference labels are indexed from the local store when it has
+            # the graph, otherwise only the summary is known.
+            data = client.scmd.resolveReference(summary, client.store)
+        facts = label_facts(data) if data else []
+        base = []
+        for config in ('Config', 'ContainerConfig'):
+            name = (inspect.get(config) or {}).get('Image')
+            if name:
+                break
+        if name and not HEX_ID.match(name):
+            base = [name]
+        else:
+            # A built image names its last intermediate image, so follow
+            # the parents to the first tagged image.
+            parent = name or inspect.get('Parent')
+            for step in range(MAX_PARENTS):
+                if not parent:
+                    break
+                base = list(tags.get(image_id(parent), []))
+                if base:
+                    break
+                try:
+                    parent = client.inspect_image(parent).get('Parent')
+                except IOError:
+                    # Pulled images have no local parents.
+                    break
+        created = inspect.get('Created')
+        return {'id': Id, 'created': created and normalize_time(created),
+                'tags': tags.get(Id, []), 'base': base_names(base),
+                'facts': facts}
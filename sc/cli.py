@@ -1,13 +1,8 @@
 import click
 import os
-import rdflib
-from rdflib import Literal, Namespace
-from rdflib.namespace import FOAF
-import uuid
-from configmanager import ConfigManager
-from orcidmanager import OrcidManager
-from orcidprofilesearch import orcid_search
-from dockercli import DockerCli
+
+# rdflib, docker-py and the ORCID client are imported by the commands that
+# use them, so commands passed through to docker start without loading them.
 
 # from ._version import __version__
 
@@ -20,8 +15,6 @@ class Settings(object):
         self.home = os.path.abspath(home or '.')
         self.debug = debug
 
-graph = rdflib.Graph()
-config_file = ConfigManager()
 
 @click.group()
 @click.version_option()
@@ -37,10 +30,15 @@ def cli(ctx):
     image.
     """
 
-    # Ignore config loading if we intend to create an orcid config
-    if ctx.args[0] == "config" and ctx.args[1] == "orcid":
-        return
 
+def ensure_config():
+    """Read the user configuration, creating it if it does not exist.
+
+    Only commands that record provenance need the configuration, so they
+    call this before running.
+    """
+    import configmanager
+    config_file = configmanager.get_config()
     Success = False
     while not Success:
         result = config_file.read_config()
@@ -55,6 +53,9 @@ def cli(ctx):
                         continue
 
                     if selected.lower() == 'n' or selected.lower() == 'no':
+                        import uuid
+                        from rdflib import Literal, Namespace
+                        from rdflib.namespace import FOAF
                         print("Please provide some basic information:")
                         query = {
                             'first_name': click.prompt(
@@ -78,7 +79,6 @@ def cli(ctx):
                     print('That is not a valid selection.  Please try again.\n')
         else:
             Success = True
-            graph = config_file.graph
 
 
 @cli.group()
@@ -101,30 +101,138 @@ def docker(command):
 
     :param command: string
     """
-    cmd = ""
-    for i in range(len(command)):
-        cmd += command[i] + " "
-
+    from dockercli import DockerCli, captures
+    if captures(command):
+        ensure_config()
     processdocker = DockerCli()
-    processdocker.do_command(cmd)
+    # Passed through commands replace sc with the docker process.
+    processdocker.do_command(command, replace=True)
+
+
+@cli.command()
+@click.argument('text', nargs=-1)
+@click.option('--orcid', help='ORCID iD of an agent.')
+@click.option('--agent', help='Part of an agent name or IRI.')
+@click.option('--base', '-b', help='Base image, such as ubuntu or ubuntu:14.04.')
+@click.option('--command', help='Part of a recorded command.')
+@click.option('--after', help='Created at or after this date, YYYY-MM-DD.')
+@click.option('--before', help='Created before this date, YYYY-MM-DD.')
+@click.option('--env', '-e', multiple=True,
+              help='Environment fact, such as os=Linux or cores=4.')
+@click.option('--limit', '-n', default=0, help='Show at most this many images.')
+@click.option('--refresh', '-r', is_flag=True,
+              help='Update the catalog from the docker daemon first.')
+def search(text, orcid, agent, base, command, after, before, env, limit,
+           refresh):
+    """Search for images in the local provenance catalog.
+    Example: sc search --orcid 0000-0002-1825-0097 --base ubuntu --after 2016-01-01
+
+    :param text: string
+    """
+    from catalog import Catalog
+    mycatalog = Catalog()
+    if refresh:
+        from dockercli import DockerCli
+        added, removed = mycatalog.sync(DockerCli().dcli)
+        print("Catalog updated: %d added, %d removed" % (added, removed))
+    facts = dict(fact.split('=', 1) for fact in env if '=' in fact)
+    images = mycatalog.search(' '.join(text), orcid=orcid, agent=agent,
+                              base=base, command=command, after=after,
+                              before=before, env=facts, limit=limit)
+    mycatalog.close()
+    for image in images:
+        print("%-12s  %-20s  %-30s  %s" % (
+            image['id'][:12], image['created'] or '',
+            ' '.join(image['tags']) or '<none>', ' '.join(image['base'])))
+
+
+def print_related(image, related):
+    """Print the images of a lineage query, one per line."""
+    from catalog import Catalog
+    mycatalog = Catalog()
+    Id = mycatalog.resolve(image)
+    if Id is None:
+        mycatalog.close()
+        raise click.ClickException(
+            'No lineage recorded for %s. Run sc search --refresh to index '
+            'local image names.' % image)
+    images = getattr(mycatalog, related)(Id)
+    mycatalog.close()
+    for other in images:
+        print("%-12s  %5d  %s" % (other['id'][:12], other['depth'],
+                                  ' '.join(other['names']) or '<none>'))
 
 
 @cli.command()
 @click.argument('image')
-def search(image):
-    """Search for information in docker metadata.
+def lineage(image):
+    """Show the images an image was made from, nearest first.
 
     :param image: string
     """
-    pass
+    print_related(image, 'lineage')
+
+
+@cli.command()
+@click.argument('image')
+def descendants(image):
+    """Show the images made from an image, nearest first.
+
+    :param image: string
+    """
+    print_related(image, 'descendants')
+
+
+@cli.command()
+@click.argument('sparql', required=False)
+@click.option('--file', '-f', 'query_file', type=click.File('r'),
+              help='Read the query from a file.')
+@click.option('--image', '-i', 'images', multiple=True,
+              help='Query the provenance of this image. Repeat for several. '
+                   'Without it the local graph store is queried.')
+@click.option('--format', '-o', 'output', default='table',
+              type=click.Choice(['table', 'json', 'csv', 'xml']),
+              help='Result format.')
+def query(sparql, query_file, images, output):
+    """Run a SPARQL query over provenance.
+    Example: sc query -i myimage 'SELECT ?a WHERE { ?a a prov:Activity }'
+
+    :param sparql: string
+    """
+    if query_file is not None:
+        sparql = query_file.read()
+    if not sparql:
+        raise click.UsageError('Give a query or --file.')
+    import sparqlQuery
+    if images:
+        from dockercli import DockerCli
+        dataset = sparqlQuery.image_dataset(DockerCli().dcli, images)
+    else:
+        try:
+            dataset = sparqlQuery.local_dataset()
+        except ValueError as error:
+            raise click.ClickException(str(error))
+    result = sparqlQuery.QueryCache().query(dataset, sparql)
+    if result.type in ('CONSTRUCT', 'DESCRIBE'):
+        print(result.serialize(format='turtle'))
+    elif output != 'table':
+        print(result.serialize(format=output))
+    elif result.type == 'ASK':
+        print(str(result.askAnswer).lower())
+    else:
+        print('\t'.join(result.vars))
+        for row in result:
+            print('\t'.join(u'' if term is None else term.n3()
+                            for term in row).encode('utf-8'))
 
 
 @cli.command()
 @click.argument('image')
 def printlabel(image):
     """Print Metadata label from container."""
-    processdocker = DockerCli("info")
-    this_label = processdocker.get_label(image)
+    from dockercli import DockerCli
+    processdocker = DockerCli()
+    this_label = processdocker.dcli.get_label_image(image)
     print this_label
 
 
@@ -144,12 +252,68 @@ def preserve():
     pass
 
 @cli.command()
-@click.argument('image')
-def infect(image):
+@click.option('--journal', '-j',
+              help='Journal file, defaults to events.jsonl under SC_HOME.')
+@click.option('--batch', '-b', default=500,
+              help='Most events written to the journal at once.')
+@click.option('--since', type=int,
+              help='First record the events since this Unix time, defaults '
+                   'to the last event recorded.')
+def watch(journal, batch, since):
+    """Record provenance of container start, die and commit events.
+    Runs in the foreground until interrupted, recording containers however
+    they were started.
+    """
+    import signal
+    import sys
+    import time
+    from dockercli import DockerCli
+    from eventWatcher import EventWatcher
+    watcher = EventWatcher(DockerCli().dcli, journal, batch_size=batch,
+                           since=since)
+    # Stop cleanly when run as a service.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    watcher.start()
+    print("Recording docker events to %s" % watcher.journal)
+    try:
+        while watcher.running():
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.stop()
+        print("Recorded %(records)d of %(events)d events in %(batches)d "
+              "batches" % watcher.counts)
+
+
+@cli.command()
+@click.argument('images', nargs=-1)
+@click.option('--all', 'infect_all', is_flag=True,
+              help='Infect every image that is not a smartcontainer.')
+@click.option('--filter', '-f', 'filters', multiple=True,
+              help='Only infect images matching a docker images filter, '
+                   'such as label=project.')
+@click.option('--workers', '-w', default=8,
+              help='Number of images to infect at once.')
+@click.option('--retag', is_flag=True,
+              help='Move the tags of each image to its smartcontainer.')
+def infect(images, infect_all, filters, workers, retag):
     """Provenance should be contagious. Create smartcontainer image from
     existing image. """
+    from dockercli import DockerCli
+    if not (images or infect_all or filters):
+        raise click.UsageError('Give an image, --all or --filter.')
+    ensure_config()
     processdocker = DockerCli()
-    processdocker.infect(image)
+    if len(images) == 1 and not (infect_all or filters):
+        processdocker.infect(images[0])
+        return
+    image_filters = {}
+    for image_filter in filters:
+        key, _, value = image_filter.partition('=')
+        image_filters.setdefault(key, []).append(value)
+    processdocker.infect_all(list(images) or None, image_filters or None,
+                             workers, retag)
 
 #  Orcid Commands  ################################
 #  cwilli34
@@ -177,15 +341,25 @@ def orcid(i, e):
 
 def config_by_search():
     """Create a RDF Graph configuration file by searching for Orcid user."""
-    orcid_profile = orcid_search(sandbox=False)
-    if orcid_profile is not None:
-        orcid_manager = OrcidManager(sandbox=False, orcid_id=orcid_profile)
-        turtle_data = orcid_manager.get_turtle()
-        config_file = ConfigManager()
-        config_file.config_obj = turtle_data
-        config_file.write_config()
-    else:
-        print("Sorry, ORCID returned no resutls for that user information.")
+    from configmanager import ConfigManager
+    from orcidCache import ResponseCache
+    from orcidmanager import OrcidManager
+    from orcidprofilesearch import orcid_search
+    # The search and the profile lookup share one cache.
+    cache = ResponseCache()
+    try:
+        orcid_profile = orcid_search(sandbox=False, cache=cache)
+        if orcid_profile is not None:
+            orcid_manager = OrcidManager(sandbox=False, orcid_id=orcid_profile,
+                                         cache=cache)
+            turtle_data = orcid_manager.get_turtle()
+            config_file = ConfigManager()
+            config_file.config_obj = turtle_data
+            config_file.write_config()
+        else:
+            print("Sorry, ORCID returned no resutls for that user information.")
+    finally:
+        cache.close()
 
 
 def config_by_id(orcid_id):
@@ -194,9 +368,14 @@ def config_by_id(orcid_id):
     :param orcid_id: string
         Orcid ID used for the configuration file ID and to create the configuration file.
     """
+    from configmanager import ConfigManager
+    from orcidmanager import OrcidManager
     # Make sure sandbox variable is set correctly in cli.py before testing
     orcid_profile = OrcidManager(orcid_id=orcid_id, sandbox=False)
-    turtle_data = orcid_profile.get_turtle()
+    try:
+        turtle_data = orcid_profile.get_turtle()
+    finally:
+        orcid_profile.close()
     config_file = ConfigManager()
     config_file.get_config(_id=orcid_profile.orcid_id, _data=turtle_data)
     config_file.write_config()
@@ -208,10 +387,15 @@ def config_by_email(email):
     :param email: string
         Orcid email address used to create a configuration file.
     """
+    from configmanager import ConfigManager
+    from orcidmanager import OrcidManager
     # Make sure sandbox variable is set correctly in cli.py before testing
     email = 'email:' + email
     orcid_profile = OrcidManager(orcid_email=email, sandbox=False)
-    turtle_data = orcid_profile.get_turtle()
+    try:
+        turtle_data = orcid_profile.get_turtle()
+    finally:
+        orcid_profile.close()
     config_file = ConfigManager()
     config_file.get_config(_id=orcid_profile.orcid_id, _data=turtle_data)
     config_file.write_config()
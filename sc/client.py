@@ -11,18 +11,140 @@ state change.
 
 import docker
 import glob
+import io
 import json
 import re
 import os
+import sys
 import scMetadata
+import graphRegistry
+import contentStore
 import tempfile
 import tarfile
+import time
 import buildProcessor
+import dockerfileParser
+import catalog
+import requests
+import sqlite3
+from multiprocessing.pool import ThreadPool
+from util import read_json_cache, sc_home, write_json_cache
+
+class BuildError(docker.errors.DockerException):
+    """Raised when the docker daemon reports a failed build."""
+
+
+# Most undecoded text build_events holds while waiting for the rest of an
+# event.
+MAX_PENDING = 1024 * 1024
+
+
+def build_events(chunks):
+    """Generator over the JSON events of a streamed build response.
+
+    Chunks are decoded as they arrive. A chunk can hold several events or
+    only part of one, so undecoded text is kept until the rest arrives.
+    Events are single lines, so a line that does not decode, such as plain
+    text output or an error page, is dropped, as is undecoded text longer
+    than MAX_PENDING, and memory stays bounded.
+
+    Args:
+        chunks: Raw response chunks from the docker build endpoint.
+
+    Yields:
+        event (dict): Decoded build event.
+
+    """
+    decoder = json.JSONDecoder()
+    pending = ''
+    for chunk in chunks:
+        pending = (pending + chunk).lstrip()
+        while pending:
+            try:
+                event, end = decoder.raw_decode(pending)
+            except ValueError:
+                newline = pending.find('\n')
+                if newline >= 0:
+                    pending = pending[newline + 1:].lstrip()
+                    continue
+                if len(pending) > MAX_PENDING:
+                    pending = ''
+                break
+            yield event
+            pending = pending[end:].lstrip()
+
+
+def dockerfile_quote(value, escape='\\'):
+    """Quote a value for a Dockerfile LABEL instruction.
+
+    Args:
+        value (str): Label value.
+        escape (str): Escape character of the Dockerfile, a backslash or a
+        backtick set with the escape parser directive.
+
+    Returns:
+        quoted (str): Double quoted value with quotes, escape characters
+        and variable references escaped.
+
+    """
+    for char in (escape, '"', '$'):
+        value = value.replace(char, escape + char)
+    return '"' + value + '"'
+
+
+# Clients shared by the whole sc process, keyed by docker host URL.
+_clients = {}
+# Daemon errors for a request made with an API version it doesn't support.
+VERSION_ERROR = re.compile(r'client is newer than server|'
+                           r'client version \S+ is too new')
+
+
+def get_client(base_url, tls=False, cache_path=None):
+    """Return the shared scClient for a docker host.
+
+    The first call for a host creates the client. Later calls reuse it
+    and its pooled HTTP session. The API version negotiated with the
+    daemon is cached under SC_HOME by host URL, so later sc processes
+    skip the version negotiation and make no request until the first API
+    call. If the daemon rejects the cached version of that call, after a
+    downgrade or when another daemon now answers at the URL, the version
+    is negotiated again, the cache entry replaced and the call retried.
+
+    Args:
+        base_url (str): Docker host URL, from DOCKER_HOST or the socket.
+        tls (TLSConfig): TLS configuration for https hosts.
+        cache_path (str): API version cache, defaults to
+            SC_HOME/docker_api.json.
+
+    Returns:
+        scClient: Client for the docker host.
+
+    """
+    if base_url not in _clients:
+        if cache_path is None:
+            cache_path = sc_home('docker_api.json')
+        versions = read_json_cache(cache_path) or {}
+        if versions.get(base_url):
+            myclient = scClient(base_url=base_url, tls=tls,
+                                version=versions[base_url])
+            myclient.version_cache = (cache_path, base_url)
+        else:
+            myclient = scClient(base_url=base_url, tls=tls, version="auto")
+            versions[base_url] = myclient.api_version
+            write_json_cache(cache_path, versions)
+        _clients[base_url] = myclient
+    return _clients[base_url]
 
 
 class scClient(docker.Client):
     """scClient Class extends Docker-py Client class and Docker API."""
 
+    # (cache path, host URL) of a cached API version, which is checked by
+    # the first request. Class attributes, as version="auto" makes a
+    # request before __init__ returns.
+    version_cache = None
+    version_checked = False
+
     def __init__(self, *args, **kwargs):
         """Initialize docker-py client with standard arguments.
 
@@ -34,7 +156,66 @@ class scClient(docker.Client):
         self.scmd = scMetadata.scMetadata()
         self.provfilepath = "/SmartContainer/"
         self.provfilename = "SCProv.jsonld"
+        # Incremental mode appends one named graph per state change to an
+        # N-Quads file and records its byte range in a manifest.
+        self.incremental_prov = False
+        self.provnquadsname = "SCProv.nq"
+        self.provmanifestname = "SCProv.manifest"
         self.label_prefix = "smartcontainer"
+        # Provenance checks keyed by (container ID, file path).
+        self._prov_cache = {}
+        # Write the label with the first commit instead of committing a
+        # second, throwaway container in put_label_image.
+        self.single_pass_commit = True
+        # Label holds the whole graph ("inline") or only its content hash
+        # and a summary ("reference") with the graph kept in the store.
+        self.label_mode = "inline"
+        # Inline labels longer than this many bytes are gzip compressed and
+        # base64 encoded. None disables compression.
+        self.label_compress_over = None
+        self.store = contentStore.ContentStore()
+        # Build output is echoed here as it streams. None silences it.
+        self.build_output = sys.stdout
+        # build_prov adds the provenance in the build itself instead of
+        # infecting the built image through a second container.
+        self.inject_build_prov = True
+        # Generated Dockerfile, its directory holds the provenance files.
+        self.build_dockerfile = ".smartcontainer/Dockerfile"
+        # Record the image each new image was made from in the catalog
+        # lineage index.
+        self.lineage = True
+
+    def request(self, method, url, *args, **kwargs):
+        """HTTP request to the daemon that checks a cached API version.
+
+        If the daemon rejects the cached version of the first request, the
+        version is negotiated again, the cache entry replaced and the
+        request retried.
+
+        Returns:
+            response (Response): Daemon response.
+
+        """
+        response = super(scClient, self).request(method, url, *args,
+                                                 **kwargs)
+        if self.version_cache is None or self.version_checked:
+            return response
+        self.version_checked = True
+        if response.status_code != 400 or \
+                not VERSION_ERROR.search(response.text):
+            return response
+        stale = '/v%s/' % self._version
+        self._version = self._retrieve_server_version()
+        cache_path, base_url = self.version_cache
+        versions = read_json_cache(cache_path) or {}
+        versions[base_url] = self._version
+        write_json_cache(cache_path, versions)
+        data = kwargs.get('data')
+        if hasattr(data, 'seek'):
+            data.seek(0)
+        return super(scClient, self).request(
+            method, url.replace(stale, '/v%s/' % self._version, 1), *args,
+            **kwargs)
 
     def commit(self, container, *args, **kwargs):
         """Docker Commit that also updates a smart container object.
@@ -42,43 +223,223 @@ class scClient(docker.Client):
         Args:
             container: Container ID
 
-        Returns: Nothing.
+        Returns:
+            image (dict): Commit result from the docker daemon.
 
         """
         # Extends the docker-py commit command to include
         #              smartcontainer functions
+        parent = None
+        if self.lineage:
+            parent = super(scClient, self).inspect_container(
+                container)['Image']
         # Check if the container being committed has previous
         #                     provenance information stored in it.
-        if self.hasProv(container, self.provfilename, self.provfilepath):
-            # Retrieve provenance file from the container
-            self.fileCopyOut(container, self.provfilename, self.provfilepath)
-            # Append provenance data to file
-            self.scmd.appendData(self.provfilename)
-            # Copy provenance file back to the container
-            self.fileCopyIn(container, self.provfilename, self.provfilepath)
-            # Remove the local copy of the provenance file
-            os.remove(self.provfilename)
-            # Commit the container changes
-            newImage = super(scClient, self).commit(container=container, *args,
+        if self.hasAnyProv(container):
+            # Get the provenance and the label of this state change.
+            files, newLabel = self.stateChange(container)
+            # Append provenance data inside the container
+            self.bufferCopyInFiles(container, files, self.provfilepath)
+            if self.single_pass_commit:
+                # Commit the container changes with the label in the
+                # image config.
+                kwargs['conf'] = self.label_conf(kwargs.get('conf'), newLabel)
+                newImage = super(scClient, self).commit(container=container,
+                                                        *args, **kwargs)
+            else:
+                # Commit the container changes
+                newImage = super(scClient, self).commit(container=container,
+                                                        *args, **kwargs)
+                # Get the ID of the newly created image
+                thisID = newImage['Id']
+                # Write the label to the new image
+                self.put_label_image(thisID, newLabel, *args, **kwargs)
+
+        else:
+            newImage = super(scClient, self).commit(container, *args,
                                                     **kwargs)
-            # Get the ID of the newly created image
-            thisID = newImage['Id']
-            # Get the label contents in dictionary form.
-            newLabel = self.scmd.labelDictionary(self.label_prefix)
-            # Write the label to the new image
-            self.put_label_image(thisID, newLabel, *args, **kwargs)
+        # The container may change after the commit operation.
+        self.forget_prov(container)
+        repository = kwargs.get('repository', args[0] if args else None)
+        tag = kwargs.get('tag', args[1] if len(args) > 1 else None)
+        names = []
+        if repository:
+            names.append(("%s:%s" % (repository, tag or "latest"),
+                          newImage['Id']))
+        self.record_lineage(parent, newImage['Id'], names)
+        return newImage
+
+    def appendProv(self, containerid, existing=True):
+        """Append the current state change to the container provenance.
 
+        Args:
+            containerid: Container ID
+            existing (bool): Read the provenance already in the container
+        before appending.
+
+        Returns: Nothing.
+
+        """
+        files, label = self.stateChange(containerid if existing else None)
+        self.bufferCopyInFiles(containerid, files, self.provfilepath)
+
+    def stateChange(self, containerid=None, existing=None):
+        """Get the provenance files and the label of a new state change.
+
+        Each state change is recorded in its own named graph. The files and
+        the label are made together, so they describe the same graph even
+        when other threads record state changes at the same time.
+
+        Args:
+            containerid: Container whose provenance is appended to, or None
+        to start new provenance.
+            existing (dict): Provenance already read with readProv, used
+        instead of reading containerid.
+
+        Returns:
+            (files, label): (filename, data) pairs to write to provfilepath
+        and the label dictionary.
+
+        """
+        # Read the existing provenance before holding up other threads.
+        if existing is None:
+            existing = self.readProv(containerid)
+        with graphRegistry.get_registry().state_change():
+            return self.provFiles(existing=existing), self.newLabel()
+
+    def readProv(self, containerid=None):
+        """Read the provenance files a state change appends to.
+
+        Args:
+            containerid: Container to read, or None to start new provenance.
+
+        Returns:
+            existing (dict): Contents of each provenance file, or None for
+        files the container does not have.
+
+        """
+        if self.incremental_prov:
+            names = [self.provnquadsname, self.provmanifestname]
         else:
-            super(scClient, self).commit(container, *args, **kwargs)
+            names = [self.provfilename]
+        existing = dict.fromkeys(names)
+        if containerid is not None:
+            for name in names:
+                existing[name] = self.bufferCopyOut(containerid, name,
+                                                    self.provfilepath)
+        return existing
+
+    def readImageProv(self, image):
+        """Read the provenance files of an image.
+
+        Uses a container that is created but never started.
+
+        Args:
+            image: Image ID
+
+        Returns:
+            existing (dict): Contents of each provenance file, or None for
+        files the image does not have.
+
+        """
+        newContainer = super(scClient, self).create_container(
+            image=image, command="/bin/sh")
+        ContainerID = str(newContainer['Id'])
+        try:
+            return self.readProv(ContainerID)
+        finally:
+            super(scClient, self).remove_container(ContainerID)
+
+    def provFiles(self, containerid=None, existing=None):
+        """Get the provenance files for the current state change.
+
+        Args:
+            containerid: Container whose provenance is appended to, or None
+        to start new provenance.
+            existing (dict): Provenance already read with readProv, used
+        instead of reading containerid.
+
+        Returns:
+            files (list): (filename, data) pairs to write to provfilepath.
+
+        """
+        if existing is None:
+            existing = self.readProv(containerid)
+        if self.incremental_prov:
+            data, manifest = self.scmd.appendIncremental(
+                existing.get(self.provnquadsname),
+                existing.get(self.provmanifestname))
+            return [(self.provnquadsname, data),
+                    (self.provmanifestname, manifest)]
+        return [(self.provfilename,
+                 self.scmd.appendBuffer(existing.get(self.provfilename)))]
+
+    def newLabel(self):
+        """Get the smartcontainer label for the current state change.
+
+        Returns:
+            label (dict): Label dictionary in the configured label_mode.
+
+        """
+        if self.label_mode == "reference":
+            if self.incremental_prov:
+                return self.scmd.labelReference(
+                    self.label_prefix, self.store, self.provnquadsname,
+                    'nquads')
+            return self.scmd.labelReference(self.label_prefix, self.store,
+                                            self.provfilename)
+        return self.scmd.labelDictionary(self.label_prefix,
+                                         self.label_compress_over)
+
+    def label_conf(self, conf, label):
+        """Merge a label into a commit config.
+
+        Args:
+            conf (dict): Container config passed to commit, or None.
+            label (dict): Label to add to the image.
+
+        Returns:
+            conf (dict): Copy of the config with the label added.
+
+        """
+        # The daemon merges the commit config with the container config, so
+        # only the labels need to be sent.
+        conf = dict(conf or {})
+        labels = dict(conf.get('Labels') or {})
+        labels.update(label)
+        conf['Labels'] = labels
+        return conf
+
+    def image_labels(self, inspect):
+        """Get the labels of an inspected image.
+
+            Labels written at commit time are in Config, labels from a
+            labelled container are in ContainerConfig.
+
+        Args:
+            inspect (dict): Result of inspect_image.
+
+        Returns:
+            labels (dict): Image labels, Config taking precedence.
+
+        """
+        labels = {}
+        for key in ('ContainerConfig', 'Config'):
+            config = inspect.get(key) or {}
+            labels.update(config.get('Labels') or {})
+        return labels
 
     def build(self, *args, **kwargs):
         """build; Docker Build for smartcontainers.
 
+        The build output is echoed to build_output as it streams.
+
         Args:
             image: Image ID
             label: Label string to write to the container
 
-        Returns: Nothing.
+        Returns:
+            Id (str): Full ID of the built image, or "".
 
         """
         # Build Metadata
@@ -87,42 +448,323 @@ class scClient(docker.Client):
 
         # path or fileobj must exist. If not, we let the docker-py interface handle any error reporting
         if "path" in kwargs and kwargs['path'] != None:
-            BP.processDF(kwargs['path'])
+            BP.processDF(os.path.join(kwargs['path'],
+                                      kwargs.get('dockerfile') or
+                                      'Dockerfile'))
         elif "fileobj" in kwargs and kwargs['fileobj'] != None:
-            BP.processFO(kwargs['fileobj'])
-
-        Id = ""
+            BP.processFO(kwargs['fileobj'], kwargs.get('custom_context'),
+                         kwargs.get('dockerfile'))
+            # Upload the context processFO read instead of reading the
+            # file object again.
+            if BP.context not in (None, kwargs['fileobj']):
+                kwargs['fileobj'].close()
+                kwargs['fileobj'] = BP.context
 
         generator = None
+        # Stream the raw response so each chunk is handled as it arrives.
+        kwargs['stream'] = True
+        kwargs['decode'] = False
         try:
             # Execute the build
             generator = super(scClient, self).build(*args,  **kwargs)
         except TypeError:
             raise
         else:
-            response = [line for line in generator]
-            final_line = response[len(response)-1]
-
-            # Handle strange case of two lines in generated last line
-            lines = final_line.split("\r\n")
-            if len(lines) > 1:
-                if len(lines[0]) == 0:
-                    final_line = lines[1]
-                else:
-                    final_line = lines[0]
+            Id = self.resolve_image_id(self.follow_build(generator))
+            self.record_build_lineage(BP.instructions, Id, kwargs.get('tag'))
+            return Id
+        finally:
+            if "fileobj" in kwargs:
+                kwargs["fileobj"].close()
+
+    def record_build_lineage(self, instructions, Id, tag=None):
+        """Record the base image of a build in the lineage index.
+
+        Args:
+            instructions (list): Instructions parsed from the Dockerfile.
+            Id (str): Built image ID.
+            tag (str): Repository tag given to the build.
+
+        """
+        if not (self.lineage and Id):
+            return
+        base = dockerfileParser.base_image(instructions)
+        if base in (None, 'scratch'):
+            return
+        try:
+            parent = self.inspect_image(base)['Id']
+        except (docker.errors.DockerException,
+                requests.exceptions.RequestException):
+            # An unresolved build argument or a base removed since.
+            return
+        names = [(base, parent)]
+        if tag:
+            names.append((tag, Id))
+        self.record_lineage(parent, Id, names)
+
+    def record_lineage(self, parent, child, names=()):
+        """Record that image child was made from image parent.
+
+        The lineage index only speeds up queries over provenance the labels
+        already hold, so a catalog that can't be written is skipped.
+
+        Args:
+            parent (str): Image ID the child was made from.
+            child (str): Image ID of the new image.
+            names: (name, image ID) pairs for either image.
+
+        """
+        if not (self.lineage and parent and child):
+            return
+        try:
+            mycatalog = catalog.Catalog()
+            try:
+                mycatalog.add_lineage(parent, child, names)
+            finally:
+                mycatalog.close()
+        except (sqlite3.Error, OSError):
+            pass
 
-            fJson = json.loads(final_line)
-            if "Successfully built" in fJson['stream']:
-                Id = fJson['stream'].split(' ')[2].strip()
+    def follow_build(self, chunks):
+        """Echo a streamed build and find the image it built.
 
-            for line in super(scClient, self).images():
-                fullID = line['Id'].replace("sha256:", "")
-                if fullID.startswith(Id):
-                    return fullID
+        Only the current step and the image ID are kept, so the build log
+        is never held in memory.
+
+        Args:
+            chunks: Raw response chunks from the docker build endpoint.
+
+        Returns:
+            Id (str): Image ID reported by the build, or "". This is the
+        full digest when the daemon sends it in an aux event and the short
+        ID from "Successfully built" otherwise.
+
+        Raises:
+            BuildError: The daemon reported an error.
+
+        """
+        Id = ""
+        step = None
+        for event in build_events(chunks):
+            text = event.get('stream') or event.get('status')
+            if text and self.build_output is not None:
+                if 'stream' not in event:
+                    text += '\n'
+                self.build_output.write(text.encode('utf-8'))
+                self.build_output.flush()
+            if 'error' in event:
+                message = event['error'].strip()
+                if step:
+                    message = "%s: %s" % (step, message)
+                raise BuildError(message)
+            aux = event.get('aux')
+            if isinstance(aux, dict) and aux.get('ID'):
+                Id = aux['ID']
+            stream = event.get('stream', '')
+            if stream.startswith('Step '):
+                step = stream.strip()
+            elif stream.startswith('Successfully built') and not Id:
+                Id = stream.split(' ')[2].strip()
+        return Id
+
+    def resolve_image_id(self, Id):
+        """Expand an image ID reported by a build to the full ID.
+
+        A full digest is used as is. A short ID is expanded with a single
+        inspect, so the cost does not grow with the number of images.
+
+        Args:
+            Id (str): Full digest or short image ID.
+
+        Returns:
+            fullID (str): Full image ID without the sha256: prefix, or "".
+
+        """
+        if not Id:
+            return ""
+        fullID = Id.replace("sha256:", "")
+        if len(fullID) == 64:
+            return fullID
+        try:
+            inspect = super(scClient, self).inspect_image(Id)
+        except docker.errors.NotFound:
             return ""
+        return inspect['Id'].replace("sha256:", "")
+
+    def build_prov(self, **kwargs):
+        """Docker Build that also writes the smart container provenance.
+
+        With inject_build_prov the build adds the provenance itself. The
+        build context gets the provenance files and a Dockerfile that ends
+        by copying them to provfilepath and setting the label, so the
+        result is one image with one provenance layer. Otherwise the image
+        is built and then infected through a container.
+
+        Args:
+            kwargs: docker-py build arguments.
+
+        Returns:
+            Id (str): Full ID of the smart container image.
+
+        """
+        path = kwargs.get('path')
+        fileobj = kwargs.get('fileobj')
+        if not self.inject_build_prov or (
+                fileobj is None and not (path and os.path.isdir(path))):
+            Id = self.build(**kwargs)
+            return self.infect_image(Id, **kwargs) or Id
+        try:
+            context = self.provenance_context(
+                self.buildStateChange, path=kwargs.pop('path', None),
+                fileobj=kwargs.pop('fileobj', None),
+                custom_context=kwargs.pop('custom_context', False),
+                dockerfile=kwargs.pop('dockerfile', None))
         finally:
-            if "fileobj" in kwargs:
-                kwargs["fileobj"].close()
+            if fileobj is not None:
+                fileobj.close()
+        kwargs.pop('encoding', None)
+        return self.build(fileobj=context, custom_context=True,
+                          dockerfile=self.build_dockerfile, **kwargs)
+
+    def buildStateChange(self, source):
+        """Get the provenance files and the label of a build.
+
+        The generated Dockerfile replaces the provenance files and label
+        the image inherits from its base image, so when the base image is
+        a smart container the build is appended to its provenance. A base
+        image that is not local is pulled first, as the build would pull
+        it anyway.
+
+        Args:
+            source (str): Dockerfile of the build.
+
+        Returns:
+            (files, label): (filename, data) pairs to write to provfilepath
+        and the label dictionary.
+
+        """
+        existing = None
+        try:
+            base = dockerfileParser.base_image(dockerfileParser.parse(source))
+        except ValueError:
+            # Left for the daemon to report.
+            base = None
+        if base not in (None, 'scratch'):
+            try:
+                try:
+                    inspect = self.inspect_image(base)
+                except docker.errors.NotFound:
+                    self.pull(base)
+                    inspect = self.inspect_image(base)
+            except (docker.errors.DockerException,
+                    requests.exceptions.RequestException):
+                # A base named with a build argument can't be inspected.
+                inspect = None
+            if inspect is not None and \
+                    self.label_prefix in self.image_labels(inspect):
+                existing = self.readImageProv(inspect['Id'])
+        return self.stateChange(existing=existing)
+
+    def provenance_context(self, provenance, path=None, fileobj=None,
+                           custom_context=False, dockerfile=None):
+        """Create a build context that adds provenance to the image.
+
+        Args:
+            provenance: Called with the Dockerfile text, returns the
+        (filename, data) provenance files and the labels to set on the
+        image.
+            path: Build context directory.
+            fileobj: Dockerfile, or a tar context with custom_context.
+            custom_context (bool): fileobj is a tar build context.
+            dockerfile: Dockerfile name inside the context.
+
+        Returns:
+            context (file): Uncompressed tar of the build context, seeked
+        to the start.
+
+        """
+        dockerfile = os.path.normpath(dockerfile or 'Dockerfile')
+        context = tempfile.TemporaryFile()
+        tar = tarfile.open(mode='w', fileobj=context)
+        source = ignore = None
+        if custom_context:
+            original = tarfile.open(fileobj=fileobj, mode='r|*')
+            for member in original:
+                name = os.path.normpath(member.name)
+                data = original.extractfile(member) if member.isfile() \
+                    else None
+                if name == '.dockerignore' and data is not None:
+                    ignore = data.read()
+                    continue
+                if name == dockerfile and data is not None:
+                    source = data.read()
+                    data = io.BytesIO(source)
+                tar.addfile(member, data)
+            original.close()
+        elif fileobj is not None:
+            source = fileobj.read()
+            tar.addfile(self.context_member('Dockerfile', source),
+                        io.BytesIO(source))
+        else:
+            root = os.path.abspath(path)
+            exclude = None
+            if os.path.exists(os.path.join(root, '.dockerignore')):
+                with open(os.path.join(root, '.dockerignore')) as f:
+                    ignore = f.read()
+                exclude = list(filter(bool, ignore.splitlines()))
+            for name in sorted(docker.utils.exclude_paths(
+                    root, exclude or [], dockerfile=dockerfile)):
+                if name != '.dockerignore':
+                    tar.add(os.path.join(root, name), arcname=name,
+                            recursive=False)
+            with open(os.path.join(root, dockerfile)) as f:
+                source = f.read()
+        if source is None:
+            raise TypeError("Build context has no %s" % dockerfile)
+        files, label = provenance(source)
+
+        contextdir = os.path.dirname(self.build_dockerfile)
+        if ignore is not None:
+            # Make sure the daemon does not drop the provenance files.
+            ignore = ignore.rstrip('\n') + '\n!' + contextdir + '\n'
+            tar.addfile(self.context_member('.dockerignore', ignore),
+                        io.BytesIO(ignore))
+        sources = []
+        for filename, data in files:
+            name = os.path.join(contextdir, filename)
+            tar.addfile(self.context_member(name, data), io.BytesIO(data))
+            sources.append(name)
+        escape = dockerfileParser.directives(source).get('escape', '\\')
+        labels = " ".join('%s=%s' % (key, dockerfile_quote(value, escape))
+                          for key, value in sorted(label.items()))
+        # Labels are byte strings unless a value was decoded JSON text.
+        if isinstance(labels, unicode):
+            labels = labels.encode('utf-8')
+        generated = "%s\nCOPY %s %s\nLABEL %s\n" % (
+            source.rstrip('\n'), " ".join(sources), self.provfilepath,
+            labels)
+        tar.addfile(self.context_member(self.build_dockerfile, generated),
+                    io.BytesIO(generated))
+        tar.close()
+        context.seek(0)
+        return context
+
+    def context_member(self, name, data):
+        """Create the tar header of a generated build context file.
+
+        Args:
+            name: Path inside the context.
+            data (str): File contents.
+
+        Returns:
+            member (TarInfo): Header for the file.
+
+        """
+        member = tarfile.TarInfo(name=name)
+        member.size = len(data)
+        member.mtime = int(time.time())
+        member.mode = 0o644
+        return member
 
     def put_label_image(self, image, label, *args, **kwargs):
         """Write a new label to a new image.
@@ -154,18 +796,45 @@ class scClient(docker.Client):
 
         """
         # Copies file from container to local machine.
-        # File transmits as a tar stream. Saves to local disk as tar.
-        # Extracts file for local manipulation.
-        tarObj, stats = super(scClient,
-                              self).get_archive(container=containerid,
-                                                path=path + filename)
-        with open('temp.tar', 'w') as destination:
-            for line in tarObj:
-                destination.write(line)
-            destination.seek(0)
-            thisTar = tarfile.TarFile(destination.name)
-            thisTar.extract(filename)
-            os.remove('temp.tar')
+        # File transmits as a tar stream that is unpacked in memory.
+        # Writes file for local manipulation.
+        data = self.bufferCopyOut(containerid, filename, path)
+        if data is not None:
+            with open(filename, 'wb') as destination:
+                destination.write(data)
+
+    def bufferCopyOut(self, containerid, filename, path):
+        """Copy file from container into memory.
+
+            Reads the archive stream incrementally without touching disk.
+
+        Args:
+            containerid: Container ID
+            filename: Name of file to be copied out.
+            path: Path in the container where the file is stored.
+        Returns:
+            data (str): File contents, or None if the file is not in the
+        archive.
+
+        """
+        # get_archive returns the raw response, so the tar is read as a
+        # stream and only the requested member is held in memory.
+        try:
+            tarObj, stats = super(scClient,
+                                  self).get_archive(container=containerid,
+                                                    path=path + filename)
+        except docker.errors.NotFound:
+            return None
+        thisTar = tarfile.open(fileobj=tarObj, mode='r|')
+        try:
+            for member in thisTar:
+                if member.isfile() and \
+                        os.path.basename(member.name) == filename:
+                    return thisTar.extractfile(member).read()
+        finally:
+            thisTar.close()
+            tarObj.close()
+        return None
 
     def fileCopyIn(self, containerid, filename, path):
         """Copy file from local machine to container.
@@ -184,28 +853,111 @@ class scClient(docker.Client):
         with self.simple_tar(filename) as thisTar:
             super(scClient, self).put_archive(containerid, path, thisTar)
 
-    def hasProv(self, containerid, filename, path):
-        """Check for Smart Container directory inside container.
+    def bufferCopyIn(self, containerid, data, filename, path):
+        """Copy file contents from memory to container.
+
+            Creates an in-memory tar for transfer.
 
         Args:
             containerid: Container ID
-            filename: Name of file to be copied in.
-            path: Path in the container where file should be copied.
+            data (str): File contents to be copied in.
+            filename: Name of file to be written.
+            path: Path in the container where file should be written.
         Returns: Nothing.
 
         """
-        # Get a directory listing from the
-        #      target directory inside the container.
-        # Examine the directory contents for the provenance file.
-        # Return true if found, false if not found.
-        execid = super(scClient, self).exec_create(container=containerid,
-                                                   stdout=True,
-                                                   cmd='ls ' + path)
-        text = super(scClient, self).exec_start(exec_id=execid)
-        if 'SCProv.jsonld' in text:
-            return True
+        self.bufferCopyInFiles(containerid, [(filename, data)], path)
+
+    def bufferCopyInFiles(self, containerid, files, path):
+        """Copy several files from memory to container in one transfer.
+
+        Args:
+            containerid: Container ID
+            files (list): (filename, data) pairs to be written.
+            path: Path in the container where files should be written.
+        Returns: Nothing.
+
+        """
+        # Archive members carry the full path so they are extracted at root.
+        super(scClient, self).put_archive(containerid, '/',
+                                          self.buffer_tar_files(files, path))
+        for filename, data in files:
+            self._prov_cache[(containerid,
+                              os.path.join(path, filename))] = True
+
+    def hasProv(self, containerid, filename, path):
+        """Check for Smart Container provenance file inside container.
+
+            Uses a metadata-only archive stat, so no process is started in
+            the container and stopped or shell-less containers work. The
+            result is cached per container ID.
+
+        Args:
+            containerid: Container ID
+            filename: Name of the provenance file.
+            path: Path in the container where the file is stored.
+        Returns:
+            found (bool): True if the provenance file exists.
+
+        """
+        key = (containerid, os.path.join(path, filename))
+        if key not in self._prov_cache:
+            stat = self.archive_stat(containerid, key[1])
+            self._prov_cache[key] = stat is not None
+        return self._prov_cache[key]
+
+    def hasAnyProv(self, containerid):
+        """Check for any Smart Container provenance file inside container.
+
+        Args:
+            containerid: Container ID
+        Returns:
+            found (bool): True if a provenance file exists.
+
+        """
+        names = [self.provfilename]
+        if self.incremental_prov:
+            names.insert(0, self.provnquadsname)
+        for name in names:
+            if self.hasProv(containerid, name, self.provfilepath):
+                return True
         return False
 
+    def forget_prov(self, containerid):
+        """Drop cached provenance checks for a container.
+
+        Args:
+            containerid: Container ID
+
+        Returns: Nothing.
+
+        """
+        for key in [k for k in self._prov_cache if k[0] == containerid]:
+            del self._prov_cache[key]
+
+    def archive_stat(self, containerid, path):
+        """Stat a path inside a container without transferring it.
+
+            Issues a HEAD request on the container archive endpoint.
+
+        Args:
+            containerid: Container ID
+            path: Path in the container.
+        Returns:
+            stat (dict): Path stat from the daemon, or None if the path
+        does not exist.
+
+        """
+        url = self._url('/containers/{0}/archive', containerid)
+        res = self.head(url, params={'path': path}, timeout=self.timeout)
+        if res.status_code == 404:
+            return None
+        self._raise_for_status(res)
+        encoded_stat = res.headers.get('x-docker-container-path-stat')
+        if encoded_stat:
+            return docker.utils.decode_json_header(encoded_stat)
+        return {}
+
     def simple_tar(self, path):
         """Create tarfile.
 
@@ -232,6 +984,43 @@ class scClient(docker.Client):
         f.seek(0)
         return f
 
+    def buffer_tar(self, data, filename, path):
+        """Create tar archive in memory.
+
+        Args:
+            data (str): File contents.
+            filename: Name of file inside the archive.
+            path: Directory of the file inside the archive.
+
+        Returns:
+            tar (str): Tar archive bytes.
+
+        """
+        return self.buffer_tar_files([(filename, data)], path)
+
+    def buffer_tar_files(self, files, path):
+        """Create tar archive of several files in memory.
+
+        Args:
+            files (list): (filename, data) pairs.
+            path: Directory of the files inside the archive.
+
+        Returns:
+            tar (str): Tar archive bytes.
+
+        """
+        f = io.BytesIO()
+        tar = tarfile.open(mode='w', fileobj=f)
+        for filename, data in files:
+            member = tarfile.TarInfo(
+                name=os.path.join(path, filename).lstrip('/'))
+            member.size = len(data)
+            member.mtime = int(time.time())
+            member.mode = 0o644
+            tar.addfile(member, io.BytesIO(data))
+        tar.close()
+        return f.getvalue()
+
     def infect_image(self, image, *args, **kwargs):
         """Create new smart container from image.
 
@@ -245,65 +1034,129 @@ class scClient(docker.Client):
         """
         # Look for the smart container label, if it exists return none
         myInspect = super(scClient, self).inspect_image(image)
-        labels = myInspect['ContainerConfig']['Labels']
-        if labels is not None:
-            if self.label_prefix in myInspect['ContainerConfig']['Labels']:
-                return None
+        if self.label_prefix in self.image_labels(myInspect):
+            return None
 
-        # Get label contents in dictionary form
-        newlabel = self.scmd.labelDictionary(self.label_prefix)
+        # Get the provenance and label contents of this state change
+        files, newlabel = self.stateChange()
 
         # Get new container from image.
         newContainer = super(scClient, self).create_container(image=image,
                                                               command="/bin/sh",
                                                               labels=newlabel)
         ContainerID = str(newContainer['Id'])
-        super(scClient, self).start(ContainerID)
-
-        # Get metadata.
-        self.scmd.appendData(self.provfilename)
-
-        # Copy file into container.
-        self.fileCopyIn(newContainer, self.provfilename, "/")
-        # Remove local copy of provenance file
-        os.remove(self.provfilename)
-
-        # Commit the container changes
-        if 'path' in kwargs:
-            del kwargs['path']
-
-        tName = ""
-        if 'tag' in kwargs:
-            tName = kwargs['tag']
-            del kwargs['tag']
-
-        newImage = super(scClient, self).commit(container=ContainerID, *args,
-                                                **kwargs)
-        # Update Tag
-        if tName is not "":
-            repository = ""
-            tag = ""
-
-            parts = tName.split(":")
-            repository = parts[0]
-            if len(parts) is 1:
-                tag = "latest"
-            else:
-                tag = parts[1]
+        try:
+            super(scClient, self).start(ContainerID)
 
-            super(scClient, self).tag(image=str(newImage['Id']).replace("sha256:", ""), repository=repository, tag=tag)
+            # Copy the metadata into the container.
+            self.bufferCopyInFiles(ContainerID, files, self.provfilepath)
 
-        # Stop container
-        super(scClient, self).stop(ContainerID)
-        super(scClient, self).remove_container(ContainerID)
+            # Commit the container changes
+            if 'path' in kwargs:
+                del kwargs['path']
+
+            tName = ""
+            if 'tag' in kwargs:
+                tName = kwargs['tag']
+                del kwargs['tag']
+
+            newImage = super(scClient, self).commit(container=ContainerID,
+                                                    *args, **kwargs)
+            # Update Tag
+            if tName is not "":
+                repository = ""
+                tag = ""
+
+                parts = tName.split(":")
+                repository = parts[0]
+                if len(parts) is 1:
+                    tag = "latest"
+                else:
+                    tag = parts[1]
+
+                super(scClient, self).tag(image=str(newImage['Id']).replace("sha256:", ""), repository=repository, tag=tag)
+        finally:
+            # Remove the container, also when a step above failed.
+            super(scClient, self).remove_container(ContainerID, force=True)
+            self.forget_prov(ContainerID)
         newImageID = str(newImage['Id'])
+        names = []
+        if not catalog.HEX_ID.match(image):
+            names.append((image, myInspect['Id']))
+        if tName:
+            names.append((tName, newImageID))
+        self.record_lineage(myInspect['Id'], newImageID, names)
         return newImageID
 
-    def get_label_image(self, imageID):
+    def infect_images(self, images=None, filters=None, workers=8,
+                      callback=None, retag=False):
+        """Create smart containers from many images concurrently.
+
+        Without images, every image matching filters is infected, except
+        those that already have the smartcontainer label. Both are found
+        with one image listing each.
+
+        Args:
+            images (list): Image names or IDs to infect, or None.
+            filters (dict): docker images filters used without images.
+            workers (int): Number of images infected at once.
+            callback: Called with each result as it completes.
+            retag (bool): Move the repository tags of each image found
+        with filters to the smart container made from it.
+
+        Returns:
+            results (list): One dict per image with the image, the new
+        image Id (None if it was already a Smart Container), the error
+        message or None, and the seconds it took, in image order.
+
+        """
+        if images is None:
+            labelled = set(self.images(
+                quiet=True, filters={'label': self.label_prefix}))
+            jobs = [(image['Id'], [tag for tag in image.get('RepoTags') or []
+                                   if retag and tag != '<none>:<none>'])
+                    for image in self.images(filters=filters)
+                    if image['Id'] not in labelled]
+        else:
+            jobs = [(image, []) for image in images]
+        if not jobs:
+            return []
+        # Build the provenance graph once before the workers share it.
+        graphRegistry.get_registry().build_graph()
+        pool = ThreadPool(max(1, min(workers, len(jobs))))
+        results = {}
+        try:
+            for result in pool.imap_unordered(self._infect_job, jobs):
+                results[result['image']] = result
+                if callback is not None:
+                    callback(result)
+        finally:
+            pool.close()
+        return [results[image] for image, tags in jobs]
+
+    def _infect_job(self, job):
+        """Infect one image of infect_images and time it."""
+        image, tags = job
+        start = time.time()
+        result = {'image': image, 'Id': None, 'error': None}
+        try:
+            result['Id'] = self.infect_image(image)
+            for repotag in tags if result['Id'] else []:
+                repository, tag = repotag.rsplit(':', 1)
+                self.tag(result['Id'], repository, tag, force=True)
+        except (docker.errors.DockerException,
+                requests.exceptions.RequestException) as error:
+            result['error'] = str(error)
+        result['seconds'] = time.time() - start
+        return result
+
+    def get_label_image(self, imageID, resolve=True):
         """Get Smart Container Metadata Label from image.
 
         Args:
             imageID: Id for image that label is requested
+            resolve (bool): Decode a compressed label and replace a graph
+        reference label with the graph it points to.
 
         Returns:
             metadata: Label String in JSON-LD
@@ -311,13 +1164,53 @@ class scClient(docker.Client):
         """
         # Look for the smart container label, if it exists return none
         myInspect = super(scClient, self).inspect_image(imageID)
-        labels = myInspect['ContainerConfig']['Labels']
-        if labels is not None:
+        labels = self.image_labels(myInspect)
+        if labels:
+            summary = None
+            if resolve and self.label_prefix in labels:
+                labels[self.label_prefix] = self.scmd.decodeLabel(
+                    labels[self.label_prefix])
+                summary = self.scmd.readReference(labels[self.label_prefix])
+            if summary is not None:
+                # Only fetch the provenance file when the local store
+                # does not have the graph.
+                data = self.scmd.resolveReference(summary, self.store)
+                if data is None:
+                    # Labels written before the summary named the file
+                    # were written from the JSON-LD file.
+                    provdata = self.imageCopyOut(
+                        imageID, summary.get('file', self.provfilename),
+                        self.provfilepath)
+                    data = self.scmd.resolveReference(summary, self.store,
+                                                      provdata)
+                if data is not None:
+                    labels[self.label_prefix] = data
             # print json.dumps(labels, ensure_ascii=False, sort_keys=True, indent=4,
             #                 separators=(',', ':')).encode('utf8')
             return json.dumps(labels)
         return None
 
+    def imageCopyOut(self, imageID, filename, path):
+        """Copy file from an image into memory.
+
+            Uses a container that is created but never started.
+
+        Args:
+            imageID: Image ID
+            filename: Name of file to be copied out.
+            path: Path in the image where the file is stored.
+        Returns:
+            data (str): File contents, or None if the file is not found.
+
+        """
+        newContainer = super(scClient, self).create_container(
+            image=imageID, command="/bin/sh")
+        ContainerID = str(newContainer['Id'])
+        try:
+            return self.bufferCopyOut(ContainerID, filename, path)
+        finally:
+            super(scClient, self).remove_container(ContainerID)
+
     def get_label_container(self, containerID):
         """Get Smart Container Metadata Label from a container.
 
@@ -93,5 +93,21 @@ class ConfigManager(object):
                 ctgfile.close()
                 return 'Configration could not be read or parsed correctly'
 
-configmanager = ConfigManager()
-configmanager.read_config()
+
+# The user configuration is read on first use, not on import.
+configmanager = None
+
+
+def get_config():
+    """Return the process-wide configuration, reading it on first use.
+
+    Returns
+    -------
+    :returns configmanager: ConfigManager
+        Configuration with the user graph parsed.
+    """
+    global configmanager
+    if configmanager is None:
+        configmanager = ConfigManager()
+        configmanager.read_config()
+    return configmanager
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""Content-addressed store for SmartContainers provenance graphs.
+
+Serialized graphs are stored under SC_HOME by the sha256 digest of their
+contents, so a docker label only has to carry the digest. Objects are
+written once and never modified, which makes the store safe to share between
+concurrent sc processes.
+"""
+import hashlib
+import os
+import tempfile
+
+from util import sc_home
+
+
+def digest(data):
+    """digest: Returns the content address of a byte string.
+
+    Args:
+        data (str): Serialized graph.
+
+    Returns:
+        digest (str): Digest of the form sha256:<hex>.
+
+    """
+    return 'sha256:' + hashlib.sha256(data).hexdigest()
+
+
+class ContentStore(object):
+    """Local content-addressed object store."""
+
+    def __init__(self, root=None):
+        """Initialize a store.
+
+        Args:
+         (Optional) root (str): Store directory, defaults to SC_HOME/objects.
+        """
+        self.root = root or sc_home('objects')
+
+    def path(self, address):
+        """path: Returns the file path of an object.
+
+        Args:
+            address (str): Digest of the form sha256:<hex>.
+
+        Returns:
+            path (str): Location of the object in the store.
+
+        """
+        algorithm, hexdigest = address.split(':', 1)
+        return os.path.join(self.root, algorithm, hexdigest[:2], hexdigest)
+
+    def put(self, data):
+        """put: Store an object.
+
+        Args:
+            data (str): Serialized graph.
+
+        Returns:
+            address (str): Digest the object is stored under.
+
+        """
+        address = digest(data)
+        path = self.path(address)
+        if not os.path.exists(path):
+            directory = os.path.dirname(path)
+            if not os.path.isdir(directory):
+                try:
+                    os.makedirs(directory)
+                except OSError:
+                    if not os.path.isdir(directory):
+                        raise
+            # Write to a temporary file first so readers never see a
+            # partially written object.
+            handle, tmppath = tempfile.mkstemp(dir=directory)
+            with os.fdopen(handle, 'wb') as tmpfile:
+                tmpfile.write(data)
+            os.rename(tmppath, path)
+        return address
+
+    def get(self, address):
+        """get: Fetch an object.
+
+        Args:
+            address (str): Digest of the form sha256:<hex>.
+
+        Returns:
+            data (str): Serialized graph, or None if it is not in the store.
+
+        """
+        try:
+            with open(self.path(address), 'rb') as objfile:
+                return objfile.read()
+        except IOError:
+            return None
+
+    def has(self, address):
+        """has: Check for an object.
+
+        Args:
+            address (str): Digest of the form sha256:<hex>.
+
+        Returns:
+            found (bool): True if the object is in the store.
+
+        """
+        return os.path.exists(self.path(address))
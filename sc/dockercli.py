@@ -13,22 +13,106 @@ from util import which
 import getopt
 import os
 import os.path
-import requests
+import pipes
+import shlex
 import stat
 import subprocess
+import sys
+import time
 
-import docker.tls as tls
-
-import client
+# docker-py and the provenance client are imported when the client is first
+# used, so commands passed through to docker do not load them.
 
 # We need to docker version greater than 1.6.0 to support
 # the label functionality.
 min_docker_version = '1.6.0'
 
 # Default docker commands that sc can handle.
-snarf_docker_commands = ['commit', 'build', 'stop', 'run']
+snarf_docker_commands = ['commit', 'build']
 # Default docker label key where smart container graph is stored.
 smart_container_key = 'sc'
+# Docker global options that take a value, as in docker -H host ps.
+global_value_options = ['-H', '--host', '--config', '-l', '--log-level',
+                        '--tlscacert', '--tlscert', '--tlskey']
+# Docker global options that choose the daemon or how to connect to it.
+daemon_options = ['-H', '--host', '--config', '--tls', '--tlsverify',
+                  '--tlscacert', '--tlscert', '--tlskey']
+
+
+def command_argv(command):
+    """command_argv: Returns the argument list of a docker command.
+
+    Args:
+        command (str or list): Docker command line string or arguments,
+        without the docker executable.
+
+    Returns:
+        list: Docker arguments.
+
+    """
+    if isinstance(command, basestring):
+        return shlex.split(command)
+    return list(command)
+
+
+def split_command(argv):
+    """split_command: Splits docker arguments at the subcommand.
+
+    Docker global options and their values come before the subcommand, so
+    they are skipped to find the subcommand token.
+
+    Args:
+        argv (list): Docker arguments.
+
+    Returns:
+        tuple: Global options, the subcommand or None, and the subcommand
+        arguments.
+
+    """
+    index = 0
+    while index < len(argv):
+        token = argv[index]
+        if token == '-' or not token.startswith('-'):
+            return argv[:index], token, argv[index + 1:]
+        if token in global_value_options:
+            index += 1
+        index += 1
+    return argv, None, []
+
+
+def selects_daemon(options):
+    """selects_daemon: Returns True if docker global options choose a daemon
+    or connection other than the one in the environment.
+
+    Args:
+        options (list): Docker global options.
+
+    Returns:
+        bool: An option such as -H or --tlsverify is present.
+
+    """
+    for token in options:
+        name = token.split('=', 1)[0]
+        if name in daemon_options or token.startswith('-H'):
+            return True
+    return False
+
+
+def captures(command):
+    """captures: Returns True if sc records provenance for a command.
+
+    Commands for a daemon chosen with global options are passed through,
+    as the scClient connects to the daemon in the environment.
+
+    Args:
+        command (str or list): Docker command line string or arguments.
+
+    Returns:
+        bool: The command is handled by the scClient.
+
+    """
+    options, name, args = split_command(command_argv(command))
+    return name in snarf_docker_commands and not selects_daemon(options)
 
 
 class Error(Exception):
@@ -99,7 +183,7 @@ class DockerCli:
     docker_cert_path = None      #: Docker cert path environment variable.
     docker_machine_name = None   #: Docker machine name env variable.
     docker_socket_file = None    #: Path to docker socket file.
-    dcli = None                  #: docker-py client object.
+    _dcli = None                 #: docker-py client object.
     docker_machine = False       #: Using Docker machine instead of sockets.
 
     def __init__(self):
@@ -136,9 +220,36 @@ class DockerCli:
             raise DockerNotFoundError("Couldn't find socket file or"
                                       "Environment variables for docker.")
 
-        # Setup the docker client connections based on what we've found.
         if (self.docker_host and self.docker_machine_name and
                 self.docker_cert_path):
+            self.docker_machine = True
+        elif not self.docker_socket_file:
+            raise DockerNotFoundError("Docker Client cannot find server.")
+        # Test for dcli to make sure it can talk to client.
+        # self.test_docker_version()
+        # self.test_docker_connection()
+
+    @property
+    def dcli(self):
+        """docker-py client object, created on first use."""
+        if self._dcli is None:
+            self._dcli = self.create_client()
+        return self._dcli
+
+    def create_client(self):
+        """create_client: Connect a scClient to the docker server.
+
+        The client is shared by every DockerCli in the process, so the
+        connection and API version are only set up once.
+
+        Returns:
+            scClient: Client using the connection variables found by init.
+
+        """
+        import client
+        # Setup the docker client connections based on what we've found.
+        if self.docker_machine:
+            import docker.tls as tls
             tls_config = tls.TLSConfig(
                 client_cert=(os.path.join(self.docker_cert_path, 'cert.pem'),
                              os.path.join(self.docker_cert_path, 'key.pem')),
@@ -146,22 +257,11 @@ class DockerCli:
                 verify=True,
                 assert_hostname=False
             )
-        # # Replace tcp: with https: in docker host.
+            # Replace tcp: with https: in docker host.
             docker_host_https = self.docker_host.replace("tcp", "https")
-            self.dcli = client.scClient(base_url=docker_host_https,
-                                        tls=tls_config, version="auto")
-            self.docker_machine = True
-        # #print self.dcli.info()
-        elif (self.docker_socket_file):
-            self.dcli = client.scClient(base_url=self.docker_socket_file,
-                                        version="auto")
-
-        # Assert dcli is not none;
-        if self.dcli is None:
-            raise DockerNotFoundError("Docker Client cannot find server.")
-        # Test for dcli to make sure it can talk to client.
-        # self.test_docker_version()
-        # self.test_docker_connection()
+            return client.get_client(docker_host_https, tls=tls_config)
+        else:
+            return client.get_client(self.docker_socket_file)
 
     def check_docker_connection(self):
         """check_docker_connection: Docker connections.
@@ -192,6 +292,7 @@ class DockerCli:
             raise DockerDaemonConnectionError("Docker cannot connect to daemon")
 
         # Check dcli can connect to server.
+        import requests
         try:
             self.dcli.ping()
         except requests.exceptions.ConnectionError:
@@ -222,58 +323,78 @@ class DockerCli:
             raise DockerInsuficientVersionError(
                 "Please  make sure docker is greater than %s" % min_version)
 
-    def do_command(self, command):
+    def do_command(self, command, replace=False):
         """do_command: main entry point for capturing docker commands.
 
         Commands that don't require provenance capture and annotation are
         passed verbatim to the docker client command line utility. All other
         commands are parsed and passed to the scClient docker-py client which
         executes the equivalent docker command line and and processes the
-        provenance metadata.
+        provenance metadata. Commands are matched on the docker subcommand,
+        so arguments such as --name commit-bot are not captured.
 
         Args:
-            command (str): Docker command line string.
+            command (str or list): Docker command line string or arguments.
+            replace (bool): Replace this process with docker for commands
+                that are passed through, instead of waiting for it.
+
+        Returns:
+            int: Exit status of a passed through docker command, else 0.
 
         """
-        # First run the command and capture the output.
-        # For efficiency this should probably change such that
-        # if a command doesn't have a capture handler we execute
-        # the command uncaptured. Most commands are going to be captured
-        # for provenance, so this efficiency concern is probably moot.
-
-        cmd_string = str(self.location) + ' ' + command
-        capture_flag = False
-
-        for name in snarf_docker_commands:
-            if name in command:
-                if name == 'build':
-                    capture_flag = True
-                    build_args = self.capture_cmd_build(cmd_string)
-                    try:
-                        default = self.dcli.build(**build_args)
-                        self.dcli.infect_image(default, **build_args)
-                    except TypeError as error:
-                        print(error)
-                        # Did not pass a path/fileobj.
-                        # Run native docker build command
-                        #  (probably a --help, or similar).
-                        capture_flag = False
-                elif name == 'commit':
-                    self.capture_cmd_commit(cmd_string)
-                    capture_flag = True
-        if not capture_flag:
-            subprocess.call(cmd_string, shell=True)
-
-    def capture_cmd_commit(self, cmd_string):
+        argv = command_argv(command)
+        options, name, args = split_command(argv)
+        if not captures(argv):
+            return self.passthrough(argv, replace)
+
+        if name == 'build':
+            import client
+            build_args = self.capture_cmd_build(args)
+            try:
+                self.dcli.build_prov(**build_args)
+                return 0
+            except client.BuildError as error:
+                print(error)
+                return 1
+            except TypeError as error:
+                print(error)
+                # Did not pass a path/fileobj.
+                # Run native docker build command
+                #  (probably a --help, or similar).
+        elif name == 'commit':
+            self.capture_cmd_commit([self.location] + argv)
+            return 0
+        return self.passthrough(argv, replace)
+
+    def passthrough(self, argv, replace=False):
+        """passthrough: Run a docker command without capturing it.
+
+        Args:
+            argv (list): Docker arguments.
+            replace (bool): Exec docker in place of this process, so no
+                python or shell process stays resident while it runs.
+
+        Returns:
+            int: Exit status of docker when not replacing the process.
+
+        """
+        if replace:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.execv(self.location, [self.location] + argv)
+        return subprocess.call([self.location] + argv)
+
+    def capture_cmd_commit(self, argv):
         """TODO: Docstring for capture_cmd_commit.
 
         Args:
-            cmd_string (TODO): TODO
+            argv (list): Command line arguments, starting with the docker
+                executable.
 
         Returns: TODO
 
         """
-        print cmd_string
+        print ' '.join(pipes.quote(arg) for arg in argv)
         pass
 
     # Native docker to docker-py options.
@@ -319,7 +440,8 @@ class DockerCli:
         """Captures and parses the native docker build command.
 
         Args:
-            command (str): String containing 'build' and options.
+            command (str or list): Command line string starting with the
+                docker executable and 'build', or the build arguments.
 
         Returns:
             (dict): Build data to pass to docker-py.
@@ -331,7 +453,10 @@ class DockerCli:
         short_options += "".join(self.no_arg_short_options)
         long_options.extend(self.no_arg_long_options)
 
-        command_arguments = command.split()[2:]  # Ignore 'docker' and 'build'.
+        if isinstance(command, basestring):
+            command_arguments = command.split()[2:]  # Ignore 'docker' and 'build'.
+        else:
+            command_arguments = list(command)
         try:
             opts, args = getopt.gnu_getopt(command_arguments, short_options,
                                            long_options)
@@ -373,9 +498,13 @@ class DockerCli:
                     else:
                         data[option_value] = self.value_mapping[option_value]
             elif option == "file" or option == "f":
-                file_obj = open(a)
-                data["fileobj"] = file_obj
-                del data["path"]
+                # docker-py takes the Dockerfile relative to the context.
+                dockerfile = os.path.relpath(os.path.abspath(a),
+                                             os.path.abspath(data["path"]))
+                if dockerfile.startswith(os.pardir):
+                    # Outside the context, leave it to native docker.
+                    return {}
+                data["dockerfile"] = dockerfile
 
         return data
 
@@ -418,3 +547,42 @@ class DockerCli:
 
         """
         print("Result" + self.dcli.infect_image(image))
+
+    def infect_all(self, images=None, filters=None, workers=8, retag=False):
+        """infect_all: Infect many docker images with Provenance.
+
+        Prints the time taken for each image as it completes, then the
+        overall throughput.
+
+        Args:
+            images (list): Image names or IDs, or None for every image
+                without provenance that matches filters.
+            filters (dict): docker images filters.
+            workers (int): Number of images infected at once.
+            retag (bool): Move the tags of each image to its smart
+                container.
+
+        Returns:
+            results (list): Per image results from scClient.infect_images.
+
+        """
+        def report(result):
+            if result['error']:
+                outcome = "failed: " + result['error']
+            elif result['Id']:
+                outcome = result['Id']
+            else:
+                outcome = "already a smart container"
+            print("%s  %6.2fs  %s" % (result['image'], result['seconds'],
+                                      outcome))
+
+        start = time.time()
+        results = self.dcli.infect_images(images, filters, workers, report,
+                                          retag)
+        elapsed = time.time() - start
+        infected = len([r for r in results if r['Id']])
+        failed = len([r for r in results if r['error']])
+        print("Infected %d of %d images in %.1fs (%.2f images/s), %d failed"
+              % (infected, len(results), elapsed,
+                 len(results) / elapsed if elapsed else 0.0, failed))
+        return results
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""Dockerfile parser for SmartContainers.
+
+This module reads a Dockerfile in a single pass and returns its instructions
+as a list of Instruction tuples. It follows the Dockerfile reference:
+ https://docs.docker.com/engine/reference/builder/
+
+ - Parser directives (# escape=` and # syntax=) are read from the top of
+   the file, before any comment, blank line or instruction.
+ - Lines ending in the escape character continue on the next line. Comment
+   and blank lines inside a continued instruction are skipped.
+ - Comment lines are skipped.
+ - Heredocs (RUN <<EOF) in RUN, COPY and ADD instructions are collected
+   with their instruction.
+
+The lines are consumed as they are read, so a Dockerfile can be parsed from
+any iterable of lines, such as an open file, without reading it all first.
+"""
+import collections
+import re
+
+#: Dockerfile instruction. command is upper case, value is the text after the
+#: command, original is the instruction text with continuations joined, line
+#: is the line number it starts on and heredocs holds (name, body) pairs.
+Instruction = collections.namedtuple(
+    'Instruction', ['command', 'value', 'original', 'line', 'heredocs'])
+
+DIRECTIVE = re.compile(r'#\s*([a-zA-Z][a-zA-Z0-9]*)\s*=\s*(.*?)\s*$')
+DIRECTIVES = ('escape', 'syntax')
+ESCAPE_CHARACTERS = ('\\', '`')
+HEREDOC = re.compile(r'<<(-?)(["\']?)([A-Za-z_][A-Za-z0-9_]*)\2')
+HEREDOC_COMMANDS = ('RUN', 'COPY', 'ADD')
+
+
+def parse(lines):
+    """parse: Parse a Dockerfile.
+
+    Args:
+        lines: Dockerfile text, or an iterable of its lines such as an open
+        file.
+
+    Returns:
+        instructions (list): Instruction tuples in file order.
+
+    Raises:
+        ValueError: The escape directive is not a backslash or backtick.
+
+    """
+    if isinstance(lines, basestring):
+        lines = lines.splitlines()
+    return list(iterparse(lines))
+
+
+def directives(lines):
+    """directives: Read the parser directives of a Dockerfile.
+
+    Args:
+        lines: Dockerfile text, or an iterable of its lines.
+
+    Returns:
+        directives (dict): Directive values by lower case name, such as
+        {'escape': '`'}.
+
+    """
+    if isinstance(lines, basestring):
+        lines = lines.splitlines()
+    found = {}
+    for line in lines:
+        match = DIRECTIVE.match(line.strip())
+        if not (match and match.group(1).lower() in DIRECTIVES):
+            break
+        found[match.group(1).lower()] = match.group(2)
+    return found
+
+
+def iterparse(lines):
+    """iterparse: Generator over the instructions of a Dockerfile.
+
+    Args:
+        lines: Iterable of Dockerfile lines.
+
+    Yields:
+        instruction (Instruction): Next instruction.
+
+    """
+    escape = '\\'
+    directives = True
+    parts = []
+    start = 0
+    lines = iter(lines)
+    number = 0
+    for line in lines:
+        number += 1
+        line = line.rstrip('\r\n')
+        stripped = line.strip()
+        if directives:
+            match = DIRECTIVE.match(stripped)
+            if match and match.group(1).lower() in DIRECTIVES:
+                if match.group(1).lower() == 'escape':
+                    escape = match.group(2)
+                    if escape not in ESCAPE_CHARACTERS:
+                        raise ValueError("Invalid escape character %r" %
+                                         escape)
+                continue
+            directives = False
+        if not stripped or stripped.startswith('#'):
+            continue
+        if not parts:
+            start = number
+        text = line.rstrip()
+        if text.endswith(escape):
+            parts.append(text[:-1])
+            continue
+        parts.append(line)
+        original = ''.join(parts).strip()
+        parts = []
+        instruction = split(original, start)
+        if instruction.command in HEREDOC_COMMANDS and '<<' in original:
+            heredocs = []
+            for strip_tabs, _, name in HEREDOC.findall(instruction.value):
+                body = []
+                for line in lines:
+                    number += 1
+                    line = line.rstrip('\r\n')
+                    if strip_tabs:
+                        line = line.lstrip('\t')
+                    if line == name:
+                        break
+                    body.append(line + '\n')
+                heredocs.append((name, ''.join(body)))
+            instruction = instruction._replace(heredocs=tuple(heredocs))
+        yield instruction
+    if parts:
+        yield split(''.join(parts).strip(), start)
+
+
+def base_image(instructions):
+    """base_image: Returns the image the last stage of a Dockerfile builds on.
+
+    FROM flags such as --platform are skipped, and a stage built on an
+    earlier stage is followed to the image that stage builds on.
+
+    Args:
+        instructions (list): Instruction tuples from parse.
+
+    Returns:
+        image (str): Image name, or None without a FROM instruction.
+
+    """
+    stages = {}
+    image = None
+    for instruction in instructions:
+        if instruction.command != 'FROM':
+            continue
+        words = [word for word in instruction.value.split()
+                 if not word.startswith('--')]
+        if not words:
+            continue
+        image = stages.get(words[0].lower(), words[0])
+        if len(words) > 2 and words[1].lower() == 'as':
+            stages[words[2].lower()] = image
+    return image
+
+
+def split(original, line):
+    """split: Split instruction text into its command and value.
+
+    Args:
+        original (str): Instruction text.
+        line (int): Line number the instruction starts on.
+
+    Returns:
+        instruction (Instruction): Instruction without heredocs.
+
+    """
+    words = original.split(None, 1)
+    value = words[1] if len(words) > 1 else ''
+    return Instruction(words[0].upper(), value, original, line, ())
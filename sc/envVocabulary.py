@@ -13,9 +13,11 @@ from rdflib import Literal, BNode, Namespace, URIRef, Graph, Dataset, RDF, RDFS,
 from rdflib.namespace import FOAF
 from rdflib.serializer import Serializer
 import rdflib.resource
-import uuid
+import json
+import multiprocessing
 import platform
-import cpuinfo
+import uuid
+from util import read_json_cache, sc_home, write_json_cache
 
 # Define some namespaces
 PROV = Namespace("http://www.w3.org/ns/prov#")
@@ -37,10 +39,117 @@ dockerUseruuid = str(uuid.uuid4())
 dockerActivityuuid = str(uuid.uuid4())
 dockerEntityuuid = str(uuid.uuid4())
 
+# Docker platform names for the architectures reported by platform.machine.
+ARCHITECTURES = {
+    'x86_64': 'amd64',
+    'amd64': 'amd64',
+    'i386': '386',
+    'i686': '386',
+    'aarch64': 'arm64',
+    'armv7l': 'arm',
+    'ppc64le': 'ppc64le',
+    's390x': 's390x',
+}
+
+# Environment URIs are name based uuids under this namespace, so identical
+# environments share the same nodes across commits.
+ENVIRONMENT_NS = uuid.uuid5(uuid.NAMESPACE_URL,
+                            str(SC) + 'ComputationalEnvironment')
+
+
+def environment_key():
+    """environment_key: Returns the cache key of the host environment.
+
+    The key is made from the boot id, the kernel and a hardware signature,
+    all of which are cheap to read, so a changed host is detected without
+    probing the CPU.
+
+    Returns:
+        key (str): Cache key.
+
+    """
+    try:
+        with open('/proc/sys/kernel/random/boot_id') as boot_id:
+            boot = boot_id.read().strip()
+    except IOError:
+        boot = ''
+    return '|'.join([boot, platform.system(), platform.release(),
+                     platform.machine(), str(multiprocessing.cpu_count())])
+
+
+def probe_environment():
+    """probe_environment: Returns the facts about the host environment.
+
+    Returns:
+        facts (dict): Operating system, architecture, cores and processor.
+
+    """
+    import cpuinfo
+    info = cpuinfo.get_cpu_info()
+    machine = platform.machine().lower()
+    return {
+        'os': platform.system().lower(),
+        'kernel': platform.release(),
+        'architecture': ARCHITECTURES.get(machine, machine),
+        'cores': info.get('count') or multiprocessing.cpu_count(),
+        'processor': info.get('brand', ''),
+    }
+
+
+def environment_uris(facts):
+    """environment_uris: Returns the stable URIs of an environment.
+
+    Args:
+        facts (dict): Facts returned by probe_environment.
+
+    Returns:
+        uris (dict): URI strings for the environment, operating system,
+        processor and architecture nodes.
+
+    """
+    def name(*keys):
+        return str(uuid.uuid5(ENVIRONMENT_NS, json.dumps(
+            [[k, facts[k]] for k in keys])))
+    return {
+        'environment': name(*sorted(facts)),
+        'os': name('os', 'kernel'),
+        'processor': name('processor', 'architecture', 'cores'),
+        'architecture': name('architecture'),
+    }
+
+
+def load_environment(path=None):
+    """load_environment: Returns the cached host environment.
+
+    The environment is probed and cached under SC_HOME when the cache is
+    missing or its key does not match this host.
+
+    Args:
+        (Optional) path (str): Cache file, defaults to environment.json
+        under SC_HOME.
+
+    Returns:
+        environment (dict): key, facts and uris of the host environment.
+
+    """
+    if path is None:
+        path = sc_home('environment.json')
+    key = environment_key()
+    environment = read_json_cache(path)
+    if environment and environment.get('key') == key:
+        return environment
+    facts = probe_environment()
+    environment = {'key': key, 'facts': facts,
+                   'uris': environment_uris(facts)}
+    # An unwritable SC_HOME only costs the probe on the next run.
+    write_json_cache(path, environment)
+    return environment
+
+
 class envVocabulary(baseVocabulary):
 
     def __init__(self):
-        pass
+        super(envVocabulary, self).__init__()
 
     def build(self):
         ds = self.graph
@@ -50,28 +159,27 @@ class envVocabulary(baseVocabulary):
         CE = Namespace("http://dase.cs.wright.edu/ontologies/ComputationalEnvironment#")
         CA = Namespace("http://dase.cs.wright.edu/ontologies/ComputationalActivity#")
         DOCKER = Namespace("http://w3id.org/daspos/docker#")
-        info = cpuinfo.get_cpu_info()
-
-# ISSUES: We want if the architecture URI's to be created only once on
-# build or initial commit. Otherwise, we want to re-read the URI's
-#  from the original graph. There are imm
+        environment = load_environment()
+        facts = environment['facts']
+        uris = environment['uris']
 
         ds.bind("ce", CE)
-        ceuri = URIRef(str(uuid.uuid4()))
+        ceuri = UUIDNS[uris['environment']]
         ds.add((ceuri, RDF.type, CE.ComputationalEnvironment))
 
-        osUri = URIRef(str(uuid.uuid4()))
+        osUri = UUIDNS[uris['os']]
         ds.add((ceuri, CE.hasOperatingSystem, osUri))
-        ds.add((osUri, RDFS.label, Literal("linux")))
+        ds.add((osUri, RDFS.label, Literal(facts['os'])))
 
-        processorUri = URIRef(str(uuid.uuid4()))
+        processorUri = UUIDNS[uris['processor']]
         ds.add((ceuri, CE.hasHardware, processorUri))
 
-        archUri = URIRef(str(uuid.uuid4()))
+        archUri = UUIDNS[uris['architecture']]
         ds.add((processorUri, CE.hasArchitecture,  archUri))
-        ds.add((archUri, RDFS.label, Literal("amd64")))
+        ds.add((archUri, RDFS.label, Literal(facts['architecture'])))
         ds.add((processorUri, CE.hasNumberOfCores,
-                Literal("4", datatype=XSD.nonNegativeInteger)))
+                Literal(str(facts['cores']),
+                        datatype=XSD.nonNegativeInteger)))
 
         # :hasArchitecture
         # :hasNumberOfCores
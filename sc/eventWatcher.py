@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+"""Docker events watcher for SmartContainers.
+
+This module records provenance for containers however they are started,
+by sc, docker or anything else, from the docker daemon's event stream.
+One thread reads the stream and only queues each event, so the daemon and
+the docker commands that caused the events never wait on provenance work.
+Another thread takes the queued events in batches, turns them into
+provenance records and appends each batch to a JSON lines journal with one
+write. The queue is bounded, so a burst the writer can't keep up with is
+held back in the event stream instead of in memory.
+
+If the event stream is lost the watcher reconnects and replays the events
+since the last one it read, dropping any it has already recorded. The time
+of the last recorded event is saved next to the journal, so a restarted
+watcher replays the events from while it was down. Records already in the
+journal are not written again.
+
+Example:
+    watcher = eventWatcher.EventWatcher(myclient)
+    watcher.start()
+    ...
+    watcher.stop()
+"""
+import collections
+import datetime
+import json
+import logging
+import os
+import Queue
+import threading
+import time
+import uuid
+
+import docker
+import requests
+
+from client import build_events
+from util import sc_home
+
+logger = logging.getLogger(__name__)
+
+# Container events recorded by default.
+EVENTS = ('start', 'die', 'commit')
+# Namespace of the record IDs, which are derived from the event so a
+# replayed event gets the ID it had before.
+EVENT_NS = uuid.uuid5(uuid.NAMESPACE_URL, 'http://w3id.org/daspos/docker#event')
+# Marks the end of the queued events.
+STOP = object()
+
+
+def event_fields(event):
+    """event_fields: Read an event in the format of any API version.
+
+    Args:
+        event (dict): Decoded docker event.
+
+    Returns:
+        fields (dict): action, container, image, name, time in seconds,
+    a time key unique to the event and the actor attributes.
+
+    """
+    actor = event.get('Actor') or {}
+    attributes = dict(actor.get('Attributes') or {})
+    seconds = event.get('time') or 0
+    return {
+        'action': event.get('Action') or event.get('status'),
+        'container': actor.get('ID') or event.get('id'),
+        'image': attributes.pop('image', None) or event.get('from'),
+        'name': attributes.pop('name', None),
+        'time': seconds,
+        'key': str(event.get('timeNano') or seconds),
+        'attributes': attributes,
+    }
+
+
+def iso_time(seconds):
+    """iso_time: Returns Unix seconds as an xsd:dateTime string."""
+    return datetime.datetime.utcfromtimestamp(seconds).strftime(
+        '%Y-%m-%dT%H:%M:%SZ')
+
+
+class EventWatcher(object):
+    """Records docker container events to a provenance journal."""
+
+    def __init__(self, client, journal=None, events=EVENTS, batch_size=500,
+                 queue_size=10000, since=None):
+        """Initialize a watcher.
+
+        Args:
+            client (scClient): Client for the docker daemon.
+         (Optional) journal (str): Journal path, defaults to events.jsonl
+        under SC_HOME.
+            events (tuple): Container events to record.
+            batch_size (int): Most events written at once.
+            queue_size (int): Most events read but not yet written.
+         (Optional) since (int): Replay the events since this Unix time,
+        defaults to the time of the last recorded event.
+        """
+        self.client = client
+        self.journal = journal or sc_home('events.jsonl')
+        self.events = list(events)
+        self.batch_size = batch_size
+        self.queue = Queue.Queue(queue_size)
+        self.since = since
+        # Time of the last recorded event, kept next to the journal.
+        self.state = self.journal + '.since'
+        self.reconnect_delay = 1.0
+        self.stopping = threading.Event()
+        # Start times of running containers, for their die records.
+        self.started = {}
+        # IDs of the latest records, to drop events replayed on reconnect.
+        self.recent = collections.deque(maxlen=queue_size)
+        self.recent_ids = set()
+        self.counts = {'events': 0, 'records': 0, 'batches': 0,
+                       'duplicates': 0, 'reconnects': 0, 'errors': 0}
+        self.threads = []
+
+    def start(self):
+        """start: Start reading and recording events in the background."""
+        directory = os.path.dirname(self.journal)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        if self.since is None:
+            self.since = self.load_since()
+        if self.since is not None:
+            self.load_journal(self.since)
+        for target in (self.read_events, self.write_batches):
+            thread = threading.Thread(target=target)
+            # The reader blocks on the event stream, so it can't be joined.
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self, timeout=None):
+        """stop: Record the queued events and stop.
+
+        Args:
+            timeout (float): Seconds to wait for the queue to be written.
+
+        """
+        self.stopping.set()
+        deadline = None if timeout is None else time.time() + timeout
+        writer = self.threads[1]
+        # The writer may have died with the queue full, so don't wait on
+        # it forever.
+        while writer.is_alive():
+            try:
+                self.queue.put(STOP, timeout=1.0)
+                break
+            except Queue.Full:
+                if deadline is not None and time.time() > deadline:
+                    logger.warning("Stopped with %d events not recorded",
+                                   self.queue.qsize())
+                    return
+        if deadline is not None:
+            timeout = max(deadline - time.time(), 0)
+        writer.join(timeout)
+
+    def load_since(self):
+        """load_since: Returns the time of the last recorded event, or None
+        if nothing has been recorded."""
+        try:
+            with open(self.state) as state:
+                return int(state.read().strip())
+        except (IOError, ValueError):
+            return None
+
+    def save_since(self, seconds):
+        """save_since: Save the time of the last recorded event.
+
+        Args:
+            seconds (int): Unix time of the event.
+
+        """
+        temp = self.state + '.tmp'
+        with open(temp, 'w') as state:
+            state.write('%d\n' % seconds)
+        os.rename(temp, self.state)
+
+    def load_journal(self, since):
+        """load_journal: Read the records of the events since a time from
+        the journal, so replayed events are not recorded again.
+
+        Args:
+            since (int): Unix time of the first event replayed.
+
+        """
+        if not os.path.exists(self.journal):
+            return
+        first = iso_time(since)
+        with open(self.journal) as journal:
+            for line in journal:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A write cut short by a crash.
+                    continue
+                if record.get('activity') == 'docker:startOperation':
+                    self.started[record['container']] = record['time']
+                elif record.get('activity') == 'docker:dieOperation':
+                    self.started.pop(record['container'], None)
+                # ISO times in UTC sort as strings.
+                if record.get('time', '') >= first:
+                    self.recent_ids.add(record['id'])
+
+    def running(self):
+        """running: Returns True while the writer is recording events."""
+        return bool(self.threads) and self.threads[1].is_alive()
+
+    def read_events(self):
+        """read_events: Queue events from the daemon until stopped,
+        reconnecting when the stream is lost."""
+        while not self.stopping.is_set():
+            try:
+                stream = self.client.events(
+                    since=self.since, filters={'event': self.events},
+                    decode=False)
+                for event in build_events(stream):
+                    if self.stopping.is_set():
+                        return
+                    self.since = event.get('time') or self.since
+                    self.counts['events'] += 1
+                    # Blocks while the queue is full.
+                    self.queue.put(event)
+            except (docker.errors.DockerException,
+                    requests.exceptions.RequestException, IOError):
+                pass
+            self.counts['reconnects'] += 1
+            self.stopping.wait(self.reconnect_delay)
+
+    def next_batch(self):
+        """next_batch: Wait for an event, then take the others already
+        queued, up to batch_size.
+
+        Returns:
+            (batch, stop): Events, and whether the watcher is stopping.
+
+        """
+        batch = [self.queue.get()]
+        while len(batch) < self.batch_size and batch[-1] is not STOP:
+            try:
+                batch.append(self.queue.get_nowait())
+            except Queue.Empty:
+                break
+        if batch[-1] is STOP:
+            return batch[:-1], True
+        return batch, False
+
+    def write_batches(self):
+        """write_batches: Append the queued events to the journal in
+        batches until stopped.
+
+        A batch that can't be recorded is logged and dropped, so the writer
+        keeps taking events from the queue.
+        """
+        with open(self.journal, 'a') as journal:
+            stop = False
+            while not stop:
+                batch, stop = self.next_batch()
+                try:
+                    self.write_batch(journal, batch)
+                except Exception:
+                    self.counts['errors'] += 1
+                    logger.exception("Could not record %d events",
+                                     len(batch))
+
+    def write_batch(self, journal, batch):
+        """write_batch: Append the records of a batch of events to the
+        journal and save the time of the last event.
+
+        Args:
+            journal (file): Open journal.
+            batch (list): Events.
+
+        """
+        records = [record for record in map(self.record, batch)
+                   if record is not None]
+        if records:
+            journal.write(''.join(json.dumps(record, sort_keys=True) + '\n'
+                                  for record in records))
+            journal.flush()
+            self.counts['records'] += len(records)
+            self.counts['batches'] += 1
+        last = max(event_fields(event)['time'] for event in batch) \
+            if batch else None
+        if last:
+            self.save_since(last)
+
+    def record(self, event):
+        """record: Returns the provenance record of an event, or None if it
+        was recorded before or is not a recorded container event.
+
+        Args:
+            event (dict): Decoded docker event.
+
+        Returns:
+            record (dict): Activity for the event. A die record also has the
+        time the container started, if the watcher saw it.
+
+        """
+        fields = event_fields(event)
+        if fields['action'] not in self.events or not fields['container']:
+            return None
+        name = u'%s %s %s' % (fields['container'], fields['action'],
+                              fields['key'])
+        Id = 'urn:uuid:' + str(uuid.uuid5(EVENT_NS, name.encode('utf-8')))
+        if Id in self.recent_ids:
+            self.counts['duplicates'] += 1
+            return None
+        if len(self.recent) == self.recent.maxlen:
+            self.recent_ids.discard(self.recent[0])
+        self.recent.append(Id)
+        self.recent_ids.add(Id)
+        record = {
+            'id': Id,
+            'activity': 'docker:%sOperation' % fields['action'],
+            'container': fields['container'],
+            'image': fields['image'],
+            'time': iso_time(fields['time']),
+        }
+        if fields['name']:
+            record['name'] = fields['name']
+        if fields['action'] == 'start':
+            self.started[fields['container']] = record['time']
+        elif fields['action'] == 'die':
+            started = self.started.pop(fields['container'], None)
+            if started:
+                record['startedAtTime'] = started
+            if 'exitCode' in fields['attributes']:
+                record['exitCode'] = int(fields['attributes']['exitCode'])
+        return record
@@ -14,10 +14,49 @@ a named graph for each docker state change (build, commit, run). Provenance
  RDFLib Dataset graph object reference:
  https://rdflib.readthedocs.org/en/stable/apidocs/rdflib.html#dataset
 """
+import contextlib
+import logging
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import os
 import rdflib
 from rdflib import URIRef
+import uuid
 import baseVocabulary
 import provVocabulary
+import sqliteStore
+import threading
+import time
+from util import sc_home
+
+logger = logging.getLogger(__name__)
+
+# Backing stores for the global graph and their default location under
+# SC_HOME. The memory store is rebuilt by every sc process.
+STORES = {
+    'memory': None,
+    'sqlite': 'graph.sqlite',
+    'sleepycat': 'graph.bdb',
+}
+
+
+def _build(vocabulary):
+    """Build a vocabulary and return the elapsed seconds."""
+    start = time.time()
+    vocabulary.build()
+    return time.time() - start
+
+
+def _build_in_process(vocabulary_class):
+    """Build a vocabulary in a worker process.
+
+    Graphs do not pickle, so the vocabulary is returned as N-Quads along
+    with its context and the elapsed seconds.
+    """
+    vocabulary = vocabulary_class()
+    elapsed = _build(vocabulary)
+    return (vocabulary.graph.serialize(format='nquads'), vocabulary.context,
+            elapsed)
 
 
 class VocabularyRegistry(object):
@@ -31,6 +70,15 @@ class VocabularyRegistry(object):
     global_context = {}
     built = False
     global_graph = rdflib.Dataset(default_union=True)
+    persistent = False
+    # Vocabularies are built concurrently in a thread pool. Use a process
+    # pool instead for CPU-bound vocabularies.
+    build_workers = 4
+    build_processes = False
+    # Clients running in several threads share the registry.
+    _build_lock = threading.Lock()
+    # Held while a client records one state change.
+    _state_lock = threading.RLock()
 
     def __init__(self, existing_graph=None):
         """Initialize a new registry.
@@ -39,9 +87,103 @@ class VocabularyRegistry(object):
          (Optional) existing_graph (turtle): Add an existing global graph
          to the default graph.
         """
+        # Serializations keyed by format, each stored with the graph
+        # version it was made from.
+        self.version = 0
+        self._serializations = {}
+        # Named graph of the current docker state change, and whether a
+        # state change has been recorded in it.
+        self.graph_uri = URIRef('urn:uuid:' + str(uuid.uuid4()))
+        self.recorded = False
+        # Seconds spent in each vocabulary build, keyed by registry name.
+        self.build_times = {}
         if existing_graph:
             self.global_graph.parse(data=existing_graph, format='turtle')
 
+    # @classmethod
+    def open_store(self, store='sqlite', path=None):
+        """open_store: Back the global graph with a pluggable store.
+
+        Persistent stores keep every state change graph between sc
+        invocations, so opening them does not re-parse any serialization.
+
+        Args:
+            store (str): One of 'memory', 'sqlite' or 'sleepycat'.
+            (Optional) path (str): Store location, defaults to a file or
+            directory under SC_HOME.
+
+        """
+        if store not in STORES:
+            raise ValueError("Unknown graph store: %s" % store)
+        if store == 'memory':
+            self.global_graph = rdflib.Dataset(default_union=True)
+            self.persistent = False
+            self.invalidate()
+            return
+        if path is None:
+            path = sc_home(STORES[store])
+        if store == 'sqlite':
+            backend = sqliteStore.SQLiteStore()
+            directory = os.path.dirname(path)
+        else:
+            backend = rdflib.plugin.get('Sleepycat', rdflib.store.Store)()
+            directory = path
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        dataset = rdflib.Dataset(store=backend, default_union=True)
+        dataset.open(path, create=True)
+        self.global_graph = dataset
+        self.persistent = True
+        self.invalidate()
+
+    # @classmethod
+    def close_store(self):
+        """close_store: Commit and close the global graph store."""
+        self.global_graph.close(commit_pending_transaction=True)
+
+    # @classmethod
+    def invalidate(self):
+        """invalidate: Mark the global graph as changed.
+
+        Bumps the graph version so cached serializations are rebuilt. Call
+        this after adding triples to global_graph directly.
+        """
+        self.version += 1
+
+    # @classmethod
+    def serialize_cached(self, key, serialize):
+        """serialize_cached: Returns a cached serialization.
+
+        Args:
+            key (str): Serialization format.
+            serialize (callable): Builds the serialization on a cache miss.
+
+        Returns:
+            serialization (str): Serialization of the current graph version.
+
+        """
+        cached = self._serializations.get(key)
+        if cached is None or cached[0] != self.version:
+            cached = (self.version, serialize())
+            self._serializations[key] = cached
+        return cached[1]
+
+    # @classmethod
+    def export_graph(self):
+        """export_graph: Returns the graph the serializers write out.
+
+        A persistent store holds every recorded state change, so only the
+        named graph of the current one is exported. Otherwise the whole
+        global graph is exported.
+
+        Returns:
+            graph (Graph): Graph or Dataset to serialize.
+
+        """
+        if self.persistent:
+            return self.global_graph.graph(self.graph_uri)
+        return self.global_graph
+
     # @classmethod
     def get_registry(self):
         """get_registry: Returns the dictionary of all registered vocbularies.
@@ -74,19 +216,94 @@ class VocabularyRegistry(object):
     def build_graph(self):
         """build_graph: Builds a new global graph.
 
-        If the global_graph doesn't exisit, loop through all
-        registered vocabularies, build the vocabulary and
-        merge the vocabulary graph with the global_graph.
+        If the global_graph doesn't exisit, build all registered
+        vocabularies concurrently, each into its own graph, then merge the
+        vocabulary graphs into the named graph in registry name order so
+        the result does not depend on which build finished first. Build
+        times per vocabulary are kept in build_times.
         """
-        if not self.built:
-            for k in self.REGISTRY:
-                print self.REGISTRY[k]
-                self.REGISTRY[k].build()
-                g = self.global_graph.graph(
-                    URIRef('http://www.example.com/gr'))
-                g += self.REGISTRY[k].graph
-                self.global_context.update(self.REGISTRY[k].context)
-            self.built = True
+        with self._build_lock:
+            if not self.built:
+                self._build_vocabularies()
+
+    def _build_vocabularies(self):
+        """Build and merge the registered vocabularies."""
+        names = sorted(self.REGISTRY)
+        vocabularies = [self.REGISTRY[k] for k in names]
+        if self.build_processes and len(vocabularies) > 1:
+            pool = multiprocessing.Pool(
+                min(self.build_workers, len(vocabularies)))
+            try:
+                results = pool.map(_build_in_process,
+                                   [type(v) for v in vocabularies])
+            finally:
+                pool.close()
+            for vocabulary, (nquads, context, elapsed) in zip(
+                    vocabularies, results):
+                vocabulary.graph.parse(data=nquads, format='nquads')
+                vocabulary.context = context
+            times = [result[2] for result in results]
+        elif len(vocabularies) > 1:
+            pool = ThreadPool(min(self.build_workers, len(vocabularies)))
+            try:
+                times = pool.map(_build, vocabularies)
+            finally:
+                pool.close()
+        else:
+            times = [_build(v) for v in vocabularies]
+        self.build_times = dict(zip(names, times))
+        g = self.global_graph.graph(self.graph_uri)
+        for k, vocabulary in zip(names, vocabularies):
+            logger.debug("built %s in %.1f ms", k,
+                         self.build_times[k] * 1000)
+            g += vocabulary.graph
+            self.global_context.update(vocabulary.context)
+        self.global_graph.commit()
+        self.built = True
+        self.invalidate()
+
+    # @classmethod
+    def new_state_change(self):
+        """new_state_change: Start the named graph of a docker state change.
+
+        The first state change is recorded in the graph build_graph made.
+        Each later one gets a fresh graph IRI holding a copy of the
+        vocabulary triples, so separate state changes are never merged into
+        one graph. A memory store drops the graph of the previous state
+        change, a persistent store keeps it.
+
+        Returns:
+            graph_uri (URIRef): Named graph of the state change.
+
+        """
+        with self._state_lock:
+            self.build_graph()
+            if self.recorded:
+                previous = self.graph_uri
+                self.graph_uri = URIRef('urn:uuid:' + str(uuid.uuid4()))
+                g = self.global_graph.graph(self.graph_uri)
+                g += self.global_graph.graph(previous)
+                if not self.persistent:
+                    self.global_graph.remove_graph(previous)
+                self.global_graph.commit()
+                self.invalidate()
+            self.recorded = True
+            return self.graph_uri
+
+    @contextlib.contextmanager
+    def state_change(self):
+        """state_change: Record one docker state change.
+
+        Starts the graph of a new state change and keeps other threads from
+        starting theirs until the block ends, so the serializations made in
+        the block all describe the same graph.
+
+        Yields:
+            graph_uri (URIRef): Named graph of the state change.
+
+        """
+        with self._state_lock:
+            yield self.new_state_change()
 
     # @classmethod
     def get_json_ld(self):
@@ -101,8 +318,9 @@ class VocabularyRegistry(object):
         """
         if not self.built:
             self.build_graph()
-        return self.global_graph.serialize(
-            format='json-ld', context=self.global_context)
+        return self.serialize_cached('json-ld', lambda: (
+            self.export_graph().serialize(format='json-ld',
+                                          context=self.global_context)))
 
     # @classmethod
     def get_turtle(self):
@@ -118,7 +336,31 @@ class VocabularyRegistry(object):
         """
         if not self.built:
             self.build_graph()
-        return self.global_graph.serialize(format='turtle')
+        return self.serialize_cached('turtle', lambda: (
+            self.export_graph().serialize(format='turtle')))
+
+    # @classmethod
+    def get_nquads(self):
+        """get_nquads: Returns N-Quads serialization of the state change.
+
+        Only the named graph built for the current docker state change is
+        serialized, so the output can be appended to an existing N-Quads
+        provenance file without duplicating earlier graphs.
+
+        Returns:
+            nquads (str): N-Quads string object.
+
+        """
+        if not self.built:
+            self.build_graph()
+        return self.serialize_cached('nquads', self._serialize_nquads)
+
+    def _serialize_nquads(self):
+        """Serializes the current state change graph as N-Quads."""
+        state_change = rdflib.ConjunctiveGraph()
+        g = state_change.get_context(self.graph_uri)
+        g += self.global_graph.graph(self.graph_uri)
+        return state_change.serialize(format='nquads')
 
     # @classmethod
     def add_context(self, key, value):
@@ -132,8 +374,9 @@ class VocabularyRegistry(object):
             value (str): IRI that the shortut key identifies.
 
         """
-        if key not in self.context:
+        if key not in self.global_context:
             self.global_context[key] = value
+            self.invalidate()
 
     # @classmethod
     def add_graph(self, existing_graph):
@@ -147,3 +390,5 @@ class VocabularyRegistry(object):
 
         """
         self.global_graph.parse(data=existing_graph, format='turtle')
+        self.global_graph.commit()
+        self.invalidate()
@@ -14,13 +14,34 @@ a named graph for each docker state change (build, commit, run). Provenance
  RDFLib Dataset graph object reference:
  https://rdflib.readthedocs.org/en/stable/apidocs/rdflib.html#dataset
 """
+import os
 import graphManager
 import provVocabulary
 import envVocabulary
-# Create instances of registry and register vocabularies
-scVocabRegistry = graphManager.VocabularyRegistry()
-scProvVocab = provVocabulary.provVocabulary()
-scVocabRegistry.register(scProvVocab)
 
-scEnvVocabulary = envVocabulary.envVocabulary()
-scVocabRegistry.register(envVocabulary)
+# The registry is created on first use so importing sc modules does not
+# build vocabularies or open the graph store.
+scVocabRegistry = None
+
+
+def get_registry():
+    """get_registry: Returns the process-wide vocabulary registry.
+
+    The first call creates the registry, registers the provenance and
+    environment vocabularies and opens the graph store configured in
+    SC_GRAPH_STORE.
+
+    Returns:
+        registry (VocabularyRegistry): Registry of the sc vocabularies.
+
+    """
+    global scVocabRegistry
+    if scVocabRegistry is None:
+        registry = graphManager.VocabularyRegistry()
+        registry.register(provVocabulary.provVocabulary())
+        registry.register(envVocabulary.envVocabulary())
+        # Back the global graph with a persistent store if one is configured.
+        if os.environ.get('SC_GRAPH_STORE'):
+            registry.open_store(os.environ['SC_GRAPH_STORE'])
+        scVocabRegistry = registry
+    return scVocabRegistry
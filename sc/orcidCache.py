@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""Response cache for ORCID lookups.
+
+ORCID profiles and search results change rarely, but every sc config run
+fetched them again from the ORCID public API. This module keeps the
+responses in a SQLite database under SC_HOME, keyed by ORCID iD or by the
+normalized search query. Entries are fresh for a time to live, after which
+they are fetched again. An expired entry is still used when the API can't
+be reached or answers with a server error, so a host that has looked up an
+identity once can resolve it offline. Requests time out, so a network that
+drops packets falls back to the cache too. The cache is bounded in size and evicts the least recently used
+entries first.
+"""
+import json
+import os
+import sqlite3
+import time
+
+import requests
+
+from util import sc_home
+
+# Seconds an entry is used without asking ORCID again.
+DEFAULT_TTL = 7 * 24 * 3600
+# Bytes of responses kept.
+DEFAULT_MAX_SIZE = 16 * 1024 * 1024
+# Seconds to wait for ORCID to connect or answer.
+DEFAULT_TIMEOUT = 10
+# Lucene operators, which are case sensitive.
+OPERATORS = ('AND', 'OR', 'NOT', 'TO')
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS responses "
+    "(key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+    "stored REAL NOT NULL, used REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS responses_used ON responses (used)",
+]
+
+
+def normalize_query(query):
+    """normalize_query: Returns the cache key form of a search query.
+
+    Whitespace is collapsed and terms are lower cased, as ORCID search is
+    not case sensitive, but boolean operators are kept.
+    """
+    return ' '.join(word if word in OPERATORS else word.lower()
+                    for word in query.split())
+
+
+class ResponseCache(object):
+    """Persistent cache of ORCID responses with TTL and LRU eviction."""
+
+    def __init__(self, path=None, ttl=DEFAULT_TTL, max_size=DEFAULT_MAX_SIZE):
+        """Open the cache, creating it if it does not exist.
+
+        Args:
+         (Optional) path (str): Database path, defaults to orcid.db under
+        SC_HOME.
+            ttl (float): Seconds an entry stays fresh.
+            max_size (int): Bytes of responses kept.
+        """
+        self.path = path or sc_home('orcid.db')
+        self.ttl = ttl
+        self.max_size = max_size
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.db = sqlite3.connect(self.path, timeout=30)
+        for statement in SCHEMA:
+            self.db.execute(statement)
+        self.db.commit()
+
+    def close(self):
+        """close: Close the database."""
+        self.db.close()
+
+    def get(self, key, stale=False):
+        """get: Returns a cached response, or None.
+
+        Args:
+            key (str): Cache key.
+            stale (bool): Return the entry even if it has expired.
+
+        Returns:
+            value (str): Cached response.
+
+        """
+        row = self.db.execute("SELECT value, stored FROM responses "
+                              "WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if not stale and now - row[1] > self.ttl:
+            return None
+        self.db.execute("UPDATE responses SET used = ? WHERE key = ?",
+                        (now, key))
+        self.db.commit()
+        return str(row[0])
+
+    def put(self, key, value):
+        """put: Cache a response, evicting the least recently used entries
+        if the cache is over max_size.
+
+        Args:
+            key (str): Cache key.
+            value (str): Response.
+
+        """
+        now = time.time()
+        self.db.execute(
+            "INSERT OR REPLACE INTO responses (key, value, size, stored, used) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (key, sqlite3.Binary(value), len(value), now, now))
+        total = self.db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total > self.max_size:
+            evicted = []
+            for old, size in self.db.execute(
+                    "SELECT key, size FROM responses WHERE key != ? "
+                    "ORDER BY used", (key,)):
+                if total <= self.max_size:
+                    break
+                evicted.append((old,))
+                total -= size
+            self.db.executemany("DELETE FROM responses WHERE key = ?",
+                                evicted)
+        self.db.commit()
+
+
+def fetch(cache, key, url, headers=None, timeout=DEFAULT_TIMEOUT):
+    """fetch: GET a URL through the cache.
+
+    Only successful responses are cached. An expired entry is returned if
+    the request fails or the server answers with an error.
+
+    Args:
+        cache (ResponseCache): Response cache.
+        key (str): Cache key of the response.
+        url (str): URL to get.
+        headers (dict): Request headers.
+        timeout (float): Request timeout in seconds.
+
+    Returns:
+        (status, content, source): HTTP status, response body and where it
+    came from: 'cache', 'network' or 'offline' for an expired entry used
+    because the request or the server failed.
+
+    Raises:
+        RequestException: The request failed and nothing is cached.
+
+    """
+    content = cache.get(key)
+    if content is not None:
+        return 200, content, 'cache'
+    try:
+        response = requests.get(url, headers=headers, timeout=timeout)
+    except requests.exceptions.RequestException:
+        content = cache.get(key, stale=True)
+        if content is None:
+            raise
+        return 200, content, 'offline'
+    if response.status_code == 200:
+        cache.put(key, response.content)
+    elif response.status_code >= 500:
+        content = cache.get(key, stale=True)
+        if content is not None:
+            return 200, content, 'offline'
+    return response.status_code, response.content, 'network'
+
+
+def search(cache, search_public, query, **kwargs):
+    """search: Run an ORCID search through the cache.
+
+    Args:
+        cache (ResponseCache): Response cache.
+        search_public: Search function, such as SearchAPI.search_public.
+        query (str): Lucene search query.
+        kwargs: Other search arguments, such as start and rows.
+
+    Returns:
+        results (dict): Decoded search results.
+
+    Raises:
+        RequestException: The search failed and nothing is cached.
+
+    """
+    key = 'search:%s:%s' % (json.dumps(kwargs, sort_keys=True),
+                            normalize_query(query))
+    content = cache.get(key)
+    if content is not None:
+        return json.loads(content)
+    try:
+        results = search_public(query, **kwargs)
+    except requests.exceptions.RequestException:
+        content = cache.get(key, stale=True)
+        if content is None:
+            raise
+        return json.loads(content)
+    cache.put(key, json.dumps(results))
+    return results
@@ -4,14 +4,15 @@
 """
 
 import orcid
-import requests
 import click
+import orcidCache
 
 # noinspection PyBroadException
 class OrcidManager(object):
     """Class for OrcidManager"""
 
-    def __init__(self, query=None, orcid_id=None, orcid_email=None, sandbox=True):
+    def __init__(self, query=None, orcid_id=None, orcid_email=None, sandbox=True,
+                 cache=None, timeout=orcidCache.DEFAULT_TIMEOUT):
         """Initialize
 
         Parameters
@@ -20,8 +21,16 @@ class OrcidManager(object):
             Needs orcid_id to perform a request by orcid_id.
         :param orcid_email: string
             Needs an email address to perform a request by email.
+        :param cache: ResponseCache
+            Cache of ORCID responses, defaults to the one under SC_HOME,
+            which close closes.
+        :param timeout: float
+            Seconds to wait for the ORCID profile.
         """
         self.api = orcid.SearchAPI(False)
+        self.own_cache = cache is None
+        self.cache = cache or orcidCache.ResponseCache()
+        self.timeout = timeout
         if orcid_email:
             self.data = self.basic_search(orcid_email)
             self.orcid_id = self.get_id()
@@ -40,6 +49,11 @@ class OrcidManager(object):
                 print('Orcid ID or email is invalid.  Please try again.')
                 exit()
 
+    def close(self):
+        """Close the response cache if it was opened here."""
+        if self.own_cache:
+            self.cache.close()
+
     def get_id(self):
         """Get the Orcid_id from the email search
 
@@ -67,17 +81,21 @@ class OrcidManager(object):
 
         Returns
         -------
-        :returns self.turtle_config.text: string
+        :returns content: string
             user data in a text format with Turtle syntax
         """
-        self.turtle_config = requests.get(self.url, headers=self.headers)
-        if (self.turtle_config.status_code == 404) or (self.turtle_config.status_code == 500):
+        # Repeated config runs and offline hosts use the cached profile.
+        status, content, source = orcidCache.fetch(
+            self.cache, 'turtle:' + self.orcid_id, self.url, self.headers,
+            self.timeout)
+        if (status == 404) or (status == 500):
             print('Orcid ID not found.  Please try again.')
             exit()
         else:
-            print(str(self.url) + ", Status: " +
-                  str(self.turtle_config.status_code))
-            return self.turtle_config.content
+            print(str(self.url) + ", Status: " + str(status) +
+                  ('' if source == 'network' else ' (' + source + ')'))
+            self.turtle_config = content
+            return content
 
     def select_id(self):
         """ Function for initializing a search for an orcid id, and then creates a RDF
@@ -156,7 +174,10 @@ class OrcidManager(object):
         :returns self.s_dict: dict type
             Records with minimal information based on search terms used.
         """
-        search_results = self.api.search_public(query, start=0, rows=100)
+        self.s_dict = dict()
+        # Searching again from the selection prompt uses the cached results.
+        search_results = orcidCache.search(self.cache, self.api.search_public,
+                                           query, start=0, rows=100)
         results = search_results.get('orcid-search-results', None)
         self.actual_total_results = results.get('num-found', 0)
         result = results.get('orcid-search-result', None)
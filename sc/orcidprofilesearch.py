@@ -4,14 +4,18 @@
 from requests import RequestException
 import orcid
 import click
+import orcidCache
 
-def orcid_search(sandbox):
+def orcid_search(sandbox, cache=None):
     """Get the Orcid_id from the email search
 
     Parameters
     ----------
     :param sandbox: boolean
         Should the sandbox be used. True (default) indicates development mode.
+    :param cache: ResponseCache
+        (Optional) Cache of ORCID responses, opened and closed here if not
+        given.
 
     Returns
     -------
@@ -53,14 +57,20 @@ def orcid_search(sandbox):
         search_terms += query['keywords']
 
     api = orcid.SearchAPI(False)
+    own_cache = cache is None
+    if own_cache:
+        cache = orcidCache.ResponseCache()
     try:
-        results = api.search_public(search_terms).get(
+        results = orcidCache.search(cache, api.search_public,
+                                    search_terms).get(
             'orcid-search-results', None)
     except RequestException as e:
-    # Here the error should be handled. As the exception message might be
-    # too generic, additional info can be obtained by:
-        print(e.response.text)
-    # The response is a requests Response instance.
+        # Not every error has a response, such as a connection error.
+        print(e)
+        results = None
+    finally:
+        if own_cache:
+            cache.close()
 
     if results is None:
         return None
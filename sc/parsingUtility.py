@@ -15,51 +15,50 @@ class parsingUtility:
         with open(file_name, "w") as data_file:
             json.dump(self.data, data_file, indent=4)
 
+    # Instruction handlers, keyed by Dockerfile command.
+    handlers = {
+        'FROM': 'parseFROM',
+        'MAINTAINER': 'parseMAINTAINER',
+        'RUN': 'parseRUN',
+        'CMD': 'parseCMD',
+        'LABEL': 'parseLABEL',
+        'EXPOSE': 'parseEXPOSE',
+        'ENV': 'parseENV',
+        'ADD': 'parseADD',
+        'COPY': 'parseCOPY',
+        'ENTRYPOINT': 'parseENTRYPOINT',
+        'VOLUME': 'parseVOLUME',
+        'USER': 'parseUSER',
+        'WORKDIR': 'parseWORKDIR',
+        'ARG': 'parseARG',
+        'ONBUILD': 'parseONBUILD',
+        'STOPSIGNAL': 'parseSTOPSIGNAL',
+    }
+
     def parseCommand(self,cmdString):
         #Directs the command processing to the appropriate function,
         #based on the type of command received.
+        words = cmdString.split(None, 1)
+        self.dispatch(words[0], words[1] if len(words) > 1 else '')
+        self.steps.append(cmdString)
+
+    def parseInstruction(self, instruction):
+        """Process an instruction from dockerfileParser.
+
+        Args:
+            instruction (Instruction): Parsed instruction.
 
-        #Get the command type from the cmdString
-        thisCommand = self.getCommand(cmdString)
-        command_data = self.get_command_data(cmdString)
+        """
+        self.dispatch(instruction.command, instruction.value)
+        self.steps.append(instruction.original)
 
+    def dispatch(self, command, data):
         #Call the appropriate routine based on the command type
-        if thisCommand == 'FROM':
-            self.parseFROM(command_data)
-        elif thisCommand == 'MAINTAINER':
-            self.parseMAINTAINER(command_data)
-        elif thisCommand == 'RUN':
-            self.parseRUN(command_data)
-        elif thisCommand == 'CMD':
-            self.parseCMD(command_data)
-        elif thisCommand == 'LABEL':
-            self.parseLABEL(command_data)
-        elif thisCommand == 'EXPOSE':
-            self.parseEXPOSE(command_data)
-        elif thisCommand == 'ENV':
-            self.parseENV(command_data)
-        elif thisCommand == 'ADD':
-            self.parseADD(command_data)
-        elif thisCommand == 'COPY':
-            self.parseCOPY(command_data)
-        elif thisCommand == 'ENTRYPOINT':
-            self.parseENTRYPOINT(command_data)
-        elif thisCommand == 'VOLUME':
-            self.parseVOLUME(command_data)
-        elif thisCommand == 'USER':
-            self.parseUSER(command_data)
-        elif thisCommand == 'WORKDIR':
-            self.parseWORKDIR(command_data)
-        elif thisCommand == 'ARG':
-            self.parseARG(command_data)
-        elif thisCommand == 'ONBUILD':
-            self.parseONBUILD(command_data)
-        elif thisCommand == 'STOPSIGNAL':
-            self.parseSTOPSIGNAL(command_data)
-        else:
+        handler = self.handlers.get(command.upper())
+        if handler is None:
             print "Error parsing command"
-
-        self.steps.append(cmdString)
+        else:
+            getattr(self, handler)(data)
 
     def getCommand(self, cmdString):
         #returns command from cmdString, with the assumption
@@ -39,7 +39,7 @@ dockerEntityuuid = str(uuid.uuid4())
 class provVocabulary(baseVocabulary):
 
     def __init__(self):
-        pass
+        super(provVocabulary, self).__init__()
 
     def build(self):
 
@@ -91,7 +91,7 @@ class provVocabulary(baseVocabulary):
     def build_agent(self, ds):
 
         # Get configmager object from configmanager.
-        config_graph = configmanager.configmanager.graph
+        config_graph = configmanager.get_config().graph
         person_entities = []
         familyName_entities = []
         givenName_entities = []
@@ -5,8 +5,21 @@ This module provides an interface for the Client to the metadata
 objects that need to writen to a label or inside of a container.
 """
 import graphRegistry
-import re
-import ast
+import contentStore
+import base64
+import datetime
+import gzip
+import io
+import json
+import rdflib
+
+# Prefix marking a label value as gzip compressed and base64 encoded.
+GZIP_PREFIX = 'gzip+base64:'
+
+
+def utcnow():
+    # Returns the current time as an xsd:dateTime string
+    return datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
 
 
 class scMetadata:
@@ -16,17 +29,150 @@ class scMetadata:
     def appendData(self, filepath):
         # Appends provinator data to the file passed in
         with open(filepath, 'a') as provfile:
-            provfile.write(graphRegistry.scVocabRegistry.get_json_ld())
+            provfile.write(graphRegistry.get_registry().get_json_ld())
+
+    def appendBuffer(self, data):
+        # Returns the buffer passed in with provinator data appended
+        if data is None:
+            data = ''
+        return data + graphRegistry.get_registry().get_json_ld()
+
+    def appendIncremental(self, data, manifest):
+        # Appends only the named graph for the current state change to the
+        # N-Quads buffer and records its byte range in the manifest.
+        # Returns the new (data, manifest) pair
+        if data is None:
+            data = ''
+        if manifest is None:
+            manifest = ''
+        registry = graphRegistry.get_registry()
+        nquads = registry.get_nquads()
+        entry = {'graph': str(registry.graph_uri),
+                 'offset': len(data),
+                 'length': len(nquads),
+                 'format': 'nquads',
+                 'created': utcnow()}
+        manifest += json.dumps(entry, sort_keys=True) + '\n'
+        return data + nquads, manifest
+
+    def readManifest(self, manifest):
+        # Returns the manifest entries in the order they were appended
+        return [json.loads(line) for line in manifest.splitlines()
+                if line.strip()]
+
+    def iterGraphs(self, data, manifest, graphs=None):
+        # Yields (graph IRI, graph) for each appended state change, or only
+        # for the IRIs in graphs. Each byte range is only parsed when the
+        # reader asks for it
+        for entry in self.readManifest(manifest):
+            if graphs is not None and entry['graph'] not in graphs:
+                continue
+            chunk = data[entry['offset']:entry['offset'] + entry['length']]
+            ds = rdflib.Dataset()
+            ds.parse(data=chunk, format=entry['format'])
+            yield entry['graph'], ds.graph(rdflib.URIRef(entry['graph']))
 
-    def labelDictionary(self, label_prefix):
+    def loadDataset(self, data, manifest=None, graphs=None):
+        # Reassembles the provenance dataset from an N-Quads buffer. With a
+        # manifest, only the named graphs listed in graphs are parsed
+        ds = rdflib.Dataset(default_union=True)
+        if manifest is None:
+            ds.parse(data=data, format='nquads')
+            return ds
+        for uri, graph in self.iterGraphs(data, manifest, graphs):
+            g = ds.graph(rdflib.URIRef(uri))
+            g += graph
+        return ds
+
+    def labelDictionary(self, label_prefix, compress_over=None):
         # Returns the label as a dictionary
         # Get the label information from provinator
-        provOutput = graphRegistry.scVocabRegistry.get_json_ld()
-        # Remove any formatting characters
-        provOutput = re.sub('[\t\r\n\s+]', '', provOutput)
-        # Add the label prefix
-        newLabel = "{'" + label_prefix + "':'" + provOutput + "'}"
-        # Evaluate the string to create the dictionary
-        newLabel = ast.literal_eval(newLabel)
-        # Return the dictionary
-        return newLabel
+        provOutput = graphRegistry.get_registry().get_json_ld()
+        # Return the dictionary with the encoded graph under the label prefix
+        return {label_prefix: self.encodeLabel(provOutput, compress_over)}
+
+    def encodeLabel(self, provOutput, compress_over=None):
+        # Returns a label value for a JSON-LD string. The graph is
+        # re-serialized as compact JSON, which drops formatting whitespace
+        # but keeps literals intact. Values longer than compress_over bytes
+        # are gzip compressed and base64 encoded
+        value = json.dumps(json.loads(provOutput), sort_keys=True,
+                           separators=(',', ':'))
+        if compress_over is not None and len(value) > compress_over:
+            buf = io.BytesIO()
+            # A fixed mtime keeps the encoding of a graph stable.
+            with gzip.GzipFile(fileobj=buf, mode='wb', mtime=0) as gz:
+                gz.write(value.encode('utf-8'))
+            value = GZIP_PREFIX + base64.b64encode(buf.getvalue()).decode(
+                'ascii')
+        return value
+
+    def decodeLabel(self, value):
+        # Returns the JSON string stored in a label value
+        if value.startswith(GZIP_PREFIX):
+            data = base64.b64decode(value[len(GZIP_PREFIX):])
+            with gzip.GzipFile(fileobj=io.BytesIO(data), mode='rb') as gz:
+                return gz.read().decode('utf-8')
+        return value
+
+    def labelReference(self, label_prefix, store=None, filename=None,
+                       format='json-ld'):
+        # Returns the label as a dictionary holding only the content hash
+        # and a small summary of the graph. The serialized graph is written
+        # to the local content-addressed store. The summary names the
+        # provenance file the same serialization is appended to, and its
+        # format, so a store miss can be resolved from that file
+        registry = graphRegistry.get_registry()
+        if format == 'nquads':
+            provOutput = registry.get_nquads()
+        else:
+            provOutput = registry.get_json_ld()
+        if store is None:
+            store = contentStore.ContentStore()
+        summary = {'digest': store.put(provOutput),
+                   'size': len(provOutput),
+                   'triples': len(registry.export_graph()),
+                   'graph': str(registry.graph_uri),
+                   'format': format,
+                   'created': utcnow()}
+        if filename is not None:
+            summary['file'] = filename
+        return {label_prefix: json.dumps(summary, sort_keys=True,
+                                         separators=(',', ':'))}
+
+    def readReference(self, value):
+        # Returns the summary if a label value is a graph reference,
+        # otherwise None
+        try:
+            summary = json.loads(self.decodeLabel(value))
+        except ValueError:
+            return None
+        if isinstance(summary, dict) and 'digest' in summary:
+            return summary
+        return None
+
+    def resolveReference(self, summary, store=None, provdata=None):
+        # Returns the graph a reference points to as JSON-LD. The local
+        # store is tried first, then the tail of the provenance file named
+        # in the summary, which ends with the graph appended at the same
+        # state change
+        if store is None:
+            store = contentStore.ContentStore()
+        data = store.get(summary['digest'])
+        if data is None and provdata:
+            tail = provdata[-summary['size']:]
+            if contentStore.digest(tail) == summary['digest']:
+                store.put(tail)
+                data = tail
+        if data is not None:
+            data = self.toJsonLD(data, summary.get('format', 'json-ld'))
+        return data
+
+    def toJsonLD(self, data, format):
+        # Returns a serialized graph as JSON-LD
+        if format == 'json-ld':
+            return data
+        ds = rdflib.Dataset()
+        ds.parse(data=data, format=format)
+        context = graphRegistry.get_registry().global_context
+        return ds.serialize(format='json-ld', context=context or None)
@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+"""SPARQL queries over SmartContainers provenance.
+
+This module runs SPARQL queries over the provenance of images or over the
+local graph store. rdflib parses queries with a pyparsing grammar that is
+slow to run the first time in every process, so prepared queries, parsed
+and translated to SPARQL algebra, are cached under SC_HOME by the hash of
+their text. A repeated query is loaded from the cache and never parsed.
+
+The algebra is cached as JSON, not pickled, so a cache entry can only hold
+algebra nodes, RDF terms and the names of rdflib's SPARQL operators, and
+reading it never runs other code. Queries with algebra the cache can't
+hold are prepared every time.
+
+ RDFLib SPARQL reference:
+ https://rdflib.readthedocs.org/en/stable/intro_to_sparql.html
+"""
+import collections
+import hashlib
+import json
+import os
+import tempfile
+import types
+
+import rdflib
+from rdflib import paths
+from rdflib.plugins.sparql import operators, prepareQuery
+from rdflib.plugins.sparql.parserutils import CompValue, Expr
+from rdflib.plugins.sparql.sparql import Prologue, Query
+
+from util import sc_home
+
+# Bump when the cached form of a prepared query or NAMESPACES change.
+CACHE_VERSION = 2
+# Prefixes queries can use without declaring them.
+NAMESPACES = {
+    'rdf': rdflib.RDF,
+    'rdfs': rdflib.RDFS,
+    'xsd': rdflib.XSD,
+    'foaf': rdflib.namespace.FOAF,
+    'prov': rdflib.Namespace("http://www.w3.org/ns/prov#"),
+    'dc': rdflib.Namespace("http://purl.org/dc/terms/"),
+    'docker': rdflib.Namespace("http://w3id.org/daspos/docker#"),
+    'sc': rdflib.Namespace("https://w3id.org/daspos/smartcontainers#"),
+    'ce': rdflib.Namespace(
+        "http://dase.cs.wright.edu/ontologies/ComputationalEnvironment#"),
+    'ca': rdflib.Namespace(
+        "http://dase.cs.wright.edu/ontologies/ComputationalActivity#"),
+}
+# Property path classes, by name.
+PATHS = dict((cls.__name__, cls) for cls in (
+    paths.InvPath, paths.SequencePath, paths.AlternativePath, paths.MulPath,
+    paths.NegatedPath))
+# Containers, by name.
+CONTAINERS = {'list': list, 'tuple': tuple, 'set': set,
+              'frozenset': frozenset}
+# Attributes OrderedDict keeps for itself.
+ORDERED_DICT_STATE = set(vars(collections.OrderedDict()))
+
+
+def encode(value, parents=()):
+    """encode: Returns a SPARQL algebra value as JSON data.
+
+    Args:
+        value: Algebra node, RDF term, container or plain value.
+        parents (tuple): IDs of the containers value is in.
+
+    Returns:
+        data: JSON data for decode.
+
+    Raises:
+        TypeError: The value can't be cached.
+
+    """
+    if value is None or isinstance(value, (bool, int, long, float)):
+        return value
+    if isinstance(value, rdflib.URIRef):
+        return {'uri': value}
+    if isinstance(value, rdflib.Literal):
+        return {'literal': value, 'datatype': value.datatype,
+                'lang': value.language}
+    if isinstance(value, rdflib.Variable):
+        return {'var': value}
+    if isinstance(value, rdflib.BNode):
+        return {'bnode': value}
+    if type(value) in (str, unicode):
+        return value
+    if id(value) in parents:
+        raise TypeError("Cyclic algebra")
+    parents += (id(value),)
+    if value is operators.TrueFilter:
+        # Evaluated by a lambda, so it is saved by name.
+        return {'true_filter': True}
+    if isinstance(value, CompValue):
+        state = dict((key, item) for key, item in vars(value).items()
+                     if key not in ORDERED_DICT_STATE)
+        data = {'node': state.pop('name'),
+                'items': [[key, encode(collections.OrderedDict.__getitem__(
+                    value, key), parents)] for key in value]}
+        function = state.pop('_evalfn', None)
+        if isinstance(value, Expr):
+            data['function'] = None
+            if function is not None:
+                function = function.im_func
+                if getattr(operators, function.__name__, None) \
+                        is not function:
+                    raise TypeError("Not a SPARQL operator: %s" %
+                                    function.__name__)
+                data['function'] = function.__name__
+        if any(item is not None for item in state.values()):
+            raise TypeError("Algebra node with state: %s" % data['node'])
+        return data
+    if type(value).__name__ in PATHS:
+        return {'path': type(value).__name__,
+                'state': [[key, encode(item, parents)]
+                          for key, item in vars(value).items()]}
+    if isinstance(value, dict):
+        return {'dict': [[encode(key, parents), encode(item, parents)]
+                         for key, item in value.items()]}
+    for name, container in CONTAINERS.items():
+        if isinstance(value, container):
+            return {name: [encode(item, parents) for item in value]}
+    raise TypeError("Can't cache %s in a query" % type(value).__name__)
+
+
+def decode(data):
+    """decode: Returns the SPARQL algebra value of JSON data from encode.
+
+    Raises:
+        ValueError: The data is not encoded algebra.
+
+    """
+    if not isinstance(data, dict):
+        return data
+    if 'node' in data:
+        if 'function' in data:
+            function = data['function']
+            if function is not None:
+                function = getattr(operators, function, None)
+                if not isinstance(function, types.FunctionType):
+                    raise ValueError("Not a SPARQL operator: %s" %
+                                     data['function'])
+            node = Expr(str(data['node']), function)
+        else:
+            node = CompValue(str(data['node']))
+        for key, item in data['items']:
+            collections.OrderedDict.__setitem__(node, str(key), decode(item))
+        return node
+    if 'uri' in data:
+        return rdflib.URIRef(data['uri'])
+    if 'literal' in data:
+        return rdflib.Literal(data['literal'], lang=data['lang'],
+                              datatype=data['datatype'] and
+                              rdflib.URIRef(data['datatype']))
+    if 'var' in data:
+        return rdflib.Variable(data['var'])
+    if 'bnode' in data:
+        return rdflib.BNode(data['bnode'])
+    if 'true_filter' in data:
+        return operators.TrueFilter
+    if 'path' in data:
+        path = PATHS[data['path']].__new__(PATHS[data['path']])
+        for key, item in data['state']:
+            setattr(path, str(key), decode(item))
+        return path
+    if 'dict' in data:
+        return dict((decode(key), decode(item)) for key, item in data['dict'])
+    for name, container in CONTAINERS.items():
+        if name in data:
+            return container(decode(item) for item in data[name])
+    raise ValueError("Not a cached query value: %r" % data)
+
+
+def dump_query(query):
+    """dump_query: Returns a prepared query as JSON data.
+
+    Raises:
+        TypeError: The query can't be cached.
+
+    """
+    prologue = query.prologue
+    return {'base': prologue.base,
+            'namespaces': [[prefix, uri] for prefix, uri in
+                           prologue.namespace_manager.namespaces()],
+            'algebra': encode(query.algebra)}
+
+
+def load_query(data):
+    """load_query: Returns the prepared query of JSON data from
+    dump_query."""
+    prologue = Prologue()
+    prologue.base = data['base']
+    for prefix, uri in data['namespaces']:
+        prologue.bind(prefix, rdflib.URIRef(uri))
+    return Query(prologue, decode(data['algebra']))
+
+
+def query_key(text):
+    """query_key: Returns the cache key of a query.
+
+    Args:
+        text (str): SPARQL query.
+
+    Returns:
+        key (str): Hex digest of the query and the rdflib version.
+
+    """
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    return hashlib.sha256('%s\0%d\0%s' % (
+        rdflib.__version__, CACHE_VERSION, text)).hexdigest()
+
+
+class QueryCache(object):
+    """Prepared SPARQL queries cached in memory and on disk."""
+
+    def __init__(self, root=None):
+        """Initialize a cache.
+
+        Args:
+         (Optional) root (str): Cache directory, defaults to SC_HOME/queries.
+        """
+        self.root = root or sc_home('queries')
+        self.queries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, key):
+        """path: Returns the file path of a cached query."""
+        return os.path.join(self.root, key[:2], key + '.json')
+
+    def prepare(self, text):
+        """prepare: Returns the prepared form of a query.
+
+        Args:
+            text (str): SPARQL query.
+
+        Returns:
+            query (Query): Parsed query translated to SPARQL algebra.
+
+        """
+        key = query_key(text)
+        query = self.queries.get(key)
+        if query is None:
+            query = self.load(key)
+        if query is None:
+            self.misses += 1
+            query = prepareQuery(text, initNs=NAMESPACES)
+            self.save(key, query)
+        else:
+            self.hits += 1
+        self.queries[key] = query
+        return query
+
+    def load(self, key):
+        """load: Returns a cached query, or None if it is not cached or
+        can't be read."""
+        try:
+            with open(self.path(key)) as cached:
+                return load_query(json.load(cached))
+        except Exception:
+            # Not cached, or written by another version of rdflib or sc.
+            return None
+
+    def save(self, key, query):
+        """save: Atomically cache a query. Returns False if it can't."""
+        path = self.path(key)
+        directory = os.path.dirname(path)
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            handle, tmppath = tempfile.mkstemp(dir=directory)
+        except (IOError, OSError):
+            return False
+        try:
+            with os.fdopen(handle, 'w') as cached:
+                json.dump(dump_query(query), cached)
+            os.rename(tmppath, path)
+            return True
+        except (IOError, OSError, TypeError, ValueError):
+            os.remove(tmppath)
+            return False
+
+    def query(self, dataset, text, initBindings=None):
+        """query: Run a query over a dataset.
+
+        Args:
+            dataset (Graph): Graph or Dataset to query.
+            text (str): SPARQL query.
+            initBindings (dict): Initial variable bindings.
+
+        Returns:
+            result (Result): rdflib query result.
+
+        """
+        return dataset.query(self.prepare(text),
+                             initBindings=initBindings or {})
+
+
+def image_dataset(client, images):
+    """image_dataset: Returns a Dataset of the provenance of images.
+
+    Args:
+        client (scClient): Client for the docker daemon.
+        images (list): Image names or IDs.
+
+    Returns:
+        dataset (Dataset): Union of the label graphs of the images.
+
+    """
+    dataset = rdflib.Dataset(default_union=True)
+    for image in images:
+        labels = json.loads(client.get_label_image(image) or '{}')
+        data = labels.get(client.label_prefix)
+        if data:
+            dataset.parse(data=data, format='json-ld')
+    return dataset
+
+
+def local_dataset(store=None, path=None):
+    """local_dataset: Returns the local graph store as a Dataset.
+
+    Args:
+        store (str): Store type, defaults to the store the registry is
+        configured with in SC_GRAPH_STORE.
+     (Optional) path (str): Store location, defaults to the one under
+        SC_HOME.
+
+    Returns:
+        dataset (Dataset): Every state change graph recorded locally.
+
+    Raises:
+        ValueError: The store is not persistent or has not been created.
+
+    """
+    import graphManager
+    store = store or os.environ.get('SC_GRAPH_STORE') or 'memory'
+    if store not in graphManager.STORES:
+        raise ValueError("Unknown graph store: %s" % store)
+    if graphManager.STORES[store] is None:
+        raise ValueError(
+            "No local graph store: provenance is only kept in images. Set "
+            "SC_GRAPH_STORE to sqlite or sleepycat to record it locally, "
+            "or query images with --image.")
+    path = path or sc_home(graphManager.STORES[store])
+    if not os.path.exists(path):
+        raise ValueError("No local graph store at %s: no provenance has "
+                         "been recorded with SC_GRAPH_STORE=%s." % (path,
+                                                                    store))
+    registry = graphManager.VocabularyRegistry()
+    registry.open_store(store, path)
+    return registry.global_graph
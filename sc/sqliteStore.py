@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""SQLite backed RDFlib store for SmartContainers.
+
+This module provides a graph-aware, context-aware quad store on top of the
+python sqlite3 module so the global provenance dataset can persist under
+SC_HOME between sc invocations. Opening the store only opens the database
+file, and triple patterns are answered from indexes, so the dataset never
+has to be loaded into memory.
+
+ RDFLib Store API reference:
+ https://rdflib.readthedocs.org/en/stable/univrdfstore.html
+"""
+import json
+import os
+import sqlite3
+
+from rdflib import BNode, Graph, Literal, URIRef
+from rdflib.store import Store, VALID_STORE, NO_STORE
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS quads "
+    "(s TEXT NOT NULL, p TEXT NOT NULL, o TEXT NOT NULL, c TEXT NOT NULL, "
+    "PRIMARY KEY (c, s, p, o))",
+    "CREATE INDEX IF NOT EXISTS quads_spo ON quads (s, p, o)",
+    "CREATE INDEX IF NOT EXISTS quads_pos ON quads (p, o, s)",
+    "CREATE INDEX IF NOT EXISTS quads_osp ON quads (o, s, p)",
+    "CREATE TABLE IF NOT EXISTS graphs (c TEXT PRIMARY KEY)",
+    "CREATE TABLE IF NOT EXISTS namespaces "
+    "(prefix TEXT PRIMARY KEY, uri TEXT NOT NULL)",
+]
+
+
+def encode_term(term):
+    """encode_term: Returns the database key of an RDF term.
+
+    Args:
+        term (Node): URIRef, BNode or Literal.
+
+    Returns:
+        key (unicode): Type tag followed by the term value.
+
+    """
+    if isinstance(term, Literal):
+        datatype = term.datatype and unicode(term.datatype)
+        return u'L' + json.dumps([unicode(term), datatype, term.language])
+    if isinstance(term, BNode):
+        return u'B' + unicode(term)
+    return u'U' + unicode(term)
+
+
+def decode_term(key):
+    """decode_term: Returns the RDF term for a database key.
+
+    Args:
+        key (unicode): Key created by encode_term.
+
+    Returns:
+        term (Node): URIRef, BNode or Literal.
+
+    """
+    tag, value = key[0], key[1:]
+    if tag == u'L':
+        value, datatype, language = json.loads(value)
+        return Literal(value, lang=language,
+                       datatype=datatype and URIRef(datatype))
+    if tag == u'B':
+        return BNode(value)
+    return URIRef(value)
+
+
+class SQLiteStore(Store):
+    """RDFlib quad store persisted in a SQLite database file."""
+
+    context_aware = True
+    formula_aware = False
+    transaction_aware = True
+    graph_aware = True
+
+    def __init__(self, configuration=None, identifier=None):
+        """Initialize the store.
+
+        Args:
+         (Optional) configuration (str): Database path to open.
+         (Optional) identifier: Store identifier.
+        """
+        self.identifier = identifier
+        self.db = None
+        super(SQLiteStore, self).__init__(configuration)
+
+    def open(self, configuration, create=True):
+        """open: Open the database file.
+
+        Args:
+            configuration (str): Database path.
+            create (bool): Create the database if it does not exist.
+
+        Returns:
+            status (int): VALID_STORE or NO_STORE.
+
+        """
+        if not create and not os.path.exists(configuration):
+            return NO_STORE
+        self.db = sqlite3.connect(configuration, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        for statement in SCHEMA:
+            self.db.execute(statement)
+        self.db.commit()
+        return VALID_STORE
+
+    def close(self, commit_pending_transaction=True):
+        """close: Close the database, committing pending writes.
+
+        rdflib graphs close their store without asking for a commit, and
+        sqlite3 discards uncommitted writes on close, so writes are always
+        committed. Use rollback first to discard them.
+        """
+        if self.db is not None:
+            self.db.commit()
+            self.db.close()
+            self.db = None
+
+    def commit(self):
+        """commit: Commit pending writes."""
+        self.db.commit()
+
+    def rollback(self):
+        """rollback: Discard pending writes."""
+        self.db.rollback()
+
+    def _context(self, context):
+        """Returns the database key of a context or None for all contexts."""
+        if context is None or context == self:
+            return None
+        return encode_term(getattr(context, 'identifier', context))
+
+    def _graph(self, key):
+        """Returns a context graph backed by this store."""
+        return Graph(store=self, identifier=decode_term(key))
+
+    def add(self, triple, context, quoted=False):
+        """add: Add a triple to a context."""
+        self.addN([triple + (context,)])
+
+    def addN(self, quads):
+        """addN: Add quads in a single statement batch."""
+        rows = [(encode_term(s), encode_term(p), encode_term(o),
+                 self._context(c)) for s, p, o, c in quads]
+        self.db.executemany("INSERT OR IGNORE INTO quads VALUES (?, ?, ?, ?)",
+                            rows)
+
+    def remove(self, triple, context=None):
+        """remove: Remove triples matching a pattern."""
+        where, params = self._where(triple[0], triple[1], triple[2], context)
+        self.db.execute("DELETE FROM quads" + where, params)
+
+    def _where(self, subject, predicate, object, context):
+        """Returns the WHERE clause and parameters for a quad pattern."""
+        clauses = []
+        params = []
+        for column, term in (('s', subject), ('p', predicate),
+                             ('o', object)):
+            if term is not None:
+                clauses.append(column + " = ?")
+                params.append(encode_term(term))
+        context = self._context(context)
+        if context is not None:
+            clauses.append("c = ?")
+            params.append(context)
+        if not clauses:
+            return "", params
+        return " WHERE " + " AND ".join(clauses), params
+
+    def triples(self, triple, context=None):
+        """triples: Generator over triples matching a pattern.
+
+        Yields:
+            ((s, p, o), contexts): Matching triple and the context graphs it
+        is in.
+
+        """
+        where, params = self._where(triple[0], triple[1], triple[2], context)
+        cursor = self.db.cursor()
+        cursor.execute("SELECT s, p, o, c FROM quads" + where +
+                       " ORDER BY s, p, o", params)
+        current = None
+        contexts = []
+        for s, p, o, c in cursor:
+            if (s, p, o) != current:
+                if current is not None:
+                    yield tuple(decode_term(t) for t in current), \
+                        iter(contexts)
+                current = (s, p, o)
+                contexts = []
+            contexts.append(self._graph(c))
+        if current is not None:
+            yield tuple(decode_term(t) for t in current), iter(contexts)
+
+    def __len__(self, context=None):
+        """Number of distinct triples in a context or in the store."""
+        context = self._context(context)
+        if context is None:
+            sql = "SELECT COUNT(*) FROM (SELECT DISTINCT s, p, o FROM quads)"
+            return self.db.execute(sql).fetchone()[0]
+        sql = "SELECT COUNT(*) FROM quads WHERE c = ?"
+        return self.db.execute(sql, (context,)).fetchone()[0]
+
+    def contexts(self, triple=None):
+        """contexts: Generator over context graphs, or those of a triple."""
+        if triple is None:
+            rows = self.db.execute("SELECT c FROM graphs UNION "
+                                   "SELECT DISTINCT c FROM quads").fetchall()
+        else:
+            where, params = self._where(triple[0], triple[1], triple[2], None)
+            rows = self.db.execute("SELECT DISTINCT c FROM quads" + where,
+                                   params).fetchall()
+        for row in rows:
+            yield self._graph(row[0])
+
+    def add_graph(self, graph):
+        """add_graph: Record a graph, even if it has no triples."""
+        self.db.execute("INSERT OR IGNORE INTO graphs VALUES (?)",
+                        (self._context(graph),))
+
+    def remove_graph(self, graph):
+        """remove_graph: Remove a graph and its triples."""
+        context = self._context(graph)
+        self.db.execute("DELETE FROM quads WHERE c = ?", (context,))
+        self.db.execute("DELETE FROM graphs WHERE c = ?", (context,))
+
+    def bind(self, prefix, namespace):
+        """bind: Bind a namespace prefix."""
+        self.db.execute("INSERT OR REPLACE INTO namespaces VALUES (?, ?)",
+                        (prefix, unicode(namespace)))
+
+    def prefix(self, namespace):
+        """prefix: Returns the prefix bound to a namespace."""
+        row = self.db.execute("SELECT prefix FROM namespaces WHERE uri = ?",
+                              (unicode(namespace),)).fetchone()
+        return row and row[0]
+
+    def namespace(self, prefix):
+        """namespace: Returns the namespace bound to a prefix."""
+        row = self.db.execute("SELECT uri FROM namespaces WHERE prefix = ?",
+                              (prefix,)).fetchone()
+        return row and URIRef(row[0])
+
+    def namespaces(self):
+        """namespaces: Generator over (prefix, namespace) bindings."""
+        for prefix, uri in self.db.execute(
+                "SELECT prefix, uri FROM namespaces").fetchall():
+            yield prefix, URIRef(uri)
@@ -1,4 +1,5 @@
 # Some utility functions
+import json
 import os
 import sys
 import stat
@@ -16,6 +17,36 @@ def is_case_sensitive_filesystem():
 _IS_CASE_SENSITIVE_FILESYSTEM = is_case_sensitive_filesystem()
 
 
+def sc_home(*paths):
+    """ Return a path under the smartcontainers home directory, SC_HOME """
+    home = os.environ.get('SC_HOME') or os.path.join(os.environ['HOME'], '.sc')
+    return os.path.join(home, *paths)
+
+
+def read_json_cache(path):
+    """ Return the JSON object cached at path, or None if it can't be read """
+    try:
+        with open(path) as cache:
+            return json.load(cache)
+    except (IOError, ValueError):
+        return None
+
+
+def write_json_cache(path, data):
+    """ Atomically write data as JSON to path. Returns False if it can't """
+    try:
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        handle, tmppath = tempfile.mkstemp(dir=directory or '.')
+        with os.fdopen(handle, 'w') as cache:
+            json.dump(data, cache, sort_keys=True, indent=2)
+        os.rename(tmppath, path)
+        return True
+    except (IOError, OSError):
+        return False
+
+
 def which(program, case_sensitive=_IS_CASE_SENSITIVE_FILESYSTEM):
     """ Simulates unix `which` command. Returns absolute path if program found """
     def is_exe(fpath):
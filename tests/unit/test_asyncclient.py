@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""Tests for the concurrent Smart Containers Docker API Client."""
+import threading
+
+import pytest
+
+from sc import asyncClient
+
+
+class RecordingClient(object):
+    """Stands in for scClient and records the thread of each call."""
+
+    def __init__(self, barrier):
+        self.barrier = barrier
+
+    def get_label_image(self, imageID, resolve=True):
+        self.barrier.wait()
+        return (imageID, threading.current_thread().name)
+
+    def commit(self, container, *args, **kwargs):
+        raise ValueError(container)
+
+
+def test_concurrent_calls():
+    """Calls run at the same time, each worker with its own client."""
+    ready = threading.Event()
+    waiting = []
+
+    class Barrier(object):
+        def wait(self):
+            waiting.append(1)
+            if len(waiting) == 4:
+                ready.set()
+            assert ready.wait(5)
+
+    clients = []
+
+    def factory():
+        clients.append(RecordingClient(Barrier()))
+        return clients[-1]
+
+    pool = asyncClient.AsyncClient(workers=4, factory=factory)
+    results = [pool.get_label_image("image%d" % i) for i in range(4)]
+    labels = [result.get(10) for result in results]
+    assert [label[0] for label in labels] == ["image%d" % i for i in range(4)]
+    assert len(set(label[1] for label in labels)) == 4
+    assert len(clients) == 4
+    with pytest.raises(ValueError):
+        pool.commit("container").get(10)
+    pool.close()
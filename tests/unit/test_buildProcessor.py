@@ -4,7 +4,9 @@
 Tests for Smart Containers buildProcessor.
 This module provides functions for processing Build commands.
 """
+import io
 import os
+import tarfile
 import unittest
 
 from sc import buildProcessor
@@ -120,3 +122,55 @@ class BuildProcessorTestCase(unittest.TestCase):
 
     def test_parse_stopsignal(self):
         self.assertEqual(self.data_one["stopsignal"], "9")
+
+
+class Stream(object):
+    """File object that can only be read once, like a pipe."""
+
+    def __init__(self, data):
+        self.data = io.BytesIO(data)
+
+    def read(self, size=-1):
+        return self.data.read(size)
+
+
+class ProcessFOTestCase(unittest.TestCase):
+    def setUp(self):
+        with open(os.path.join(base_dir, 'data/Dockerfile')) as DF:
+            self.dockerfile = DF.read()
+        f = io.BytesIO()
+        tar = tarfile.open(mode='w:gz', fileobj=f)
+        for name, data in (('app.py', 'print 1\n'),
+                           ('docker/Dockerfile', self.dockerfile)):
+            member = tarfile.TarInfo(name)
+            member.size = len(data)
+            tar.addfile(member, io.BytesIO(data))
+        tar.close()
+        self.context = f.getvalue()
+
+    def test_processFO_dockerfile(self):
+        processor = buildProcessor.buildProcessor()
+        self.assertEqual(processor.processFO(io.BytesIO(self.dockerfile)), 0)
+        self.assertEqual(processor.PU.steps[0], "FROM ubuntu")
+        self.assertEqual(processor.context.read(), self.dockerfile)
+
+    def test_processFO_context(self):
+        processor = buildProcessor.buildProcessor()
+        fileobj = io.BytesIO(self.context)
+        self.assertEqual(processor.processFO(
+            fileobj, custom_context=True, dockerfile='docker/Dockerfile'), 0)
+        self.assertEqual(processor.PU.data["user"][0], "root")
+        # A seekable context is rewound and uploaded as is.
+        self.assertIs(processor.context, fileobj)
+        self.assertEqual(fileobj.tell(), 0)
+
+    def test_processFO_stream(self):
+        processor = buildProcessor.buildProcessor()
+        self.assertEqual(processor.processFO(
+            Stream(self.context), custom_context=True,
+            dockerfile='docker/Dockerfile'), 0)
+        self.assertEqual(processor.PU.data["user"][0], "root")
+        # The streamed context is kept whole for the upload.
+        self.assertEqual(processor.context.read(), self.context)
+        self.assertEqual(processor.processFO(
+            Stream(self.context), custom_context=True), 1)
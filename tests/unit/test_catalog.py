@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""Tests for the Smart Containers provenance catalog."""
+import json
+
+from sc import catalog, client
+
+ORCID = "0000-0002-1825-0097"
+LABEL = json.dumps([{
+    "@id": "urn:x-rdflib:default",
+    "@graph": [
+        {"@id": "http://orcid.org/" + ORCID,
+         "@type": ["prov:Person", "foaf:Person"],
+         "foaf:givenName": "Josiah",
+         "foaf:familyName": "Carberry"},
+        {"@id": "urn:uuid:activity",
+         "@type": ["prov:Activity"],
+         "docker:hasCommand": {"@id": "docker:commitOperation"},
+         "prov:startedAtTime": {"@value": "2016-03-01T10:00:00Z",
+                                "@type": "xsd:dateTime"}},
+        {"@id": "urn:uuid:environment",
+         "ce:hasOperatingSystem": {"@id": "urn:uuid:os"}},
+        {"@id": "urn:uuid:os", "rdfs:label": "Linux"},
+    ]}])
+
+
+def test_label_facts():
+    """Agents, ORCID iDs, commands, times and environment are read."""
+    facts = catalog.label_facts(LABEL)
+    assert ('orcid', ORCID) in facts
+    assert ('agent', 'Josiah Carberry') in facts
+    assert ('command', 'commitOperation') in facts
+    assert ('time', '2016-03-01T10:00:00Z') in facts
+    assert ('os', 'Linux') in facts
+    assert catalog.label_facts('not json') == []
+
+
+def test_search(tmpdir):
+    mycatalog = catalog.Catalog(str(tmpdir.join('catalog.db')))
+    facts = catalog.label_facts(LABEL)
+    mycatalog.add({'id': 'a' * 64, 'created': '2016-03-01T10:00:00Z',
+                   'tags': ['analysis:1'], 'base': ['ubuntu:14.04', 'ubuntu'],
+                   'facts': facts})
+    mycatalog.add({'id': 'b' * 64, 'created': '2015-01-01T00:00:00Z',
+                   'tags': [], 'base': ['alpine'], 'facts': []})
+    mycatalog.commit()
+    found = mycatalog.search(orcid="http://orcid.org/" + ORCID,
+                             base="ubuntu", after="2016-01-01")
+    assert [image['id'] for image in found] == ['a' * 64]
+    assert found[0]['tags'] == ['analysis:1']
+    assert mycatalog.search(orcid=ORCID, before="2016-01-01") == []
+    assert len(mycatalog.search(text="Carberry " + ORCID)) == 1
+    assert len(mycatalog.search(env={'os': 'Linux'}, agent="josiah")) == 1
+    assert [image['id'][0] for image in mycatalog.search()] == ['a', 'b']
+    mycatalog.close()
+
+
+def test_search_vacuum(tmpdir):
+    """Text search still finds images after VACUUM compacts the table."""
+    path = str(tmpdir.join('catalog.db'))
+    mycatalog = catalog.Catalog(path)
+    for n in range(1, 4):
+        mycatalog.add({'id': str(n) * 64, 'created': None,
+                       'tags': ['image%d:1' % n], 'base': [], 'facts': []})
+    mycatalog.remove('1' * 64)
+    mycatalog.commit()
+    mycatalog.db.execute("VACUUM")
+    assert [image['id'] for image in mycatalog.search(text="image3")] == [
+        '3' * 64]
+    mycatalog.close()
+
+
+def test_schema_upgrade(tmpdir):
+    """An older catalog drops its index but keeps its lineage."""
+    import sqlite3
+    path = str(tmpdir.join('catalog.db'))
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE images "
+               "(id TEXT PRIMARY KEY, created TEXT, tags TEXT, base TEXT)")
+    db.execute("INSERT INTO images VALUES ('x', NULL, '[]', '[]')")
+    db.commit()
+    db.close()
+    mycatalog = catalog.Catalog(path)
+    mycatalog.add_lineage('1' * 64, '2' * 64)
+    mycatalog.close()
+    mycatalog = catalog.Catalog(path)
+    assert mycatalog.image_ids() == set()
+    assert len(mycatalog.lineage('2' * 64)) == 1
+    mycatalog.close()
+
+
+def test_sync(tmpdir):
+    """Only new labelled images are inspected and gone images dropped."""
+    inspected = []
+
+    class FakeClient(client.scClient):
+        def images(self, quiet=False, filters=None):
+            if filters == {'label': self.label_prefix}:
+                return ['sha256:' + 'a' * 64]
+            return [{'Id': 'sha256:' + 'a' * 64, 'RepoTags': ['analysis:1']},
+                    {'Id': 'sha256:' + 'c' * 64, 'RepoTags': ['ubuntu:14.04']}]
+
+        def inspect_image(self, image):
+            inspected.append(image)
+            return {'Created': '2016-03-01T10:00:00.123456789Z',
+                    'Config': {'Image': 'sha256:' + 'c' * 64,
+                               'Labels': {self.label_prefix: LABEL}}}
+
+    myclient = FakeClient(base_url="unix:///tmp/sc-test-docker.sock",
+                          version="1.21")
+    mycatalog = catalog.Catalog(str(tmpdir.join('catalog.db')))
+    mycatalog.add({'id': 'b' * 64, 'created': None, 'tags': [], 'base': [],
+                   'facts': []})
+    assert mycatalog.sync(myclient) == (1, 1)
+    assert mycatalog.sync(myclient) == (0, 0)
+    assert inspected == ['a' * 64]
+    found = mycatalog.search(orcid=ORCID, base="ubuntu")
+    assert found == [{'id': 'a' * 64, 'created': '2016-03-01T10:00:00Z',
+                      'tags': ['analysis:1'],
+                      'base': ['ubuntu:14.04', 'ubuntu']}]
+    mycatalog.close()
+
+
+def test_sync_built(tmpdir):
+    """The base of a built image is its nearest tagged parent, or the FROM
+    image recorded in the lineage index."""
+    built, other = 'a' * 64, 'b' * 64
+    parents = {'sha256:' + '1' * 64: 'sha256:' + '2' * 64,
+               'sha256:' + '2' * 64: 'sha256:' + 'c' * 64}
+
+    class FakeClient(client.scClient):
+        def images(self, quiet=False, filters=None):
+            if filters == {'label': self.label_prefix}:
+                return ['sha256:' + built, 'sha256:' + other]
+            return [{'Id': 'sha256:' + built, 'RepoTags': ['app:1']},
+                    {'Id': 'sha256:' + other, 'RepoTags': ['app:2']},
+                    {'Id': 'sha256:' + 'c' * 64, 'RepoTags': ['ubuntu:14.04']},
+                    {'Id': 'sha256:' + 'd' * 64, 'RepoTags': ['alpine:3.4']}]
+
+        def inspect_image(self, image):
+            if image in parents:
+                return {'Id': image, 'Parent': parents[image]}
+            # Config.Image of a built image is the last intermediate image.
+            return {'Created': '2016-03-01T10:00:00Z',
+                    'Parent': 'sha256:' + '1' * 64,
+                    'Config': {'Image': 'sha256:' + '1' * 64,
+                               'Labels': {self.label_prefix: LABEL}}}
+
+    myclient = FakeClient(base_url="unix:///tmp/sc-test-docker.sock",
+                          version="1.21")
+    mycatalog = catalog.Catalog(str(tmpdir.join('catalog.db')))
+    mycatalog.add_lineage('d' * 64, other, [('alpine:3.4', 'd' * 64)])
+    assert mycatalog.sync(myclient) == (2, 0)
+    found = mycatalog.search(base="ubuntu")
+    assert [image['id'] for image in found] == [built]
+    assert found[0]['base'] == ['ubuntu:14.04', 'ubuntu']
+    found = mycatalog.search(base="alpine")
+    assert [image['id'] for image in found] == [other]
+    mycatalog.close()
+
+
+def test_lineage(tmpdir):
+    """Ancestors and descendants come from the closure table."""
+    mycatalog = catalog.Catalog(str(tmpdir.join('catalog.db')))
+    base, a, b, c = [str(n) * 64 for n in range(1, 5)]
+    mycatalog.add_lineage('sha256:' + base, a, [('ubuntu', base)])
+    mycatalog.add_lineage(a, b, [('analysis:1', b)])
+    mycatalog.add_lineage(a, c)
+    assert not mycatalog.add_lineage(b, base)
+    assert mycatalog.resolve('ubuntu:latest') == base
+    assert mycatalog.resolve(c[:12]) == c
+    assert mycatalog.resolve('0' * 12) is None
+    assert mycatalog.lineage(b) == [
+        {'id': a, 'depth': 1, 'names': []},
+        {'id': base, 'depth': 2, 'names': ['ubuntu:latest']}]
+    assert [(image['id'], image['depth'])
+            for image in mycatalog.descendants(base)] == [
+        (a, 1), (b, 2), (c, 2)]
+    assert mycatalog.descendants(b) == []
+    mycatalog.close()
@@ -1,3 +1,7 @@
+import os
+import subprocess
+import sys
+
 import pytest
 from click.testing import CliRunner
 from sc import cli
@@ -29,3 +33,14 @@ def test_docker(runner):
     result = runner.invoke(cli.cli,input='docker --help')
     assert not result.exception
     assert result.exit_code == 0
+
+
+def test_lazy_imports():
+    """Importing the cli and docker passthrough loads nothing heavy."""
+    root = os.path.dirname(os.path.dirname(cli.__file__))
+    code = ("import sys; from sc import cli, dockercli; "
+            "print(' '.join(m for m in ('rdflib', 'docker', 'orcid', "
+            "'requests', 'cpuinfo') if sys.modules.get(m) is not None))")
+    env = dict(os.environ, PYTHONPATH=root)
+    output = subprocess.check_output([sys.executable, '-c', code], env=env)
+    assert output.strip() == ''
@@ -9,10 +9,295 @@ conainer are implimented to also write the provenance associated with that
 state change.
 """
 
+import io
+import json
 import tarfile
 import time
 import os
 
+import docker
+import pytest
+import requests
+from sc import client
+
+
+def daemon(requested, api_version="1.21"):
+    """Fake daemon request for a daemon at api_version that records the
+    requested URLs."""
+    def request(self, method, url, *args, **kwargs):
+        requested.append(url)
+        response = requests.Response()
+        response.status_code = 200
+        if url.endswith('/version'):
+            response._content = json.dumps({'ApiVersion': api_version})
+        elif '/v%s/' % api_version not in url:
+            response.status_code = 400
+            response._content = ("client is newer than server (client API "
+                                 "version: 1.24, server API version: %s)" %
+                                 api_version)
+        else:
+            response._content = '[]'
+        return response
+    return request
+
+
+def test_get_client(tmpdir, monkeypatch):
+    """Clients are shared and use the cached API version."""
+    requested = []
+    monkeypatch.setattr(client, '_clients', {})
+    monkeypatch.setattr(requests.Session, 'request', daemon(requested))
+    base_url = "unix:///tmp/sc-test-docker.sock"
+    cache_path = str(tmpdir.join('docker_api.json'))
+    with open(cache_path, 'w') as cache:
+        json.dump({base_url: "1.21"}, cache)
+    myclient = client.get_client(base_url, cache_path=cache_path)
+    assert myclient.api_version == "1.21"
+    assert client.get_client(base_url, cache_path=cache_path) is myclient
+    # The cached version costs no request of its own.
+    assert requested == []
+    assert myclient.images() == []
+    assert len(requested) == 1
+
+
+def test_get_client_stale(tmpdir, monkeypatch):
+    """A cached version the daemon rejects is negotiated again."""
+    requested = []
+    monkeypatch.setattr(client, '_clients', {})
+    monkeypatch.setattr(requests.Session, 'request', daemon(requested))
+    base_url = "unix:///tmp/sc-test-docker.sock"
+    cache_path = str(tmpdir.join('docker_api.json'))
+    with open(cache_path, 'w') as cache:
+        json.dump({base_url: "1.24", "tcp://other:2376": "1.24"}, cache)
+    myclient = client.get_client(base_url, cache_path=cache_path)
+    assert requested == []
+    assert myclient.images() == []
+    assert myclient.api_version == "1.21"
+    assert [url.split('localunixsocket')[1] for url in requested] == [
+        '/v1.24/images/json', '/version', '/v1.21/images/json']
+    with open(cache_path) as cache:
+        assert json.load(cache) == {base_url: "1.21",
+                                    "tcp://other:2376": "1.24"}
+
+
+def test_build_events():
+    """Build events are decoded across and within chunks."""
+    chunks = ['{"stream": "Step 1 : FROM alpine\\n"}\r\n{"stre',
+              'am": "Successfully built 0123abcd\\n"}\r\n']
+    events = list(client.build_events(chunks))
+    assert [event['stream'] for event in events] == [
+        "Step 1 : FROM alpine\n", "Successfully built 0123abcd\n"]
+    # Lines that are not JSON are dropped instead of held.
+    chunks = ['<html>Bad Gateway</html>\n{"stream": "a"}\nnot json\n',
+              'x' * (client.MAX_PENDING + 1), '\n{"stream": "b"}\n']
+    assert [event['stream'] for event in client.build_events(chunks)] == [
+        "a", "b"]
+
+
+def test_follow_build():
+    """Build output is echoed and the image ID found while streaming."""
+    myclient = client.scClient(base_url="unix:///tmp/sc-test-docker.sock",
+                               version="1.21")
+    myclient.build_output = io.BytesIO()
+    chunks = ['{"stream": "Step 1 : FROM alpine\\n"}\r\n',
+              '{"stream": "Successfully built 0123abcd\\n"}\r\n']
+    assert myclient.follow_build(chunks) == "0123abcd"
+    assert "Step 1 : FROM alpine" in myclient.build_output.getvalue()
+    digest = "sha256:" + "ab" * 32
+    chunks = ['{"aux": {"ID": "%s"}}\r\n' % digest,
+              '{"stream": "Successfully built abababababab\\n"}\r\n']
+    assert myclient.follow_build(chunks) == digest
+    assert myclient.resolve_image_id(digest) == "ab" * 32
+    assert myclient.resolve_image_id("") == ""
+    chunks = ['{"stream": "Step 2 : RUN false\\n"}\r\n',
+              '{"errorDetail": {}, "error": "returned a non-zero code"}']
+    with pytest.raises(client.BuildError) as error:
+        myclient.follow_build(chunks)
+    assert "Step 2 : RUN false" in str(error.value)
+
+
+def test_provenance_context(tmpdir):
+    """Build contexts copy in the provenance and set the label."""
+    myclient = client.scClient(base_url="unix:///tmp/sc-test-docker.sock",
+                               version="1.21")
+    tmpdir.join('Dockerfile').write("FROM alpine\nRUN true\n")
+    tmpdir.join('.dockerignore').write("*.log\n")
+    tmpdir.join('build.log').write("ignored")
+    label = {myclient.label_prefix: '{"@graph": "$HOME \\"x\\""}'}
+    files = [(myclient.provfilename, 'prov')]
+    context = myclient.provenance_context(lambda source: (files, label),
+                                          path=str(tmpdir))
+    tar = tarfile.open(fileobj=context)
+    names = tar.getnames()
+    assert 'build.log' not in names
+    assert '.smartcontainer/' + myclient.provfilename in names
+    assert '!.smartcontainer' in tar.extractfile('.dockerignore').read()
+    dockerfile = tar.extractfile(myclient.build_dockerfile).read()
+    assert dockerfile.startswith("FROM alpine\nRUN true\n")
+    assert "COPY .smartcontainer/%s /SmartContainer/" % \
+        myclient.provfilename in dockerfile
+    assert 'LABEL smartcontainer="{\\"@graph\\": \\"\\$HOME' in dockerfile
+    # Values are quoted with the escape character of the Dockerfile.
+    tmpdir.join('Dockerfile').write("# escape=`\nFROM alpine\n")
+    label = {myclient.label_prefix: '"C:\\a" `$x'}
+    context = myclient.provenance_context(lambda source: (files, label),
+                                          path=str(tmpdir))
+    dockerfile = tarfile.open(fileobj=context).extractfile(
+        myclient.build_dockerfile).read()
+    assert 'LABEL smartcontainer="`"C:\\a`" ```$x"' in dockerfile
+    # Non-ASCII labels, as byte or unicode strings.
+    for value in ('{"name": "Jos\xc3\xa9"}', u'{"name": "Jos\xe9"}'):
+        label = {myclient.label_prefix: value}
+        context = myclient.provenance_context(lambda source: (files, label),
+                                              path=str(tmpdir))
+        dockerfile = tarfile.open(fileobj=context).extractfile(
+            myclient.build_dockerfile).read()
+        assert 'Jos\xc3\xa9' in dockerfile
+
+
+def test_provenance_custom_context():
+    """Tar build contexts keep their .dockerignore, which may not be a
+    regular file."""
+    myclient = client.scClient(base_url="unix:///tmp/sc-test-docker.sock",
+                               version="1.21")
+    files = [(myclient.provfilename, 'prov')]
+    label = {myclient.label_prefix: '{}'}
+    for ignore in ('*.log\n', None):
+        original = io.BytesIO()
+        tar = tarfile.open(mode='w', fileobj=original)
+        dockerfile = 'FROM alpine\n'
+        tar.addfile(myclient.context_member('Dockerfile', dockerfile),
+                    io.BytesIO(dockerfile))
+        if ignore is None:
+            # A .dockerignore symlink has no data to read.
+            member = tarfile.TarInfo('.dockerignore')
+            member.type = tarfile.SYMTYPE
+            member.linkname = 'ignore'
+            tar.addfile(member)
+        else:
+            tar.addfile(myclient.context_member('.dockerignore', ignore),
+                        io.BytesIO(ignore))
+        tar.close()
+        original.seek(0)
+        context = myclient.provenance_context(
+            lambda source: (files, label), fileobj=original,
+            custom_context=True)
+        tar = tarfile.open(fileobj=context)
+        assert '.smartcontainer/' + myclient.provfilename in tar.getnames()
+        if ignore is None:
+            assert tar.getmember('.dockerignore').issym()
+        else:
+            assert tar.extractfile('.dockerignore').read() == \
+                '*.log\n!.smartcontainer\n'
+
+
+def test_build_state_change(tmpdir):
+    """A build on a smart container appends to its provenance."""
+    class FakeClient(client.scClient):
+        def inspect_image(self, image):
+            labels = {}
+            if image == 'analysis:1':
+                labels[self.label_prefix] = '{}'
+            return {'Id': 'sha256:' + image, 'Config': {'Labels': labels}}
+
+        def readImageProv(self, image):
+            assert image == 'sha256:analysis:1'
+            return {self.provfilename: 'base provenance\n'}
+
+    myclient = FakeClient(base_url="unix:///tmp/sc-test-docker.sock",
+                          version="1.21")
+    tmpdir.join('Dockerfile').write("FROM analysis:1\nRUN true\n")
+    context = myclient.provenance_context(myclient.buildStateChange,
+                                          path=str(tmpdir))
+    tar = tarfile.open(fileobj=context)
+    prov = tar.extractfile('.smartcontainer/' + myclient.provfilename).read()
+    assert prov.startswith('base provenance\n')
+    assert len(prov) > len('base provenance\n')
+    files, label = myclient.buildStateChange("FROM alpine\n")
+    assert not files[0][1].startswith('base provenance')
+    assert myclient.label_prefix in label
+
+
+def test_infect_images():
+    """Bulk infection skips labelled images and retags the new images."""
+    class FakeClient(client.scClient):
+        tagged = []
+
+        def images(self, quiet=False, filters=None):
+            if filters == {'label': self.label_prefix}:
+                return ['sha256:b']
+            return [{'Id': 'sha256:a', 'RepoTags': ['reg:5000/a:1']},
+                    {'Id': 'sha256:b', 'RepoTags': ['b:latest']},
+                    {'Id': 'sha256:c', 'RepoTags': ['<none>:<none>']}]
+
+        def infect_image(self, image, *args, **kwargs):
+            if image == 'sha256:c':
+                raise docker.errors.DockerException("no shell")
+            return 'sha256:new-' + image[-1]
+
+        def tag(self, image, repository, tag=None, force=False):
+            self.tagged.append((image, repository, tag))
+
+    myclient = FakeClient(base_url="unix:///tmp/sc-test-docker.sock",
+                          version="1.21")
+    results = myclient.infect_images(workers=2)
+    assert [r['image'] for r in results] == ['sha256:a', 'sha256:c']
+    assert results[0]['Id'] == 'sha256:new-a'
+    assert results[1]['error'] == "no shell"
+    # Tags are only moved when asked to.
+    assert myclient.tagged == []
+    myclient.infect_images(workers=2, retag=True)
+    assert myclient.tagged == [('sha256:new-a', 'reg:5000/a', '1')]
+
+
+def test_infect_image_cleanup(monkeypatch):
+    """The helper container is removed when infection fails."""
+    removed = []
+
+    def start(self, container, *args, **kwargs):
+        raise docker.errors.APIError("no such file: /bin/sh",
+                                     requests.Response())
+
+    monkeypatch.setattr(docker.Client, 'inspect_image', lambda self, image: {
+        'Id': 'sha256:' + 'a' * 64, 'Config': {'Labels': {}}})
+    monkeypatch.setattr(docker.Client, 'create_container',
+                        lambda self, *args, **kwargs: {'Id': 'helper'})
+    monkeypatch.setattr(docker.Client, 'start', start)
+    monkeypatch.setattr(docker.Client, 'remove_container',
+                        lambda self, container, force=False: removed.append(
+                            (container, force)))
+    myclient = client.scClient(base_url="unix:///tmp/sc-test-docker.sock",
+                               version="1.21")
+    with pytest.raises(docker.errors.APIError):
+        myclient.infect_image('a' * 64)
+    assert removed == [('helper', True)]
+
+
+def test_record_build_lineage(tmpdir, monkeypatch):
+    """A build is recorded as a descendant of its last FROM image."""
+    from sc import catalog, dockerfileParser
+    monkeypatch.setenv('SC_HOME', str(tmpdir))
+    base, built = 'sha256:' + '1' * 64, 'sha256:' + '2' * 64
+
+    class FakeClient(client.scClient):
+        def inspect_image(self, image):
+            assert image == 'ubuntu:14.04'
+            return {'Id': base}
+
+    myclient = FakeClient(base_url="unix:///tmp/sc-test-docker.sock",
+                          version="1.21")
+    instructions = dockerfileParser.parse(
+        "FROM alpine AS tools\n"
+        "FROM --platform=linux/amd64 ubuntu:14.04 AS app\n")
+    myclient.record_build_lineage(instructions, built, 'app:1')
+    myclient.record_build_lineage(dockerfileParser.parse("FROM scratch\n"),
+                                  '3' * 64)
+    mycatalog = catalog.Catalog()
+    assert mycatalog.resolve('app:1') == '2' * 64
+    assert mycatalog.lineage('2' * 64) == [
+        {'id': '1' * 64, 'depth': 1, 'names': ['ubuntu:14.04']}]
+    assert mycatalog.lineage('3' * 64) == []
+    mycatalog.close()
+
 
 def test_simple_tar(createClient):
     """Tarfile creation.
@@ -29,6 +314,42 @@ def test_simple_tar(createClient):
     assert tarfile.is_tarfile(thisfile.name)
 
 
+def test_buffer_tar():
+    """In-memory tarfile creation.
+
+    Create tar archive from a buffer and assert that the member is stored
+    under the provenance path with the original contents.
+    """
+    myclient = client.scClient(base_url="unix:///tmp/sc-test-docker.sock",
+                               version="1.21")
+    data = 'This is the data for the tar file test.'
+    tarbytes = myclient.buffer_tar(data, 'SCProv.jsonld', '/SmartContainer/')
+    thisTar = tarfile.open(fileobj=io.BytesIO(tarbytes))
+    member = thisTar.getmember('SmartContainer/SCProv.jsonld')
+    assert thisTar.extractfile(member).read() == data
+
+
+def test_bufferCopyInOut(createClient, pull_docker_image):
+    """Buffer copy into and out of a container.
+
+    Copy provenance data into a container without a local file and read it
+    back through the archive stream.
+    """
+    newContainer = createClient.create_container(image=pull_docker_image,
+                                                 command="/bin/sh", tty=True)
+    ContainerID = str(newContainer['Id'])
+    createClient.start(ContainerID)
+    data = 'This is the data for the tar file test.'
+    createClient.bufferCopyIn(ContainerID, data, 'SCProv.jsonld',
+                              '/SmartContainer/')
+    assert createClient.bufferCopyOut(ContainerID, 'SCProv.jsonld',
+                                      '/SmartContainer/') == data
+    assert not os.path.isfile('temp.tar')
+    time.sleep(1)
+    createClient.stop(ContainerID)
+    createClient.remove_container(ContainerID)
+
+
 def test_fileCopyIn(createClient, pull_docker_image):
     """File Copy into container from image.
 
@@ -69,6 +390,25 @@ def test_fileCopyOut(createClient, pull_docker_image):
     os.remove('SCProv.jsonld')
 
 
+def test_hasProv_stopped(createClient, pull_docker_image):
+    """Provenance check on a container that is not running.
+
+    The archive stat does not need a shell in the container, so a created
+    but never started container can be checked.
+    """
+    newContainer = createClient.create_container(image=pull_docker_image,
+                                                 command="/bin/sh")
+    ContainerID = str(newContainer['Id'])
+    assert not createClient.hasProv(ContainerID, 'SCProv.jsonld',
+                                    '/SmartContainer/')
+    createClient.bufferCopyIn(ContainerID, 'data', 'SCProv.jsonld',
+                              '/SmartContainer/')
+    createClient.forget_prov(ContainerID)
+    assert createClient.hasProv(ContainerID, 'SCProv.jsonld',
+                                '/SmartContainer/')
+    createClient.remove_container(ContainerID)
+
+
 def test_put_label_image(createClient, pull_docker_image):
     """Add label to docker image.
 
@@ -86,6 +426,24 @@ def test_put_label_image(createClient, pull_docker_image):
     createClient.remove_image(image_id)
 
 
+def test_label_conf():
+    """Single-pass commit config.
+
+    The label is merged into the commit config and read back from the image
+    Config in preference to the ContainerConfig.
+    """
+    myclient = client.scClient(base_url="unix:///tmp/sc-test-docker.sock",
+                               version="1.21")
+    myLabel = {'smartcontainer': '{"author":"Scott B. Szakonyi"}'}
+    conf = myclient.label_conf({'Labels': {'other': 'x'}}, myLabel)
+    assert conf['Labels'] == {'other': 'x',
+                              'smartcontainer': myLabel['smartcontainer']}
+    inspect = {'ContainerConfig': {'Labels': {'smartcontainer': 'old'}},
+               'Config': conf}
+    labels = myclient.image_labels(inspect)
+    assert labels['smartcontainer'] == myLabel['smartcontainer']
+
+
 def test_infect_image(createClient, pull_docker_image):
     """TODO: Create new Smart Container from docker image ID.
 
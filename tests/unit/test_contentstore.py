@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+"""Tests for the SmartContainers content-addressed graph store."""
+import os
+
+from sc import contentStore
+
+
+def test_put_get(tmpdir):
+    """Objects are stored and fetched by their sha256 digest."""
+    store = contentStore.ContentStore(str(tmpdir))
+    data = '{"@graph":[]}'
+    address = store.put(data)
+    assert address == contentStore.digest(data)
+    assert address.startswith('sha256:')
+    assert store.has(address)
+    assert store.get(address) == data
+    # Storing the same contents again reuses the object.
+    assert store.put(data) == address
+    assert len(os.listdir(os.path.dirname(store.path(address)))) == 1
+
+
+def test_get_missing(tmpdir):
+    """Unknown digests are reported as missing."""
+    store = contentStore.ContentStore(str(tmpdir))
+    address = contentStore.digest('missing')
+    assert not store.has(address)
+    assert store.get(address) is None
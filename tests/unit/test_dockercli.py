@@ -43,6 +43,31 @@ def test_DockerCli():
     assert dockertester3.location is not None
 
 
+def test_split_command():
+    """Subcommands are found after docker global options."""
+    argv = ['-H', 'tcp://host:2376', '--tlsverify', 'run', '--name',
+            'commit-bot', 'alpine']
+    options, name, args = dockercli.split_command(argv)
+    assert options == ['-H', 'tcp://host:2376', '--tlsverify']
+    assert name == 'run'
+    assert args == ['--name', 'commit-bot', 'alpine']
+    assert dockercli.split_command(['--help']) == (['--help'], None, [])
+
+
+def test_captures():
+    """Only provenance subcommands are captured."""
+    assert dockercli.captures('build .')
+    assert dockercli.captures(['--debug', 'commit', 'abc'])
+    assert not dockercli.captures('run --name commit-bot alpine')
+    assert not dockercli.captures('ps --filter label=build')
+    assert not dockercli.captures('--help')
+    # Commands for another daemon are passed through.
+    assert not dockercli.captures('-H tcp://remote:2376 build .')
+    assert not dockercli.captures(['--host=tcp://remote:2376', 'commit', 'a'])
+    assert not dockercli.captures('--tlsverify build .')
+    assert dockercli.captures('-D -l debug build .')
+
+
 class TestDockerCli:
     """Test docker commands."""
 
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""Tests for Smart Containers dockerfileParser.
+
+Tests for the single pass Dockerfile parser used by the buildProcessor.
+"""
+import pytest
+
+from sc import dockerfileParser
+
+
+def test_parse_continuations_and_comments():
+    dockerfile = ("from ubuntu\n"
+                  "# A comment\n"
+                  "RUN apt-get update \\\n"
+                  "# comment inside the continuation\n"
+                  "\n"
+                  "  && apt-get install -y curl\n"
+                  "RUN cp Schema\\ 32/a.csv /om\n"
+                  "CMD [\"-h\"]")
+    instructions = dockerfileParser.parse(dockerfile)
+    assert [i.command for i in instructions] == ['FROM', 'RUN', 'RUN', 'CMD']
+    assert instructions[0].value == 'ubuntu'
+    assert instructions[1].original == \
+        'RUN apt-get update   && apt-get install -y curl'
+    assert instructions[1].line == 3
+    assert instructions[2].value == 'cp Schema\\ 32/a.csv /om'
+    assert instructions[3].value == '["-h"]'
+
+
+def test_parse_escape_directive():
+    dockerfile = ("# escape=`\n"
+                  "FROM windowsservercore\n"
+                  "COPY testfile.txt c:\\ `\n"
+                  "  c:\\dest\\\n")
+    instructions = dockerfileParser.parse(dockerfile)
+    assert instructions[1].value == 'testfile.txt c:\\   c:\\dest\\'
+    with pytest.raises(ValueError):
+        dockerfileParser.parse("# escape=x\nFROM alpine\n")
+    # Directives after the first instruction are comments.
+    instructions = dockerfileParser.parse("FROM alpine\n# escape=`\n")
+    assert len(instructions) == 1
+    assert dockerfileParser.directives(dockerfile) == {'escape': '`'}
+    assert dockerfileParser.directives("FROM alpine\n# escape=`\n") == {}
+
+
+def test_parse_heredoc():
+    dockerfile = ("FROM alpine\n"
+                  "RUN <<EOF\n"
+                  "echo hello\n"
+                  "EOF\n"
+                  "COPY <<-\"END\" /greeting\n"
+                  "\thi\n"
+                  "\tEND\n"
+                  "USER root\n")
+    instructions = dockerfileParser.parse(dockerfile)
+    assert [i.command for i in instructions] == ['FROM', 'RUN', 'COPY',
+                                                 'USER']
+    assert instructions[1].heredocs == (('EOF', 'echo hello\n'),)
+    assert instructions[2].heredocs == (('END', 'hi\n'),)
+
+
+def test_base_image():
+    dockerfile = ("FROM --platform=linux/amd64 golang:1.7 AS build\n"
+                  "FROM alpine AS tools\n"
+                  "FROM build\n")
+    instructions = dockerfileParser.parse(dockerfile)
+    assert dockerfileParser.base_image(instructions) == 'golang:1.7'
+    instructions = dockerfileParser.parse("FROM scratch\nCOPY a /\n")
+    assert dockerfileParser.base_image(instructions) == 'scratch'
+    assert dockerfileParser.base_image([]) is None
@@ -19,5 +19,30 @@ def test_create_graph():
     vocab.build()
     print vocab.graph.serialize(format='turtle')
 
+def test_environment_cache(tmpdir, monkeypatch):
+    """The host environment is probed once and reused from the cache."""
+    path = str(tmpdir.join('environment.json'))
+    environment = envVocabulary.load_environment(path)
+    assert environment['key'] == envVocabulary.environment_key()
+
+    def probe():
+        raise AssertionError("environment probed twice")
+    monkeypatch.setattr(envVocabulary, 'probe_environment', probe)
+    assert envVocabulary.load_environment(path) == environment
+
+
+def test_stable_uris():
+    """Identical environments get the same URIs."""
+    facts = {'os': 'linux', 'kernel': '4.4.0', 'architecture': 'amd64',
+             'cores': 4, 'processor': 'Intel(R) Xeon(R)'}
+    uris = envVocabulary.environment_uris(facts)
+    assert uris == envVocabulary.environment_uris(dict(facts))
+    assert len(set(uris.values())) == 4
+    facts['cores'] = 8
+    other = envVocabulary.environment_uris(facts)
+    assert other['architecture'] == uris['architecture']
+    assert other['processor'] != uris['processor']
+
+
 if __name__ == "__main__":
     pytest.main([__file__, '--color=yes', '-s'])
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""Tests for the Smart Containers docker events watcher."""
+import json
+import threading
+import time
+
+import requests
+
+from sc import eventWatcher
+
+
+def raw_events(count, since=0):
+    """Raw event stream chunks in the format of API 1.21, with events split
+    across chunks."""
+    text = ''
+    for index in range(since, count):
+        container = 'container%d' % (index // 2)
+        status = 'die' if index % 2 else 'start'
+        text += json.dumps({'status': status, 'id': container,
+                            'from': 'ubuntu', 'time': 1450000000 + index})
+    return [text[i:i + 1000] for i in range(0, len(text), 1000)]
+
+
+class FakeClient(object):
+    """Streams a burst of events, loses the connection, then replays."""
+
+    def __init__(self, count):
+        self.count = count
+        self.calls = []
+        self.replayed = threading.Event()
+
+    def events(self, since=None, until=None, filters=None, decode=None):
+        self.calls.append(since)
+        if len(self.calls) == 1:
+            return self.stream(raw_events(self.count))
+        self.replayed.set()
+        # The replay starts at the second of the last event read.
+        return iter(raw_events(self.count, since - 1450000000))
+
+    def stream(self, chunks):
+        for chunk in chunks:
+            yield chunk
+        raise requests.exceptions.ConnectionError("stream lost")
+
+
+def test_watch_burst(tmpdir):
+    """A burst is journaled in batches, with replayed events dropped."""
+    myclient = FakeClient(5000)
+    journal = str(tmpdir.join('events.jsonl'))
+    watcher = eventWatcher.EventWatcher(myclient, journal, batch_size=200,
+                                        queue_size=1000)
+    watcher.reconnect_delay = 0.01
+    watcher.start()
+    assert myclient.replayed.wait(10)
+    deadline = time.time() + 10
+    while watcher.counts['records'] < 5000 and time.time() < deadline:
+        time.sleep(0.01)
+    watcher.stop(10)
+    assert not watcher.running()
+    assert myclient.calls[:2] == [None, 1450004999]
+    with open(journal) as records:
+        lines = [json.loads(line) for line in records]
+    assert len(lines) == 5000
+    assert len(set(line['id'] for line in lines)) == 5000
+    assert watcher.counts['duplicates'] >= 1
+    assert watcher.counts['batches'] < 5000
+    die = lines[1]
+    assert die['activity'] == 'docker:dieOperation'
+    assert die['container'] == 'container0'
+    assert die['startedAtTime'] == '2015-12-13T09:46:40Z'
+
+
+def test_event_fields():
+    """Events from newer API versions carry the actor attributes."""
+    fields = eventWatcher.event_fields({
+        'Type': 'container', 'Action': 'die', 'time': 1450000000,
+        'timeNano': 1450000000123456789,
+        'Actor': {'ID': 'abc', 'Attributes': {'image': 'ubuntu',
+                                              'name': 'web',
+                                              'exitCode': '137'}}})
+    assert fields['action'] == 'die'
+    assert fields['container'] == 'abc'
+    assert fields['image'] == 'ubuntu'
+    assert fields['name'] == 'web'
+    assert fields['key'] == '1450000000123456789'
+    assert fields['attributes'] == {'exitCode': '137'}
+
+
+class ReplayClient(object):
+    """Streams the events since the time asked for, then waits."""
+
+    def __init__(self, count):
+        self.count = count
+        self.calls = []
+
+    def events(self, since=None, until=None, filters=None, decode=None):
+        self.calls.append(since)
+        first = since - 1450000000 if since else 0
+        for chunk in raw_events(self.count, first):
+            yield chunk
+        threading.Event().wait(10)
+
+
+def watch(myclient, journal, count, since=None):
+    """Run a watcher until it has seen count events."""
+    watcher = eventWatcher.EventWatcher(myclient, journal, since=since)
+    watcher.start()
+    deadline = time.time() + 10
+    while watcher.counts['events'] < count and time.time() < deadline:
+        time.sleep(0.01)
+    watcher.stop(10)
+    return watcher
+
+
+def test_watch_restart(tmpdir):
+    """A restarted watcher resumes from the last event without writing
+    records again."""
+    journal = str(tmpdir.join('events.jsonl'))
+    watch(ReplayClient(10), journal, 10)
+    myclient = ReplayClient(20)
+    watcher = watch(myclient, journal, 11)
+    assert myclient.calls == [1450000009]
+    watch(ReplayClient(20), journal, 20, since=1450000000)
+    with open(journal) as records:
+        lines = [json.loads(line) for line in records]
+    assert len(lines) == 20
+    assert len(set(line['id'] for line in lines)) == 20
+    assert watcher.counts['duplicates'] == 1
+
+
+def test_watch_errors(tmpdir, monkeypatch):
+    """A batch that can't be recorded doesn't stop the writer."""
+    journal = str(tmpdir.join('events.jsonl'))
+    watcher = eventWatcher.EventWatcher(ReplayClient(400), journal,
+                                        batch_size=10, queue_size=10)
+    record = watcher.record
+
+    def failing(event):
+        if event['time'] % 100 == 0:
+            raise IOError("No space left on device")
+        return record(event)
+    monkeypatch.setattr(watcher, 'record', failing)
+    watcher.start()
+    deadline = time.time() + 10
+    while watcher.counts['events'] < 400 and time.time() < deadline:
+        time.sleep(0.01)
+    watcher.stop(10)
+    assert not watcher.running()
+    assert watcher.counts['errors'] == 4
+    assert 0 < watcher.counts['records'] < 400
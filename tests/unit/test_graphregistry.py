@@ -56,5 +56,67 @@ def test_create_graph():
     assert '@context' in jsongraph
 
 
+def test_serialization_cache():
+    """Serializations are reused until the graph changes."""
+    from sc import graphManager
+
+    tstregistry = graphManager.VocabularyRegistry()
+    tstregistry.register(Vocabulary1())
+    tstregistry.build_graph()
+    first = tstregistry.get_json_ld()
+    assert tstregistry.get_json_ld() is first
+    turtle = tstregistry.get_turtle()
+    assert tstregistry.get_turtle() is turtle
+    # Adding a graph bumps the version and rebuilds the serializations.
+    tstregistry.add_graph('<%s> <%s> "cached" .' % (uuidurn, RDFS.label))
+    assert 'cached' in tstregistry.get_turtle()
+    assert tstregistry.get_json_ld() is not first
+
+
+@pytest.mark.parametrize('processes', [False, True])
+def test_parallel_build(processes):
+    """Vocabularies build concurrently and merge in name order."""
+    from rdflib import Dataset
+    from sc import graphManager
+
+    tstregistry = graphManager.VocabularyRegistry()
+    tstregistry.REGISTRY = {}
+    tstregistry.global_context = {}
+    tstregistry.global_graph = Dataset(default_union=True)
+    tstregistry.build_processes = processes
+    tstregistry.register(Vocabulary2())
+    tstregistry.register(Vocabulary1())
+    tstregistry.build_graph()
+    assert sorted(tstregistry.build_times) == ['Vocabulary1', 'Vocabulary2']
+    assert len(tstregistry.global_graph.graph(tstregistry.graph_uri)) == 2
+    assert (URIRef(uuidurn), RDFS.label, Literal(
+        "Docker: https://www.docker.com/")) in tstregistry.global_graph
+    assert set(tstregistry.global_context) == set(['prov', 'rdf'])
+
+
+
+def test_new_state_change():
+    """Each state change is recorded in a graph of its own."""
+    from rdflib import Dataset
+    from sc import graphManager
+
+    tstregistry = graphManager.VocabularyRegistry()
+    tstregistry.REGISTRY = {}
+    tstregistry.global_graph = Dataset(default_union=True)
+    tstregistry.register(Vocabulary1())
+    first = tstregistry.new_state_change()
+    nquads = tstregistry.get_nquads()
+    second = tstregistry.new_state_change()
+    assert second != first
+    assert str(second) in tstregistry.get_nquads()
+    assert str(first) not in tstregistry.get_nquads()
+    # The vocabulary triples move to the new graph.
+    assert len(tstregistry.global_graph.graph(second)) == 1
+    assert len(tstregistry.global_graph.graph(first)) == 0
+    assert str(first) in nquads
+    with tstregistry.state_change() as third:
+        assert third == tstregistry.graph_uri != second
+
+
 if __name__ == "__main__":
     pytest.main([__file__, '--color=yes', '-s'])
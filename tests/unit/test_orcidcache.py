@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""Tests for the ORCID response cache, against a local stand-in for the
+ORCID public API."""
+import BaseHTTPServer
+import json
+import threading
+import urlparse
+
+import pytest
+import requests
+
+from sc import orcidCache
+
+ORCID = "0000-0002-1825-0097"
+TURTLE = "<http://orcid.org/%s> a <http://xmlns.com/foaf/0.1/Person> .\n" % ORCID
+
+
+class OrcidHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Answers profile and search requests like the ORCID public API."""
+
+    requests = []
+    # Status of every answer while the API is failing.
+    failing = None
+
+    def do_GET(self):
+        self.requests.append(self.path)
+        url = urlparse.urlparse(self.path)
+        if self.failing:
+            body, status = 'Service unavailable', self.failing
+        elif url.path == '/' + ORCID:
+            body, status = TURTLE, 200
+        elif url.path == '/search/orcid-bio/':
+            query = urlparse.parse_qs(url.query)['q'][0]
+            body, status = json.dumps({'orcid-search-results': {
+                'num-found': 1, 'q': query}}), 200
+        else:
+            body, status = 'Not found', 404
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def orcid_api():
+    OrcidHandler.requests = []
+    OrcidHandler.failing = None
+    server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), OrcidHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def endpoint(server):
+    return 'http://127.0.0.1:%d' % server.server_address[1]
+
+
+def test_fetch(tmpdir, orcid_api):
+    """Profiles are fetched once, again when expired, and served expired
+    when the API is down."""
+    cache = orcidCache.ResponseCache(str(tmpdir.join('orcid.db')))
+    url = endpoint(orcid_api) + '/' + ORCID
+    key = 'turtle:' + ORCID
+    assert orcidCache.fetch(cache, key, url) == (200, TURTLE, 'network')
+    assert orcidCache.fetch(cache, key, url) == (200, TURTLE, 'cache')
+    assert len(OrcidHandler.requests) == 1
+    missing = endpoint(orcid_api) + '/0000-0000-0000-0000'
+    assert orcidCache.fetch(cache, 'turtle:missing', missing)[0] == 404
+    assert cache.get('turtle:missing') is None
+    cache.ttl = -1
+    assert orcidCache.fetch(cache, key, url)[2] == 'network'
+    # Server errors are answered from the cache too.
+    OrcidHandler.failing = 503
+    assert orcidCache.fetch(cache, key, url) == (200, TURTLE, 'offline')
+    assert orcidCache.fetch(cache, 'turtle:other', url + '0')[0] == 503
+    OrcidHandler.failing = None
+    orcid_api.shutdown()
+    orcid_api.server_close()
+    assert orcidCache.fetch(cache, key, url, timeout=1) == (
+        200, TURTLE, 'offline')
+    with pytest.raises(requests.exceptions.RequestException):
+        orcidCache.fetch(cache, 'turtle:other', url + '0', timeout=1)
+    cache.close()
+
+
+def test_fetch_timeout(tmpdir, monkeypatch):
+    """Requests time out by default, so the cache answers when the network
+    drops packets."""
+    def get(url, headers=None, timeout=None):
+        assert timeout == orcidCache.DEFAULT_TIMEOUT
+        raise requests.exceptions.ConnectTimeout("timed out")
+
+    cache = orcidCache.ResponseCache(str(tmpdir.join('orcid.db')))
+    cache.put('turtle:' + ORCID, TURTLE)
+    cache.ttl = -1
+    monkeypatch.setattr(requests, 'get', get)
+    assert orcidCache.fetch(cache, 'turtle:' + ORCID, 'http://orcid') == (
+        200, TURTLE, 'offline')
+    cache.close()
+
+
+def test_search(tmpdir, orcid_api):
+    """Searches that differ only in case and spacing share an entry."""
+    cache = orcidCache.ResponseCache(str(tmpdir.join('orcid.db')))
+
+    def search_public(query, start=None, rows=None):
+        response = requests.get(endpoint(orcid_api) + '/search/orcid-bio/',
+                                params={'q': query, 'start': start,
+                                        'rows': rows})
+        return response.json()
+
+    results = orcidCache.search(cache, search_public,
+                                'given-names:Josiah AND family-name:Carberry',
+                                start=0, rows=100)
+    again = orcidCache.search(cache, search_public,
+                              ' Given-Names:josiah  AND family-name:CARBERRY',
+                              start=0, rows=100)
+    assert again == results
+    assert len(OrcidHandler.requests) == 1
+    orcidCache.search(cache, search_public,
+                      'given-names:Josiah OR family-name:Carberry',
+                      start=0, rows=100)
+    assert len(OrcidHandler.requests) == 2
+    cache.close()
+
+
+def test_lru_eviction(tmpdir):
+    """The least recently used entries are evicted beyond max_size."""
+    cache = orcidCache.ResponseCache(str(tmpdir.join('orcid.db')),
+                                     max_size=25)
+    cache.put('a', 'x' * 10)
+    cache.put('b', 'x' * 10)
+    assert cache.get('a') is not None
+    cache.put('c', 'x' * 10)
+    assert cache.get('b') is None
+    assert cache.get('a') == 'x' * 10
+    assert cache.get('c') == 'x' * 10
+    cache.close()
@@ -1,6 +1,8 @@
 import pytest
+import json
 import os
 import docker
+import rdflib
 from sc import scMetadata
 
 def test_appendData():
@@ -13,9 +15,96 @@ def test_appendData():
     assert os.stat('tempprov.txt').st_size > 0
     os.remove('tempprov.txt')
 
+def test_appendBuffer():
+    #Create scMetadata instance
+    scmd = scMetadata.scMetadata()
+    #Append to an existing buffer without touching the filesystem
+    data = scmd.appendBuffer('existing')
+    assert data.startswith('existing')
+    assert len(data) > len('existing')
+
 def test_labelDictionary():
     #Create scMetadata instance
     scmd = scMetadata.scMetadata()
     #Call for the dictionary object
     thisObject = scmd.labelDictionary('smartcontainer')
-    assert type(thisObject) == dict
\ No newline at end of file
+    assert type(thisObject) == dict
+
+def test_appendIncremental():
+    from sc import graphRegistry
+    #Create scMetadata instance
+    scmd = scMetadata.scMetadata()
+    registry = graphRegistry.get_registry()
+    #Append two state changes to an empty buffer and manifest
+    registry.new_state_change()
+    data, manifest = scmd.appendIncremental(None, None)
+    registry.new_state_change()
+    data, manifest = scmd.appendIncremental(data, manifest)
+    entries = scmd.readManifest(manifest)
+    assert len(entries) == 2
+    assert entries[0]['graph'] != entries[1]['graph']
+    assert entries[1]['offset'] == entries[0]['length']
+    assert entries[1]['offset'] + entries[1]['length'] == len(data)
+    #Each manifest entry is a complete named graph
+    graphs = list(scmd.iterGraphs(data, manifest))
+    assert [uri for uri, graph in graphs] == [e['graph'] for e in entries]
+    assert len(graphs[0][1]) > 0
+    #Each state change is reassembled as its own graph
+    ds = scmd.loadDataset(data, manifest)
+    for uri, graph in graphs:
+        assert len(ds.graph(rdflib.URIRef(uri))) == len(graph)
+    #Only the graph asked for is parsed
+    ds = scmd.loadDataset(data, manifest, [entries[1]['graph']])
+    assert len(ds.graph(rdflib.URIRef(entries[0]['graph']))) == 0
+
+
+def test_labelReference(tmpdir):
+    from sc import contentStore
+    #Create scMetadata instance and a store in a temporary directory
+    scmd = scMetadata.scMetadata()
+    store = contentStore.ContentStore(str(tmpdir))
+    label = scmd.labelReference('smartcontainer', store)
+    summary = scmd.readReference(label['smartcontainer'])
+    assert summary['size'] > len(label['smartcontainer'])
+    #The graph is fetched from the store by its digest
+    data = scmd.resolveReference(summary, store)
+    assert contentStore.digest(data) == summary['digest']
+    #A store miss falls back to the tail of the provenance file
+    other = contentStore.ContentStore(str(tmpdir.join('other')))
+    assert scmd.resolveReference(summary, other) is None
+    assert scmd.resolveReference(summary, other, 'older' + data) == data
+    #The summary counts the labelled graph and names its file
+    from sc import graphRegistry
+    registry = graphRegistry.get_registry()
+    assert summary['triples'] == len(registry.export_graph())
+    assert summary['format'] == 'json-ld'
+    assert 'file' not in summary
+    #Incremental provenance is resolved from the N-Quads file
+    label = scmd.labelReference('smartcontainer', store, 'SCProv.nq',
+                                'nquads')
+    summary = scmd.readReference(label['smartcontainer'])
+    assert (summary['file'], summary['format']) == ('SCProv.nq', 'nquads')
+    nquads, manifest = scmd.appendIncremental('older\n', None)
+    data = scmd.resolveReference(summary, other, nquads)
+    assert summary['graph'] in data
+    assert isinstance(json.loads(data), (dict, list))
+    #Inline labels are not references
+    inline = scmd.labelDictionary('smartcontainer')
+    assert scmd.readReference(inline['smartcontainer']) is None
+
+
+def test_encodeLabel():
+    #Create scMetadata instance
+    scmd = scMetadata.scMetadata()
+    #Literals with spaces and quotes survive the label encoding
+    graph = '{\n  "@graph": [{"@id": "urn:x", "rdfs:label": "it\'s a \\"quoted\\" value"}]\n}'
+    value = scmd.encodeLabel(graph)
+    assert '\n' not in value
+    assert json.loads(scmd.decodeLabel(value)) == json.loads(graph)
+    #Large values are compressed and decode to the same graph
+    compressed = scmd.encodeLabel(graph, compress_over=0)
+    assert compressed.startswith(scMetadata.GZIP_PREFIX)
+    assert scmd.decodeLabel(compressed) == value
+    #The label dictionary holds the encoded graph
+    label = scmd.labelDictionary('smartcontainer', compress_over=0)
+    assert '@context' in json.loads(scmd.decodeLabel(label['smartcontainer']))
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""Tests for SPARQL queries over Smart Containers provenance."""
+import json
+
+import pytest
+import rdflib
+
+from sc import client, sparqlQuery
+
+NQUADS = """\
+<urn:uuid:a> <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> \
+<http://www.w3.org/ns/prov#Activity> <urn:uuid:g> .
+<urn:uuid:a> <http://www.w3.org/ns/prov#startedAtTime> \
+"2016-01-01T00:00:00Z"^^<http://www.w3.org/2001/XMLSchema#dateTime> \
+<urn:uuid:g> .
+<urn:uuid:b> <http://www.w3.org/1999/02/22-rdf-syntax-ns#type> \
+<http://www.w3.org/ns/prov#Activity> <urn:uuid:g> .
+"""
+QUERY = """SELECT ?a ?t WHERE {
+    ?a a prov:Activity .
+    OPTIONAL { ?a prov:startedAtTime ?t }
+    FILTER (?a != <urn:uuid:c> && regex(str(?a), "^urn:"))
+} ORDER BY ?a"""
+
+
+def test_query_cache(tmpdir):
+    """Prepared queries are cached on disk and give the same results."""
+    dataset = rdflib.Dataset(default_union=True)
+    dataset.parse(data=NQUADS, format='nquads')
+    cache = sparqlQuery.QueryCache(str(tmpdir))
+    rows = list(cache.query(dataset, QUERY))
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert [str(row[0]) for row in rows] == ['urn:uuid:a', 'urn:uuid:b']
+    assert rows[1][1] is None
+    cache = sparqlQuery.QueryCache(str(tmpdir))
+    assert list(cache.query(dataset, QUERY)) == rows
+    assert (cache.hits, cache.misses) == (1, 0)
+    # An unreadable cache entry is prepared again.
+    with open(cache.path(sparqlQuery.query_key(QUERY)), 'w') as cached:
+        cached.write('broken')
+    cache = sparqlQuery.QueryCache(str(tmpdir))
+    assert list(cache.query(dataset, QUERY)) == rows
+    assert cache.misses == 1
+    # Entries are JSON and only name SPARQL operators.
+    with open(cache.path(sparqlQuery.query_key(QUERY))) as cached:
+        data = json.load(cached)
+    text = json.dumps(data).replace('"Builtin_REGEX"', '"__import__"')
+    assert text != json.dumps(data)
+    with pytest.raises(ValueError):
+        sparqlQuery.load_query(json.loads(text))
+    with open(cache.path(sparqlQuery.query_key(QUERY)), 'w') as cached:
+        cached.write(text)
+    cache = sparqlQuery.QueryCache(str(tmpdir))
+    assert list(cache.query(dataset, QUERY)) == rows
+    assert cache.misses == 1
+
+
+def test_query_cache_paths(tmpdir):
+    """Property paths and aggregates survive the cache."""
+    dataset = rdflib.Dataset(default_union=True)
+    dataset.parse(data=NQUADS, format='nquads')
+    query = """SELECT ?a (COUNT(?t) AS ?n) WHERE {
+        ?a rdf:type/^rdf:type* ?b .
+        OPTIONAL { ?a prov:startedAtTime|prov:endedAtTime ?t }
+    } GROUP BY ?a ORDER BY ?a"""
+    rows = list(sparqlQuery.QueryCache(str(tmpdir)).query(dataset, query))
+    cache = sparqlQuery.QueryCache(str(tmpdir))
+    assert list(cache.query(dataset, query)) == rows
+    assert cache.hits == 1
+    assert len(rows) == 2
+
+
+def test_image_dataset():
+    """The label graphs of several images are queried together."""
+    dataset = rdflib.Dataset(default_union=True)
+    dataset.parse(data=NQUADS, format='nquads')
+    label = dataset.serialize(format='json-ld')
+
+    class FakeClient(client.scClient):
+        def get_label_image(self, imageID, resolve=True):
+            if imageID == 'plain':
+                return None
+            return json.dumps({self.label_prefix: label})
+
+    myclient = FakeClient(base_url="unix:///tmp/sc-test-docker.sock",
+                          version="1.21")
+    images = sparqlQuery.image_dataset(myclient, ['smart', 'plain'])
+    result = images.query("ASK { <urn:uuid:a> a prov:Activity }",
+                          initNs=sparqlQuery.NAMESPACES)
+    assert result.askAnswer
+
+
+def test_local_dataset(tmpdir, monkeypatch):
+    """Only a persistent store that exists is queried."""
+    monkeypatch.delenv('SC_GRAPH_STORE', raising=False)
+    with pytest.raises(ValueError) as error:
+        sparqlQuery.local_dataset()
+    assert 'SC_GRAPH_STORE' in str(error.value)
+    path = str(tmpdir.join('graph.sqlite'))
+    with pytest.raises(ValueError):
+        sparqlQuery.local_dataset('sqlite', path)
+    from sc import graphManager
+    registry = graphManager.VocabularyRegistry()
+    registry.open_store('sqlite', path)
+    registry.close_store()
+    dataset = sparqlQuery.local_dataset('sqlite', path)
+    assert len(dataset) == 0
+    dataset.close()
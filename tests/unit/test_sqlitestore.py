@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""Test code for the SQLite backed RDFlib store for SmartContainers."""
+import rdflib
+from rdflib import BNode, Literal, Namespace, URIRef, RDF, RDFS
+from sc import sqliteStore
+
+PROV = Namespace("http://www.w3.org/ns/prov#")
+graph_uri = URIRef("urn:uuid:6e1d8b6c-8b1e-4c1f-a8a7-2f1b8d7e5c11")
+person = URIRef("http://orcid.org/000-0003-4901-6059")
+
+
+def open_dataset(path, create=True):
+    dataset = rdflib.Dataset(store=sqliteStore.SQLiteStore(),
+                             default_union=True)
+    dataset.open(path, create=create)
+    return dataset
+
+
+def test_persistence(tmpdir):
+    """Quads written by one dataset are read back after reopening."""
+    path = str(tmpdir.join('graph.sqlite'))
+    dataset = open_dataset(path)
+    g = dataset.graph(graph_uri)
+    g.add((person, RDF.type, PROV.Person))
+    g.add((person, RDFS.label, Literal("Chuck Vardeman", lang="en")))
+    g.add((BNode("b1"), RDFS.label, Literal(4)))
+    dataset.close()
+
+    dataset = open_dataset(path, create=False)
+    assert len(dataset) == 3
+    assert len(dataset.graph(graph_uri)) == 3
+    assert (person, RDF.type, PROV.Person) in dataset
+    assert (BNode("b1"), RDFS.label, Literal(4)) in dataset
+    labels = list(dataset.objects(person, RDFS.label))
+    assert labels == [Literal("Chuck Vardeman", lang="en")]
+    assert graph_uri in [c.identifier for c in dataset.contexts()]
+    dataset.close()
+
+
+def test_remove_graph(tmpdir):
+    """Removing a named graph removes its triples only."""
+    dataset = open_dataset(str(tmpdir.join('graph.sqlite')))
+    dataset.graph(graph_uri).add((person, RDF.type, PROV.Person))
+    dataset.add((person, RDF.type, PROV.Agent))
+    dataset.remove_graph(graph_uri)
+    assert (person, RDF.type, PROV.Person) not in dataset
+    assert (person, RDF.type, PROV.Agent) in dataset
+    dataset.close()
+
+
+def test_registry_store(tmpdir):
+    """The registry builds and serializes against a persistent store."""
+    from sc import graphManager
+    path = str(tmpdir.join('graph.sqlite'))
+    registry = graphManager.VocabularyRegistry()
+    registry.open_store('sqlite', path)
+    registry.global_graph.graph(registry.graph_uri).add(
+        (person, RDF.type, PROV.Person))
+    registry.global_graph.commit()
+    assert 'Person' in registry.export_graph().serialize(format='turtle')
+    registry.close_store()
+    assert (person, RDF.type, PROV.Person) in open_dataset(path, False)